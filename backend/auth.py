@@ -1,6 +1,9 @@
 import msal
 import os
 import time
+import asyncio
+import logging
+import threading
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -13,10 +16,14 @@ CLIENT_SECRET = os.getenv("MS_GRAPH_CLIENT_SECRET", "").strip()
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 SCOPES = ["Tasks.ReadWrite", "User.Read"]
 
-print(f"DEBUG: AUTH_CONFIG -> CLIENT_ID: {CLIENT_ID}")
-print(f"DEBUG: AUTH_CONFIG -> TENANT_ID: {TENANT_ID}")
-print(f"DEBUG: AUTH_CONFIG -> AUTHORITY: {AUTHORITY}")
-print(f"DEBUG: AUTH_CONFIG -> HAS_SECRET: {bool(CLIENT_SECRET)}")
+logger = logging.getLogger("crud-planner")
+
+logger.debug(f"[AUTH] Config -> CLIENT_ID: {CLIENT_ID}, TENANT_ID: {TENANT_ID}, AUTHORITY: {AUTHORITY}, HAS_SECRET: {bool(CLIENT_SECRET)}")
+
+# Margen (s) antes de la expiración en el que se renueva el token en memoria
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+# Espera (s) para agrupar escrituras de token_cache.bin
+TOKEN_CACHE_SAVE_DELAY = float(os.getenv("TOKEN_CACHE_SAVE_DELAY", "5"))
 
 # Ruta absoluta para la caché de tokens
 CACHE_PATH = os.path.join(os.path.dirname(__file__), "token_cache.bin")
@@ -26,57 +33,135 @@ token_cache = msal.SerializableTokenCache()
 if os.path.exists(CACHE_PATH):
     try:
         token_cache.deserialize(open(CACHE_PATH, "r").read())
-        print(f"DEBUG: cache cargada de {CACHE_PATH}")
+        logger.debug(f"[AUTH] Caché cargada de {CACHE_PATH}")
     except Exception as e:
-        print(f"DEBUG: error cargando caché: {e}")
+        logger.warning(f"[AUTH] Error cargando la caché: {e}")
+
+_save_timer = None
+_save_lock = threading.Lock()
 
 def save_cache():
-    print(f"DEBUG: save_cache - state changed: {token_cache.has_state_changed}")
+    global _save_timer
+    with _save_lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+            _save_timer = None
+    logger.debug(f"[AUTH] save_cache - state changed: {token_cache.has_state_changed}")
     if token_cache.has_state_changed:
         try:
             with open(CACHE_PATH, "w") as f:
                 f.write(token_cache.serialize())
-            print(f"DEBUG: save_cache - successfully wrote {CACHE_PATH}")
+            token_cache.has_state_changed = False
+            logger.debug(f"[AUTH] save_cache - escrita {CACHE_PATH}")
         except Exception as e:
-            print(f"DEBUG: save_cache - ERROR writing file: {e}")
+            logger.error(f"[AUTH] save_cache - error escribiendo {CACHE_PATH}: {e}")
+
+def schedule_save():
+    # Debounce: varias renovaciones seguidas producen una sola escritura a disco
+    global _save_timer
+    if not token_cache.has_state_changed:
+        return
+    with _save_lock:
+        if _save_timer is None:
+            _save_timer = threading.Timer(TOKEN_CACHE_SAVE_DELAY, save_cache)
+            _save_timer.daemon = True
+            _save_timer.start()
+
+_msal_app = None
 
 def get_msal_app():
-    return msal.PublicClientApplication(
-        CLIENT_ID, 
-        authority=AUTHORITY,
-        token_cache=token_cache
-    )
+    # Una sola instancia por proceso (evita el discovery de la authority en cada llamada)
+    global _msal_app
+    if _msal_app is None:
+        _msal_app = msal.PublicClientApplication(
+            CLIENT_ID, 
+            authority=AUTHORITY,
+            token_cache=token_cache
+        )
+    return _msal_app
+
+def has_cached_account():
+    return bool(token_cache.find(msal.TokenCache.CredentialType.ACCOUNT))
 
 def init_device_flow():
     app = get_msal_app()
     flow = app.initiate_device_flow(scopes=SCOPES)
-    print(f"DEBUG: init_device_flow result: {flow}")
+    logger.debug(f"[AUTH] init_device_flow result: {flow}")
     if "user_code" not in flow:
         raise Exception(f"Fallo al iniciar el flujo de dispositivo: {flow.get('error_description', 'Error desconocido')}")
     return flow
 
 def complete_device_flow(flow):
     app = get_msal_app()
-    print(f"DEBUG: complete_device_flow calling for: {flow.get('user_code')}")
+    logger.debug(f"[AUTH] complete_device_flow para: {flow.get('user_code')}")
     result = app.acquire_token_by_device_flow(flow)
     if "error" in result:
-        print(f"DEBUG: complete_device_flow ERROR: {result.get('error')} - {result.get('error_description')}")
+        logger.warning(f"[AUTH] complete_device_flow ERROR: {result.get('error')} - {result.get('error_description')}")
     else:
-        print("DEBUG: complete_device_flow SUCCESS")
+        logger.debug("[AUTH] complete_device_flow OK")
+        token_holder.invalidate()
     save_cache()
     return result
 
+class TokenHolder:
+    """Access token en memoria, renovado una sola vez aunque haya llamadas concurrentes."""
+
+    def __init__(self, margin: int = TOKEN_REFRESH_MARGIN):
+        self.margin = margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._inflight = None
+
+    def _cached(self):
+        if self._token and time.time() < self._expires_at - self.margin:
+            return self._token
+        return None
+
+    def invalidate(self):
+        self._token = None
+        self._expires_at = 0.0
+
+    def refresh_blocking(self):
+        with self._lock:
+            token = self._cached()
+            if token:
+                return token
+            # Sin cuenta en la caché no hay nada que renovar: no se toca MSAL
+            if not has_cached_account():
+                return None
+            app = get_msal_app()
+            accounts = app.get_accounts()
+            logger.debug(f"[AUTH] Renovación del token: {len(accounts)} cuentas en caché")
+            if not accounts:
+                return None
+            # Intentar obtener token silenciosamente (usando refresh token si es necesario)
+            result = app.acquire_token_silent(SCOPES, account=accounts[0])
+            if not result or "access_token" not in result:
+                logger.debug("[AUTH] Renovación silenciosa del token fallida")
+                return None
+            logger.debug("[AUTH] Token renovado")
+            self._token = result["access_token"]
+            self._expires_at = time.time() + int(result.get("expires_in", 0))
+            schedule_save()
+            return self._token
+
+    async def get(self):
+        token = self._cached()
+        if token:
+            return token
+        loop = asyncio.get_running_loop()
+        task = self._inflight
+        if task is None or task.done() or task.get_loop() is not loop:
+            # MSAL es síncrono (red + disco): se ejecuta fuera del event loop
+            task = self._inflight = loop.create_task(asyncio.to_thread(self.refresh_blocking))
+        return await asyncio.shield(task)
+
+
+token_holder = TokenHolder()
+
 def get_access_token():
-    app = get_msal_app()
-    accounts = app.get_accounts()
-    print(f"DEBUG: get_access_token accounts found: {len(accounts)}")
-    if accounts:
-        # Intentar obtener token silenciosamente (usando refresh token si es necesario)
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if result:
-            print("DEBUG: get_access_token success")
-            save_cache()
-            return result.get("access_token")
-        else:
-            print("DEBUG: get_access_token silent acquisition failed")
-    return None
+    return token_holder._cached() or token_holder.refresh_blocking()
+
+async def get_access_token_async():
+    return await token_holder.get()
@@ -0,0 +1,89 @@
+"""Micro-benchmark de la serialización de listados de tareas (coste por cada 1.000 tareas).
+
+Compara la ruta anterior (validación con response_model + jsonable_encoder + json) con
+FastJSONResponse (orjson sobre filas ya construidas) y el tamaño con gzip/brotli.
+
+    cd backend && python benchmarks/bench_serialization.py [--tasks 5000] [--repeat 20]
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import http_encoding
+import schemas
+
+
+def make_rows(n: int) -> List[dict]:
+    return [{
+        "id": f"tarea-{i:06d}-AAAAAAAAAAAAAAAAAAAAAAAA",
+        "title": f"Tarea de ejemplo número {i}",
+        "percent_complete": (i * 7) % 101,
+        "bucket_id": f"bucket-{i % 40:03d}",
+        "plan_id": f"plan-{i % 5}",
+    } for i in range(n)]
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.tasks)
+    adapter = TypeAdapter(List[schemas.Task])
+
+    def validated_stdlib():
+        # Lo que hacía FastAPI con response_model=List[schemas.Task] y JSONResponse
+        models = adapter.validate_python(rows)
+        return json.dumps(jsonable_encoder(models), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def validated_pydantic():
+        return adapter.dump_json(adapter.validate_python(rows))
+
+    def trusted_fast():
+        return http_encoding.FastJSONResponse(rows).body
+
+    scenarios = [
+        ("response_model + json", validated_stdlib),
+        ("response_model + pydantic", validated_pydantic),
+        ("FastJSONResponse (orjson)" if http_encoding.orjson else "FastJSONResponse (json)", trusted_fast),
+    ]
+    per_k = 1000 / args.tasks
+    print(f"{args.tasks} tareas, mejor de {args.repeat} repeticiones (ms por 1.000 tareas)")
+    for name, fn in scenarios:
+        print(f"  {name:<28} {timed(fn, args.repeat) * 1000 * per_k:8.3f}")
+
+    body = trusted_fast()
+    print(f"\nTamaño del cuerpo: {len(body) / 1024:.1f} KiB")
+    for level in (1, 6, 9):
+        t = timed(lambda: gzip.compress(body, level), args.repeat)
+        print(f"  gzip -{level}: {len(gzip.compress(body, level)) / 1024:7.1f} KiB  {t * 1000 * per_k:6.3f} ms/1k")
+    if http_encoding.brotli is not None:
+        for quality in (1, 4, 11):
+            t = timed(lambda: http_encoding.brotli.compress(body, quality=quality), max(1, args.repeat // 4))
+            size = len(http_encoding.brotli.compress(body, quality=quality))
+            print(f"  br q{quality}:  {size / 1024:7.1f} KiB  {t * 1000 * per_k:6.3f} ms/1k")
+    else:
+        print("  brotli no instalado: solo gzip")
+
+
+if __name__ == "__main__":
+    main()
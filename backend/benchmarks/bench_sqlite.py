@@ -0,0 +1,88 @@
+"""Benchmark del almacén local SQLite: lecturas y escrituras concurrentes.
+
+Compara el perfil de fábrica (rollback journal, commit por escritura) con el perfil
+"tuned" (WAL, synchronous=NORMAL, caché, mmap) con y sin group commit.
+
+    cd backend && python benchmarks/bench_sqlite.py [--writers 16] [--readers 8] [--ops 100]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench_unused.db")
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import database
+import models
+
+
+async def scenario(path: str, profile: str, group_ms: float, writers: int, readers: int, ops: int) -> dict:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=writers + readers)
+    database.apply_sqlite_profile(engine.sync_engine, profile)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    committer = database.GroupCommitter(window_ms=group_ms, session_factory=sessions)
+
+    def insert(i):
+        def write(session):
+            session.add(models.Task(title=f"bench {i}", percent_complete=i % 101, bucket_id=1 + i % 50, plan_id=1))
+        return write
+
+    errors = 0
+
+    async def writer(w):
+        nonlocal errors
+        for i in range(ops):
+            try:
+                await committer.submit(insert(w * ops + i))
+            except Exception:
+                # "database is locked" cuando la espera supera busy_timeout
+                errors += 1
+
+    async def reader(r):
+        for i in range(ops):
+            async with sessions() as db:
+                query = select(models.Task).where(models.Task.bucket_id == 1 + (r + i) % 50)
+                (await db.scalars(query.order_by(models.Task.id).limit(50))).all()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(writer(w) for w in range(writers)), *(reader(r) for r in range(readers)))
+    elapsed = time.perf_counter() - t0
+    await engine.dispose()
+    return {
+        "elapsed": elapsed,
+        "writes_s": writers * ops / elapsed,
+        "reads_s": readers * ops / elapsed,
+        "errors": errors,
+    }
+
+
+async def main(args):
+    scenarios = [
+        ("default, commit por escritura", "default", 0),
+        (f"default, group commit {args.window}ms", "default", args.window),
+        ("tuned, commit por escritura", "tuned", 0),
+        (f"tuned, group commit {args.window}ms", "tuned", args.window),
+    ]
+    print(f"{args.writers} escritores × {args.ops} inserts, {args.readers} lectores × {args.ops} páginas")
+    print(f"{'escenario':<34}{'tiempo (s)':>12}{'escrituras/s':>15}{'lecturas/s':>13}{'errores':>10}")
+    for label, profile, window in scenarios:
+        with tempfile.TemporaryDirectory() as tmp:
+            r = await scenario(os.path.join(tmp, "bench.db"), profile, window, args.writers, args.readers, args.ops)
+        print(f"{label:<34}{r['elapsed']:>12.2f}{r['writes_s']:>15.0f}{r['reads_s']:>13.0f}{r['errors']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=100)
+    parser.add_argument("--window", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
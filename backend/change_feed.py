@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import AsyncIterator, Deque, List, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+import graph_client
+import models
+
+logger = logging.getLogger("crud-planner")
+
+# Eventos recordados para reanudar con Last-Event-ID (compartidos por todas las conexiones)
+CHANGE_FEED_HISTORY = int(os.getenv("CHANGE_FEED_HISTORY", "1000"))
+# Eventos pendientes por conexión; un cliente más lento se desconecta y reanuda desde su último id
+CHANGE_FEED_BUFFER = int(os.getenv("CHANGE_FEED_BUFFER", "256"))
+# Segundos sin eventos tras los que se envía un comentario de keep-alive
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", "15"))
+# Espera (ms) que el navegador aplica antes de reconectar
+CHANGE_FEED_RETRY_MS = int(os.getenv("CHANGE_FEED_RETRY_MS", "3000"))
+
+# Los ids son "<arranque>-<secuencia>": un id de otro arranque del servidor obliga a recargar
+BOOT_ID = format(int(time.time() * 1000), "x")
+
+
+class Subscriber:
+    def __init__(self, maxsize: int):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def push(self, item: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Se descarta lo pendiente y se cierra la conexión: el navegador reconecta con su
+            # Last-Event-ID y recupera lo perdido del histórico (o recarga si ya no está)
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class ChangeFeed:
+    def __init__(self, history: int = CHANGE_FEED_HISTORY, buffer: int = CHANGE_FEED_BUFFER):
+        self.buffer = buffer
+        self._history: Deque[dict] = deque(maxlen=history)
+        self._subscribers: Set[Subscriber] = set()
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publish(self, entity: str, op: str, data: dict, source: str = "local") -> dict:
+        """Registra un evento y lo entrega a las conexiones abiertas (se puede llamar desde cualquier hilo)."""
+        with self._lock:
+            self._seq += 1
+            item = {"seq": self._seq, "entity": entity, "op": op, "id": data.get("id"),
+                    "data": data, "source": source, "ts": time.time()}
+            self._history.append(item)
+            subscribers = list(self._subscribers)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for sub in subscribers:
+            if sub.loop is running:
+                sub.push(item)
+            elif not sub.loop.is_closed():
+                sub.loop.call_soon_threadsafe(sub.push, item)
+        return item
+
+    def since(self, last_event_id: Optional[str]) -> Optional[List[dict]]:
+        """Eventos posteriores a last_event_id; None si ya no se pueden reconstruir."""
+        boot, _, seq = (last_event_id or "").partition("-")
+        if boot != BOOT_ID or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._lock:
+            oldest = self._history[0]["seq"] if self._history else self._seq + 1
+            if seq < oldest - 1 or seq > self._seq:
+                return None
+            return [item for item in self._history if item["seq"] > seq]
+
+    def subscribe(self) -> Subscriber:
+        sub = Subscriber(self.buffer)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+feed = ChangeFeed()
+
+
+def format_event(item: dict) -> str:
+    payload = {k: item[k] for k in ("entity", "op", "id", "data", "source")}
+    return f"id: {BOOT_ID}-{item['seq']}\nevent: change\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+async def stream(last_event_id: Optional[str] = None, heartbeat: float = None) -> AsyncIterator[str]:
+    """Flujo SSE: histórico desde last_event_id, eventos en vivo y keep-alive."""
+    heartbeat = heartbeat or CHANGE_FEED_HEARTBEAT
+    # Suscribirse antes de leer el histórico: nada publicado entre medias se pierde
+    sub = feed.subscribe()
+    try:
+        yield f"retry: {CHANGE_FEED_RETRY_MS}\n\n"
+        last_seq = 0
+        if last_event_id:
+            missed = feed.since(last_event_id)
+            if missed is None:
+                # El cliente estuvo fuera demasiado tiempo (o el servidor se reinició)
+                yield "event: reset\ndata: {}\n\n"
+            else:
+                for item in missed:
+                    last_seq = item["seq"]
+                    yield format_event(item)
+        while True:
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if item is None:
+                logger.info("[FEED] Cliente lento desconectado (buffer lleno)")
+                return
+            if item["seq"] > last_seq:
+                last_seq = item["seq"]
+                yield format_event(item)
+    finally:
+        feed.unsubscribe(sub)
+
+
+# -----------------------------
+# Fuentes: BD (local y espejo de Graph) y escrituras en Graph
+# -----------------------------
+# modelo → (entidad, origen, columnas de datos → clave del evento)
+_TRACKED = {
+    models.Plan: ("plans", "local", {"name": "name"}),
+    models.Bucket: ("buckets", "local", {"name": "name", "plan_id": "plan_id"}),
+    models.Task: ("tasks", "local", {"title": "title", "percent_complete": "percent_complete",
+                                     "bucket_id": "bucket_id", "plan_id": "plan_id"}),
+    models.MirrorPlan: ("plans", "graph", {"title": "name"}),
+    models.MirrorBucket: ("buckets", "graph", {"name": "name", "plan_id": "plan_id"}),
+    models.MirrorTask: ("tasks", "graph", {"title": "title", "percent_complete": "percent_complete",
+                                           "bucket_id": "bucket_id", "plan_id": "plan_id"}),
+}
+_PENDING = "change_feed"
+
+
+def _row(obj, columns: dict) -> dict:
+    row = {"id": str(obj.id)}
+    for column, key in columns.items():
+        value = getattr(obj, column)
+        row[key] = str(value) if key.endswith("_id") and value is not None else value
+    return row
+
+
+def _changed(obj, columns: dict) -> bool:
+    # Los refrescos del espejo reescriben todas las filas: solo cuentan los datos visibles
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in columns)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session: Session, flush_context):
+    # Escrituras ya publicadas por _on_graph_write (el hook del espejo marca su sesión)
+    if session.info.get("change_feed") is False:
+        return
+    pending = session.info.setdefault(_PENDING, [])
+    for op, objects in (("created", session.new), ("updated", session.dirty), ("deleted", session.deleted)):
+        for obj in objects:
+            tracked = _TRACKED.get(type(obj))
+            if tracked is None or (op == "updated" and not _changed(obj, tracked[2])):
+                continue
+            entity, source, columns = tracked
+            pending.append((entity, op, {"id": str(obj.id)} if op == "deleted" else _row(obj, columns), source))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session):
+    for entity, op, data, source in session.info.pop(_PENDING, []):
+        feed.publish(entity, op, data, source)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session):
+    session.info.pop(_PENDING, None)
+
+
+_ENTITY_RE = re.compile(r"^/planner/(plans|buckets|tasks)(?:/([^/]+))?$")
+_GRAPH_FIELDS = {"title": "title", "name": "name", "percentComplete": "percent_complete",
+                 "bucketId": "bucket_id", "planId": "plan_id"}
+
+
+def _graph_row(kind: str, values: dict, entity_id: str = None) -> dict:
+    row = {"id": entity_id or values.get("id")}
+    for graph_key, key in _GRAPH_FIELDS.items():
+        if graph_key in values:
+            row["name" if kind == "plans" and key == "title" else key] = values[graph_key]
+    return row
+
+
+def _on_graph_write(method: str, endpoint: str, data: Optional[dict], result):
+    if method == "GET" or result is None:
+        return
+    match = _ENTITY_RE.match(endpoint)
+    if not match:
+        return
+    kind, entity_id = match.groups()
+    if method == "POST" and entity_id is None and isinstance(result, dict) and "id" in result:
+        feed.publish(kind, "created", _graph_row(kind, result), "graph")
+    elif method == "PATCH" and entity_id:
+        # Con Prefer: return=representation llega la entidad completa; si no, lo enviado
+        values = result if isinstance(result, dict) and result.get("id") else (data or {})
+        feed.publish(kind, "updated", _graph_row(kind, values, entity_id), "graph")
+    elif method == "DELETE" and entity_id:
+        feed.publish(kind, "deleted", {"id": entity_id}, "graph")
+
+
+graph_client.response_hooks.append(_on_graph_write)
@@ -1,28 +1,207 @@
 import os
-from sqlalchemy import create_engine
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 # Import absoluto
-from models import Base
+import migrations
 
 # Leer la URL de la base de datos desde la variable de entorno DATABASE_URL
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/postgres")
 
+# Ajustes del pool de conexiones (motores síncrono y asíncrono)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").strip().lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Perfil de SQLite: "tuned" (WAL, synchronous=NORMAL, caché y mmap) o "default" (ajustes de fábrica)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned").strip().lower()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Ventana (ms) para agrupar escrituras locales concurrentes en una sola transacción; 0 = commit por escritura
+DB_GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "5"))
+
+logger = logging.getLogger("crud-planner")
+
+
+def _async_url(url: str) -> str:
+    # Mismo destino, pero con driver asíncrono (aiosqlite / asyncpg)
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if ":memory:" not in url:
+        kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return kwargs
+
+
+def sqlite_pragmas(profile: str = None) -> List[Tuple[str, Any]]:
+    if (profile or SQLITE_PROFILE) != "tuned":
+        return [("busy_timeout", SQLITE_BUSY_TIMEOUT_MS)]
+    return [
+        ("journal_mode", "WAL"),            # lectores y escritor no se bloquean entre sí
+        ("synchronous", SQLITE_SYNCHRONOUS),  # en WAL, NORMAL solo sincroniza en checkpoints
+        ("cache_size", -SQLITE_CACHE_SIZE_KB),
+        ("mmap_size", SQLITE_MMAP_SIZE),
+        ("temp_store", "MEMORY"),
+        ("busy_timeout", SQLITE_BUSY_TIMEOUT_MS),
+    ]
+
+
+def apply_sqlite_profile(engine, profile: str = None):
+    """Aplica los PRAGMA en cada conexión nueva del pool (son por conexión, no por archivo)."""
+    pragmas = sqlite_pragmas(profile)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
 # Si es SQLite, agregar connect_args
 if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, **_engine_kwargs(DATABASE_URL))
 else:
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL))
+
+# Motor asíncrono para los handlers de FastAPI y GraphQL (no bloquea el event loop)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL))
+
+if DATABASE_URL.startswith("sqlite"):
+    apply_sqlite_profile(engine)
+    apply_sqlite_profile(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # Esquema versionado (tabla schema_migrations): crea tablas e índices que falten
+    return migrations.upgrade(engine)
 
 
 def get_db():
+    # Sesión síncrona: scripts y utilidades fuera del event loop
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# -----------------------------
+# Escrituras locales agrupadas (group commit)
+# -----------------------------
+class GroupCommitter:
+    """Reúne las escrituras locales que llegan dentro de una ventana corta en una sola transacción.
+
+    Cada escritura es una función síncrona fn(session). Si alguna falla, el grupo se repite con
+    un SAVEPOINT por escritura: solo esa petición recibe la excepción y el resto se confirma igual.
+    """
+
+    def __init__(self, window_ms: float = DB_GROUP_COMMIT_MS, max_size: int = 200, session_factory=None):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.session_factory = session_factory
+        self._pending: List[Tuple[Callable, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        # Referencias a los commits en curso: el loop solo guarda referencias débiles a las tareas
+        self._commits: Set[asyncio.Task] = set()
+
+    async def submit(self, fn: Callable) -> Any:
+        factory = self.session_factory or AsyncSessionLocal
+        if self.window <= 0:
+            async with factory() as db:
+                result = await db.run_sync(fn)
+                await db.commit()
+                return result
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((fn, fut))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.create_task(self._flush_later())
+        return await fut
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.get_running_loop().create_task(self._commit(pending))
+            self._commits.add(task)
+            task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, pending: List[Tuple[Callable, asyncio.Future]]):
+        factory = self.session_factory or AsyncSessionLocal
+
+        def apply_all(session):
+            return [(True, fn(session)) for fn, _ in pending]
+
+        def apply_isolated(session):
+            # Solo si el grupo falló: cada escritura en su SAVEPOINT para aislar la que da error
+            outcomes = []
+            for fn, _ in pending:
+                savepoint = session.begin_nested()
+                try:
+                    outcomes.append((True, fn(session)))
+                    savepoint.commit()
+                except Exception as e:
+                    savepoint.rollback()
+                    outcomes.append((False, e))
+            return outcomes
+
+        try:
+            async with factory() as db:
+                try:
+                    outcomes = await db.run_sync(apply_all)
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    outcomes = await db.run_sync(apply_isolated)
+                    await db.commit()
+        except Exception as e:
+            logger.error(f"[DB] Group commit de {len(pending)} escrituras falló: {e}")
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), (ok, value) in zip(pending, outcomes):
+            if fut.done():
+                continue
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+
+
+group_commit = GroupCommitter()
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import database
+import models
+from graph_client import graph_call
+
+logger = logging.getLogger("crud-planner")
+
+# El delta de Planner solo existe en el endpoint beta de Graph
+PLANNER_DELTA_URL = "https://graph.microsoft.com/beta/me/planner/all/delta"
+# Usar el delta para refrescar el espejo en lugar de recargar colecciones completas
+DELTA_ENABLED = os.getenv("PLANNER_DELTA", "false").strip().lower() in ("1", "true", "yes")
+# Intervalo (s) del bucle en segundo plano; 0 lo desactiva
+DELTA_INTERVAL = float(os.getenv("PLANNER_DELTA_INTERVAL", "0"))
+# Límite de páginas por pasada (protección ante un deltaLink que no converge)
+DELTA_MAX_PAGES = int(os.getenv("PLANNER_DELTA_MAX_PAGES", "200"))
+
+DELTA_SCOPE = "me"
+# Scope del espejo que el delta no puede mantener (assigned_to_me)
+MY_TASKS_SCOPE = "tasks:me"
+
+_TYPES = {
+    "#microsoft.graph.plannerPlan": (models.MirrorPlan, {"title": "title"}),
+    "#microsoft.graph.plannerBucket": (models.MirrorBucket, {"name": "name", "planId": "plan_id"}),
+    "#microsoft.graph.plannerTask": (
+        models.MirrorTask,
+        {"title": "title", "percentComplete": "percent_complete", "bucketId": "bucket_id", "planId": "plan_id"},
+    ),
+}
+
+_inflight: Optional[asyncio.Task] = None
+
+
+def _apply(db: Session, item: dict, now: float, stats: dict, added: dict) -> None:
+    entry = _TYPES.get(item.get("@odata.type"))
+    if entry is None or "id" not in item:
+        return
+    model, fields = entry
+    # Sin autoflush, db.get no ve las filas añadidas antes en la misma pasada: una tarea que
+    # aparece en dos páginas del delta se insertaría dos veces
+    key = (model, item["id"])
+    obj = added.get(key) or db.get(model, item["id"])
+    if "@removed" in item:
+        if obj is not None:
+            if key in added:
+                db.expunge(added.pop(key))
+            else:
+                db.delete(obj)
+            stats["removed"] += 1
+        return
+    if obj is None:
+        obj = model(id=item["id"])
+        db.add(obj)
+        added[key] = obj
+    # El delta solo trae las propiedades que cambiaron
+    for graph_key, column in fields.items():
+        if graph_key in item:
+            setattr(obj, column, item[graph_key] if item[graph_key] is not None else "")
+    if "@odata.etag" in item:
+        obj.etag = item["@odata.etag"]
+    obj.synced_at = now
+    stats[model.__tablename__] += 1
+
+
+def _apply_page(db: Session, items: list, now: float, stats: dict, added: dict) -> None:
+    for item in items:
+        _apply(db, item, now, stats, added)
+
+
+async def _fetch_pages(db: AsyncSession, url: str, stats: dict) -> Optional[str]:
+    now = time.time()
+    added = {}
+    for _ in range(DELTA_MAX_PAGES):
+        data = await graph_call("GET", url)
+        if not data or "value" not in data:
+            return None
+        await db.run_sync(_apply_page, data["value"], now, stats, added)
+        if data.get("@odata.deltaLink"):
+            return data["@odata.deltaLink"]
+        url = data.get("@odata.nextLink")
+        if not url:
+            return None
+    logger.warning(f"[DELTA] Se alcanzó el máximo de {DELTA_MAX_PAGES} páginas sin deltaLink")
+    return None
+
+
+async def _sync(db: AsyncSession) -> Optional[dict]:
+    state = await db.get(models.MirrorDelta, DELTA_SCOPE)
+    stats = {"mirror_plans": 0, "mirror_buckets": 0, "mirror_tasks": 0, "removed": 0, "full": False}
+
+    delta_link = None
+    if state is not None and state.delta_link:
+        delta_link = await _fetch_pages(db, state.delta_link, stats)
+        if delta_link is None:
+            # deltaLink caducado o rechazado: descartar cambios parciales y empezar de cero
+            logger.warning("[DELTA] deltaLink inválido, se reinicia la sincronización completa")
+            await db.rollback()
+            stats = {key: 0 for key in stats}
+    if delta_link is None:
+        stats["full"] = True
+        delta_link = await _fetch_pages(db, PLANNER_DELTA_URL, stats)
+        if delta_link is None:
+            await db.rollback()
+            return None
+
+    now = time.time()
+    state = await db.get(models.MirrorDelta, DELTA_SCOPE)
+    if state is None:
+        db.add(models.MirrorDelta(scope=DELTA_SCOPE, delta_link=delta_link, updated_at=now))
+    else:
+        state.delta_link = delta_link
+        state.updated_at = now
+    # El espejo queda al día: las colecciones conocidas se marcan como frescas. "tasks:me" no:
+    # el delta no dice qué tareas están asignadas al usuario y la sigue refrescando la carga completa
+    for scope in (await db.scalars(select(models.MirrorScope).where(models.MirrorScope.scope != MY_TASKS_SCOPE))).all():
+        scope.refreshed_at = now
+    await db.commit()
+    logger.info(f"[DELTA] Cambios aplicados: {stats}")
+    return stats
+
+
+async def sync_delta(db: AsyncSession = None) -> Optional[dict]:
+    """Aplica al espejo los cambios de Planner desde el último deltaLink.
+
+    Las llamadas concurrentes comparten una misma pasada. Devuelve None si Graph no respondió.
+    """
+    global _inflight
+    loop = asyncio.get_running_loop()
+    if _inflight is not None and not _inflight.done() and _inflight.get_loop() is loop:
+        return await asyncio.shield(_inflight)
+
+    async def run():
+        if db is not None:
+            return await _sync(db)
+        async with database.AsyncSessionLocal() as session:
+            return await _sync(session)
+
+    _inflight = loop.create_task(run())
+    return await asyncio.shield(_inflight)
+
+
+async def reset_delta(db: AsyncSession) -> None:
+    state = await db.get(models.MirrorDelta, DELTA_SCOPE)
+    if state is not None:
+        await db.delete(state)
+        await db.commit()
+
+
+async def run_forever(interval: float = None):
+    interval = interval or DELTA_INTERVAL
+    logger.info(f"[DELTA] Bucle incremental cada {interval}s")
+    while True:
+        try:
+            await sync_delta()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[DELTA] Pasada fallida: {e}")
+        await asyncio.sleep(interval)
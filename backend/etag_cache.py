@@ -0,0 +1,195 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+import graph_client
+from graph_batch import BatchRequest, batch_call, get_many, graph_call_batched
+from graph_client import graph_request
+
+logger = logging.getLogger("crud-planner")
+
+# Número máximo de ETags recordados (LRU)
+GRAPH_ETAG_CACHE_SIZE = int(os.getenv("GRAPH_ETAG_CACHE_SIZE", "5000"))
+
+KINDS = ("plans", "buckets", "tasks")
+_TYPES = {
+    "#microsoft.graph.plannerPlan": "plans",
+    "#microsoft.graph.plannerBucket": "buckets",
+    "#microsoft.graph.plannerTask": "tasks",
+}
+
+
+class ETagCache:
+    """LRU acotado de (tipo, id) → @odata.etag."""
+
+    def __init__(self, maxsize: int = GRAPH_ETAG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, entity_id: str) -> Optional[str]:
+        with self._lock:
+            etag = self._data.get((kind, entity_id))
+            if etag is not None:
+                self._data.move_to_end((kind, entity_id))
+            return etag
+
+    def put(self, kind: str, entity_id: str, etag: str):
+        with self._lock:
+            self._data[(kind, entity_id)] = etag
+            self._data.move_to_end((kind, entity_id))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def forget(self, kind: str, entity_id: str):
+        with self._lock:
+            self._data.pop((kind, entity_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+etags = ETagCache()
+
+
+def _segments(endpoint: str):
+    path = endpoint.split("?", 1)[0]
+    for prefix in ("https://graph.microsoft.com/v1.0", "https://graph.microsoft.com/beta"):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    return [s for s in path.split("/") if s]
+
+
+def _on_graph_response(method: str, endpoint: str, data: Optional[dict], result: Any):
+    segments = _segments(endpoint)
+    # /planner/{tipo}/{id}: lectura, alta o escritura de una entidad concreta
+    entity = None
+    if len(segments) >= 2 and segments[-2] in KINDS:
+        entity = (segments[-2], segments[-1])
+
+    if method == "DELETE":
+        if entity:
+            etags.forget(*entity)
+        return
+    if not isinstance(result, dict):
+        return
+
+    if isinstance(result.get("value"), list):
+        kind = segments[-1] if segments and segments[-1] in KINDS else None
+        for item in result["value"]:
+            item_kind = _TYPES.get(item.get("@odata.type"), kind)
+            if item_kind and item.get("id") and item.get("@odata.etag"):
+                etags.put(item_kind, item["id"], item["@odata.etag"])
+        return
+
+    kind = entity[0] if entity else (segments[-1] if segments and segments[-1] in KINDS else None)
+    entity_id = result.get("id") or (entity[1] if entity else None)
+    if not kind or not entity_id:
+        return
+    if result.get("@odata.etag"):
+        etags.put(kind, entity_id, result["@odata.etag"])
+    elif method == "PATCH":
+        # Escritura sin representación: el ETag que teníamos ya no es válido
+        etags.forget(kind, entity_id)
+
+
+graph_client.response_hooks.append(_on_graph_response)
+
+
+class WriteResult(NamedTuple):
+    status: Optional[int]
+    data: Any
+    etag: Optional[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and self.status < 400
+
+
+async def _fetch_etag(kind: str, entity_id: str) -> Optional[str]:
+    logger.info(f"[ETAG] Obteniendo ETag de {kind}/{entity_id} desde Graph...")
+    # Las lecturas de escrituras concurrentes sin ETag en caché viajan juntas en un /$batch
+    info = await graph_call_batched("GET", f"/planner/{kind}/{entity_id}")
+    return info.get("@odata.etag") if info else None
+
+
+async def conditional_write(kind: str, entity_id: str, method: str, data: dict = None, if_match: str = None) -> WriteResult:
+    """PATCH/DELETE con If-Match sin el GET previo cuando el ETag ya está en caché.
+
+    Si el ETag venía de la caché y Graph responde 412, se relee una vez y se reintenta;
+    un If-Match enviado por el cliente se respeta tal cual (el 412 es un conflicto real).
+    """
+    endpoint = f"/planner/{kind}/{entity_id}"
+    etag = if_match or etags.get(kind, entity_id)
+    from_cache = not if_match and etag is not None
+    if etag is None:
+        etag = await _fetch_etag(kind, entity_id)
+
+    status, result = await graph_request(method, endpoint, data=data, etag=etag)
+    if status == 412 and from_cache:
+        logger.info(f"[ETAG] ETag en caché obsoleto para {kind}/{entity_id}, releyendo...")
+        etags.forget(kind, entity_id)
+        etag = await _fetch_etag(kind, entity_id)
+        if etag:
+            status, result = await graph_request(method, endpoint, data=data, etag=etag)
+    return WriteResult(status, result, etags.get(kind, entity_id))
+
+
+async def _fetch_etags(kind: str, entity_ids: Sequence[str]) -> List[Optional[str]]:
+    logger.info(f"[ETAG] Obteniendo {len(entity_ids)} ETags de {kind} desde Graph...")
+    infos = await get_many([f"/planner/{kind}/{entity_id}" for entity_id in entity_ids])
+    return [info.get("@odata.etag") if info else None for info in infos]
+
+
+async def conditional_write_many(kind: str, method: str,
+                                 items: Sequence[Tuple[str, Optional[dict], Optional[str]]]) -> List[WriteResult]:
+    """Versión masiva de conditional_write: items = [(id, data, if_match), ...].
+
+    Los ETags que faltan se leen en un solo /$batch, las escrituras viajan en /$batch
+    y solo los 412 con ETag de caché se releen y reintentan. Un resultado por item, en orden.
+    """
+    if not items:
+        return []
+    if graph_client.breaker.is_open() or await graph_client.auth_headers() is None:
+        logger.warning(f"[ETAG] {len(items)} escrituras en {kind} — Graph no disponible o sin token, skipping")
+        return [WriteResult(None, None, None) for _ in items]
+
+    ids = [entity_id for entity_id, _, _ in items]
+    tags = [if_match or etags.get(kind, entity_id) for entity_id, _, if_match in items]
+    from_cache = [not if_match and tag is not None for (_, _, if_match), tag in zip(items, tags)]
+    missing = [i for i, tag in enumerate(tags) if tag is None]
+    if missing:
+        for i, tag in zip(missing, await _fetch_etags(kind, [ids[i] for i in missing])):
+            tags[i] = tag
+
+    results: List[WriteResult] = [WriteResult(404, None, None) for _ in items]
+
+    async def send(indices: List[int]):
+        # Sin ETag no hay entidad que escribir: se informa 404 sin llamar a Graph
+        for i in indices:
+            if tags[i] is None:
+                results[i] = WriteResult(404, None, None)
+        indices = [i for i in indices if tags[i] is not None]
+        batch = await batch_call([BatchRequest(method, f"/planner/{kind}/{ids[i]}", items[i][1], tags[i]) for i in indices])
+        for i, res in zip(indices, batch):
+            if res is None:
+                results[i] = WriteResult(None, None, None)
+            else:
+                results[i] = WriteResult(res.status, res.value(), etags.get(kind, ids[i]))
+
+    await send(list(range(len(items))))
+    stale = [i for i, res in enumerate(results) if res.status == 412 and from_cache[i]]
+    if stale:
+        logger.info(f"[ETAG] {len(stale)} ETags en caché obsoletos para {kind}, releyendo...")
+        for i in stale:
+            etags.forget(kind, ids[i])
+        for i, tag in zip(stale, await _fetch_etags(kind, [ids[i] for i in stale])):
+            tags[i] = tag
+        await send(stale)
+    return results
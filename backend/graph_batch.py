@@ -0,0 +1,241 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence, Set, Tuple
+
+import httpx
+
+import graph_client
+from graph_client import fan_out
+
+logger = logging.getLogger("crud-planner")
+
+# Graph acepta como máximo 20 sub-peticiones por llamada a /$batch
+GRAPH_BATCH_MAX = 20
+GRAPH_BATCH_ENABLED = os.getenv("GRAPH_BATCH_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+GRAPH_BATCH_WINDOW_MS = float(os.getenv("GRAPH_BATCH_WINDOW_MS", "10"))
+
+
+@dataclass
+class BatchRequest:
+    method: str
+    endpoint: str
+    data: Optional[dict] = None
+    etag: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    status: int
+    body: Any = None
+    headers: dict = field(default_factory=dict)
+
+    @property
+    def etag(self) -> Optional[str]:
+        if isinstance(self.body, dict) and self.body.get("@odata.etag"):
+            return self.body["@odata.etag"]
+        return self.headers.get("ETag") or self.headers.get("etag")
+
+    @property
+    def precondition_failed(self) -> bool:
+        return self.status == 412
+
+    def value(self):
+        """Traduce el resultado a la misma forma que devuelve graph_call."""
+        if self.status >= 400:
+            return None
+        if self.status == 204 or self.body is None:
+            return {"ok": True}
+        if isinstance(self.body, dict) and "@odata.etag" not in self.body and self.etag:
+            return {**self.body, "@odata.etag": self.etag}
+        return self.body
+
+
+def _log_result(req: BatchRequest, result: BatchResult):
+    if result.status == 412:
+        logger.warning(f"[BATCH] 412 Precondition Failed — ETag mismatch: {req.endpoint}")
+    elif result.status >= 400:
+        logger.error(f"[BATCH] {result.status} Error on {req.endpoint}: {str(result.body)[:200]}")
+
+
+async def _send_single(req: BatchRequest, headers: dict) -> BatchResult:
+    if req.etag:
+        headers = {**headers, "If-Match": req.etag}
+    if req.method in ("PATCH", "POST"):
+        headers = {**headers, "Prefer": "return=representation"}
+    res = await graph_client.send_request(req.method, req.endpoint, headers=headers, json=req.data)
+    body = None
+    if res.status_code != 204 and res.content:
+        try:
+            body = res.json()
+        except ValueError:
+            body = res.text
+    return BatchResult(status=res.status_code, body=body, headers=dict(res.headers))
+
+
+async def _send_chunk(chunk: Sequence[BatchRequest], headers: dict) -> List[BatchResult]:
+    if len(chunk) == 1:
+        return [await _send_single(chunk[0], headers)]
+
+    payload = []
+    for i, req in enumerate(chunk):
+        item = {"id": str(i), "method": req.method, "url": req.endpoint}
+        item_headers = {}
+        if req.etag:
+            item_headers["If-Match"] = req.etag
+        if req.data is not None:
+            item["body"] = req.data
+            item_headers["Content-Type"] = "application/json"
+        if req.method in ("PATCH", "POST"):
+            item_headers["Prefer"] = "return=representation"
+        if item_headers:
+            item["headers"] = item_headers
+        payload.append(item)
+
+    res = await graph_client.send_request("POST", "/$batch", weight=len(chunk), headers=headers, json={"requests": payload})
+    if res.status_code >= 400:
+        logger.error(f"[BATCH] /$batch → {res.status_code}: {res.text[:200]}")
+        return [BatchResult(status=res.status_code, body=None) for _ in chunk]
+
+    # Graph no garantiza el orden de las respuestas: se reordenan por id
+    by_id = {r.get("id"): r for r in res.json().get("responses", [])}
+    results = []
+    for i in range(len(chunk)):
+        r = by_id.get(str(i))
+        if r is None:
+            results.append(BatchResult(status=502, body=None))
+        else:
+            results.append(BatchResult(status=r.get("status", 500), body=r.get("body"), headers=r.get("headers") or {}))
+    logger.info(f"[BATCH] /$batch → {len(chunk)} sub-peticiones en una sola llamada")
+    return results
+
+
+async def _send_all(requests: Sequence[BatchRequest], headers: dict) -> List[BatchResult]:
+    chunks = [requests[i:i + GRAPH_BATCH_MAX] for i in range(0, len(requests), GRAPH_BATCH_MAX)]
+    chunk_results = await fan_out(chunks, lambda c: _send_chunk(c, headers))
+    return [r for chunk in chunk_results for r in chunk]
+
+
+async def batch_call(requests: Sequence[BatchRequest]) -> List[Optional[BatchResult]]:
+    """Envía una lista de peticiones independientes en bloques de 20 vía /$batch.
+
+    Devuelve un BatchResult por petición, en el mismo orden; None si no hay token.
+    """
+    if not requests:
+        return []
+    headers = await graph_client.auth_headers()
+    if headers is None:
+        logger.warning(f"[BATCH] {len(requests)} peticiones — No access token, skipping")
+        return [None] * len(requests)
+
+    try:
+        results = await _send_all(requests, headers)
+    except (graph_client.CircuitOpenError, httpx.TransportError) as e:
+        logger.warning(f"[BATCH] {len(requests)} peticiones — Graph no disponible ({e!r}), skipping")
+        return [None] * len(requests)
+    # Sub-peticiones con 429/503/504 dentro del lote: se reenvían solo esas
+    for attempt in range(graph_client.GRAPH_MAX_RETRIES):
+        pending = [i for i, r in enumerate(results) if r.status in graph_client.RETRY_STATUSES]
+        if not pending:
+            break
+        delay = max(graph_client.backoff_delay(attempt, results[i].headers) for i in pending)
+        if delay > graph_client.GRAPH_RETRY_MAX:
+            break
+        logger.warning(f"[BATCH] {len(pending)} sub-peticiones con throttling — reintento {attempt + 1} en {delay:.2f}s")
+        graph_client.stats["throttled"] += len(pending)
+        graph_client.stats["retries"] += len(pending)
+        graph_client.stats["throttled_seconds"] += delay
+        await asyncio.sleep(delay)
+        try:
+            retried = await _send_all([requests[i] for i in pending], headers)
+        except (graph_client.CircuitOpenError, httpx.TransportError):
+            break
+        for i, result in zip(pending, retried):
+            results[i] = result
+    for req, result in zip(requests, results):
+        _log_result(req, result)
+        if result.status < 400:
+            await graph_client.notify_response(req.method, req.endpoint, req.data, result.value())
+    return results
+
+
+async def get_many(endpoints: Sequence[str]) -> List[Optional[dict]]:
+    """GET de varios endpoints; cada elemento tiene la forma de graph_call (dict o None)."""
+    if not GRAPH_BATCH_ENABLED:
+        return await fan_out(endpoints, graph_client.get_all)
+    results = await batch_call([BatchRequest("GET", e) for e in endpoints])
+    values = [r.value() if r is not None else None for r in results]
+    # Las colecciones con más de una página se completan siguiendo @odata.nextLink
+    paged = [i for i, v in enumerate(values) if isinstance(v, dict) and v.get("@odata.nextLink")]
+    if paged:
+        full = await fan_out(paged, lambda i: graph_client.get_all(endpoints[i], first_page=values[i]))
+        for i, value in zip(paged, full):
+            values[i] = value
+    return values
+
+
+class GraphBatcher:
+    """Agrupa las peticiones emitidas dentro de una ventana corta en llamadas /$batch."""
+
+    def __init__(self, window_ms: float = GRAPH_BATCH_WINDOW_MS, max_size: int = GRAPH_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._pending: List[Tuple[BatchRequest, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        # Referencias a los envíos en curso: el loop solo guarda referencias débiles a las tareas
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def submit(self, req: BatchRequest) -> Optional[BatchResult]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((req, fut))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.create_task(self._flush_later())
+        return await fut
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.get_running_loop().create_task(self._dispatch(pending))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def close(self):
+        """Envía lo que quede en la ventana y espera los /$batch en curso (antes de cerrar el cliente)."""
+        self._flush()
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+
+    async def _dispatch(self, pending: List[Tuple[BatchRequest, asyncio.Future]]):
+        try:
+            results = await batch_call([req for req, _ in pending])
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), result in zip(pending, results):
+            if not fut.done():
+                fut.set_result(result)
+
+
+batcher = GraphBatcher()
+
+
+async def graph_call_batched(method: str, endpoint: str, data: dict = None, etag: str = None):
+    """Igual que graph_call, pero la petición viaja en el próximo /$batch."""
+    if not GRAPH_BATCH_ENABLED:
+        return await graph_client.graph_call(method, endpoint, data=data, etag=etag)
+    result = await batcher.submit(BatchRequest(method, endpoint, data, etag))
+    return result.value() if result is not None else None
@@ -0,0 +1,420 @@
+import os
+import time
+import random
+import asyncio
+import inspect
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+import auth
+
+logger = logging.getLogger("crud-planner")
+
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+
+# ─── Configuración del pool HTTP hacia Microsoft Graph ──────────
+GRAPH_HTTP2 = os.getenv("GRAPH_HTTP2", "true").strip().lower() in ("1", "true", "yes")
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "20"))
+GRAPH_MAX_KEEPALIVE = int(os.getenv("GRAPH_MAX_KEEPALIVE", "10"))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "60"))
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "20"))
+GRAPH_WRITE_TIMEOUT = float(os.getenv("GRAPH_WRITE_TIMEOUT", "10"))
+GRAPH_POOL_TIMEOUT = float(os.getenv("GRAPH_POOL_TIMEOUT", "5"))
+# Peticiones simultáneas permitidas en cada nivel de fan-out (planes → buckets → tareas)
+GRAPH_FANOUT_CONCURRENCY = int(os.getenv("GRAPH_FANOUT_CONCURRENCY", "8"))
+# Tope de páginas @odata.nextLink por colección
+GRAPH_MAX_PAGES = int(os.getenv("GRAPH_MAX_PAGES", "500"))
+
+# Reintentos ante throttling (429) o indisponibilidad (503/504)
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+GRAPH_RETRY_BASE = float(os.getenv("GRAPH_RETRY_BASE", "0.5"))
+# Espera máxima por reintento; un Retry-After mayor no se espera y se devuelve el error
+GRAPH_RETRY_MAX = float(os.getenv("GRAPH_RETRY_MAX", "30"))
+# Limitador local (peticiones/s) por tenant y por app; 0 lo desactiva
+GRAPH_RATE_TENANT = float(os.getenv("GRAPH_RATE_TENANT", "20"))
+GRAPH_RATE_APP = float(os.getenv("GRAPH_RATE_APP", "50"))
+# Segundos de ráfaga acumulables en cada cubeta
+GRAPH_RATE_BURST = float(os.getenv("GRAPH_RATE_BURST", "2"))
+
+RETRY_STATUSES = (429, 503, 504)
+
+# Circuit breaker: fallos consecutivos (5xx, timeouts, errores de red) antes de abrir el circuito
+GRAPH_BREAKER_THRESHOLD = int(os.getenv("GRAPH_BREAKER_THRESHOLD", "5"))
+# Segundos con el circuito abierto antes de dejar pasar una petición de prueba
+GRAPH_BREAKER_COOLDOWN = float(os.getenv("GRAPH_BREAKER_COOLDOWN", "30"))
+
+# Observadores de respuestas exitosas de Graph: hook(method, endpoint, data, result); si el hook
+# es una corrutina se espera antes de devolver la respuesta (p. ej. el espejo en la BD async)
+response_hooks: List[Callable[[str, str, Optional[dict], Any], Any]] = []
+
+# Cliente compartido durante toda la vida de la app (creado en startup, cerrado en shutdown)
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    http2 = GRAPH_HTTP2 and _http2_available()
+    if GRAPH_HTTP2 and not http2:
+        logger.warning("[GRAPH] Paquete 'h2' no instalado — usando HTTP/1.1 con keep-alive")
+    return httpx.AsyncClient(
+        base_url=GRAPH_BASE,
+        http2=http2,
+        transport=transport,
+        limits=httpx.Limits(
+            max_connections=GRAPH_MAX_CONNECTIONS,
+            max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+            keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=GRAPH_CONNECT_TIMEOUT,
+            read=GRAPH_READ_TIMEOUT,
+            write=GRAPH_WRITE_TIMEOUT,
+            pool=GRAPH_POOL_TIMEOUT,
+        ),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+async def start_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = build_client(transport)
+    logger.info(f"[GRAPH] Cliente compartido listo (max_connections={GRAPH_MAX_CONNECTIONS})")
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("[GRAPH] Cliente compartido cerrado")
+
+
+def get_client() -> httpx.AsyncClient:
+    # Fuera del ciclo de vida de la app (scripts, tests) se crea bajo demanda
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_client()
+    return _client
+
+
+async def notify_response(method: str, endpoint: str, data: Optional[dict], result: Any):
+    for hook in response_hooks:
+        try:
+            outcome = hook(method, endpoint, data, result)
+            if inspect.isawaitable(outcome):
+                await outcome
+        except Exception as e:
+            logger.warning(f"[GRAPH] Hook {getattr(hook, '__name__', hook)} falló: {e}")
+
+
+# -----------------------------
+# Throttling: limitador local y reintentos
+# -----------------------------
+class TokenBucket:
+    """Cubeta de tokens: `rate` peticiones/s con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, n: int = 1) -> float:
+        """Consume n tokens esperando lo necesario; devuelve los segundos esperados."""
+        if self.rate <= 0:
+            return 0.0
+        n = min(n, self.capacity)
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return waited
+            delay = (n - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+# Contadores expuestos en GET /graph/stats
+stats = {
+    "requests": 0,
+    "retries": 0,
+    "throttled": 0,
+    "throttled_seconds": 0.0,
+    "limiter_wait_seconds": 0.0,
+}
+
+
+def _bucket(key: str, rate: float) -> TokenBucket:
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = TokenBucket(rate, rate * GRAPH_RATE_BURST)
+    return bucket
+
+
+async def throttle(n: int = 1):
+    """Espera turno en las cubetas del tenant y de la app (un /$batch cuenta por sus sub-peticiones)."""
+    waited = await _bucket(f"tenant:{auth.TENANT_ID}", GRAPH_RATE_TENANT).acquire(n)
+    waited += await _bucket(f"app:{auth.CLIENT_ID}", GRAPH_RATE_APP).acquire(n)
+    stats["limiter_wait_seconds"] += waited
+
+
+def retry_after(headers) -> Optional[float]:
+    value = (headers or {}).get("Retry-After") or (headers or {}).get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, headers=None) -> float:
+    """Retry-After si Graph lo indica; si no, backoff exponencial con jitter."""
+    delay = retry_after(headers)
+    if delay is None:
+        delay = min(GRAPH_RETRY_MAX, GRAPH_RETRY_BASE * (2 ** attempt)) * random.uniform(0.5, 1.0)
+    return delay
+
+
+class CircuitOpenError(Exception):
+    """Graph se considera caído: la petición no se envía."""
+
+
+class CircuitBreaker:
+    """closed → open tras `threshold` fallos seguidos; open → half_open pasado `cooldown`.
+
+    En half_open solo viaja una petición de prueba: si va bien se cierra, si falla se reabre.
+    """
+
+    def __init__(self, threshold: int = GRAPH_BREAKER_THRESHOLD, cooldown: float = GRAPH_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def is_open(self) -> bool:
+        """Circuito abierto sin hueco para una prueba (no consume la prueba)."""
+        state = self.state
+        if state == "half_open":
+            return self._probe_pending()
+        return state == "open"
+
+    def _probe_pending(self) -> bool:
+        # Una prueba que no terminó (p. ej. cancelada) caduca tras otro cooldown
+        return self._probe_at is not None and time.monotonic() - self._probe_at < self.cooldown
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self._probe_pending():
+            return False
+        self._probe_at = time.monotonic()
+        logger.info("[GRAPH] Circuito half-open: enviando petición de prueba")
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("[GRAPH] Circuito cerrado: Graph responde de nuevo")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_at = None
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"[GRAPH] Circuito abierto tras {self.failures} fallos seguidos — usando fallback local")
+            self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def snapshot(self) -> dict:
+        state = self.state
+        retry_in = None
+        if state == "open":
+            retry_in = round(self.cooldown - (time.monotonic() - self.opened_at), 2)
+        return {"state": state, "failures": self.failures, "threshold": self.threshold,
+                "cooldown": self.cooldown, "retry_in": retry_in}
+
+
+breaker = CircuitBreaker()
+
+
+async def send_request(method: str, url: str, weight: int = 1, **kwargs) -> httpx.Response:
+    """Petición al cliente compartido con circuit breaker, limitador y reintentos ante 429/503/504.
+
+    Lanza CircuitOpenError sin tocar la red mientras el circuito está abierto.
+    """
+    if not breaker.allow():
+        raise CircuitOpenError(f"{method} {url}")
+    try:
+        res = await _send_with_retries(method, url, weight, **kwargs)
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
+    if res.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return res
+
+
+async def _send_with_retries(method: str, url: str, weight: int, **kwargs) -> httpx.Response:
+    client = get_client()
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        await throttle(weight)
+        stats["requests"] += 1
+        res = await client.request(method, url, **kwargs)
+        if res.status_code not in RETRY_STATUSES:
+            return res
+        stats["throttled"] += 1
+        delay = backoff_delay(attempt, res.headers)
+        if attempt == GRAPH_MAX_RETRIES or delay > GRAPH_RETRY_MAX:
+            logger.warning(f"[GRAPH] {res.status_code} en {url} — sin más reintentos")
+            return res
+        logger.warning(f"[GRAPH] {res.status_code} en {url} — reintento {attempt + 1} en {delay:.2f}s")
+        stats["retries"] += 1
+        stats["throttled_seconds"] += delay
+        await asyncio.sleep(delay)
+    return res
+
+
+# -----------------------------
+# Helper para Graph API
+# -----------------------------
+async def auth_headers() -> Optional[dict]:
+    token = await auth.get_access_token_async()
+    if not token:
+        return None
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def graph_request(method: str, endpoint: str, data: dict = None, etag: str = None):
+    """Como graph_call, pero devuelve (status, resultado); status es None si no hay token."""
+    headers = await auth_headers()
+    if headers is None:
+        logger.warning(f"[GRAPH] {method} {endpoint} — No access token, skipping")
+        return None, None
+    if etag:
+        headers["If-Match"] = etag
+    if method in ("PATCH", "POST"):
+        # Que Graph devuelva el objeto actualizado (y su nuevo ETag) en lugar de un 204
+        headers["Prefer"] = "return=representation"
+
+    logger.debug(f"[GRAPH] {method} {GRAPH_BASE}{endpoint}")
+    try:
+        res = await send_request(method, endpoint, headers=headers, json=data)
+    except CircuitOpenError:
+        logger.debug(f"[GRAPH] {method} {endpoint} — circuito abierto, skipping")
+        return None, None
+    except httpx.TransportError as e:
+        logger.error(f"[GRAPH] {method} {endpoint} — error de red: {e!r}")
+        return None, None
+    if res.status_code == 401:
+        auth.token_holder.invalidate()
+    if res.status_code == 412:
+        logger.warning(f"[GRAPH] 412 Precondition Failed — ETag mismatch: {endpoint}")
+        return res.status_code, None
+    if res.status_code >= 400:
+        logger.error(f"[GRAPH] {res.status_code} Error on {endpoint}: {res.text[:200]}")
+        return res.status_code, None
+    logger.info(f"[GRAPH] {method} {endpoint} → {res.status_code} ({res.http_version})")
+    result = res.json() if res.status_code != 204 and res.content else {"ok": True}
+    if isinstance(result, dict) and "@odata.etag" not in result and res.headers.get("ETag"):
+        result["@odata.etag"] = res.headers["ETag"]
+    await notify_response(method, endpoint, data, result)
+    return res.status_code, result
+
+
+async def graph_call(method: str, endpoint: str, data: dict = None, etag: str = None):
+    _, result = await graph_request(method, endpoint, data=data, etag=etag)
+    return result
+
+
+async def fan_out(items: Iterable[Any], fn: Callable[[Any], Awaitable[Any]], limit: int = None) -> List[Any]:
+    """Ejecuta fn(item) en paralelo con un máximo de `limit` en vuelo.
+
+    Los resultados se devuelven en el mismo orden que `items`.
+    """
+    sem = asyncio.Semaphore(max(1, limit or GRAPH_FANOUT_CONCURRENCY))
+
+    async def run(item):
+        async with sem:
+            return await fn(item)
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
+
+
+# -----------------------------
+# Paginación (@odata.nextLink)
+# -----------------------------
+async def iter_pages(endpoint: str, first_page: dict = None) -> AsyncIterator[List[dict]]:
+    """Recorre una colección de Graph página a página siguiendo @odata.nextLink."""
+    data = first_page
+    url = endpoint
+    for _ in range(GRAPH_MAX_PAGES):
+        if data is None:
+            data = await graph_call("GET", url)
+        if not data or "value" not in data:
+            return
+        yield data["value"]
+        url = data.get("@odata.nextLink")
+        if not url:
+            return
+        data = None
+    logger.warning(f"[GRAPH] {endpoint}: se alcanzó el máximo de {GRAPH_MAX_PAGES} páginas")
+
+
+async def iter_collection(endpoint: str) -> AsyncIterator[dict]:
+    async for page in iter_pages(endpoint):
+        for item in page:
+            yield item
+
+
+async def get_all(endpoint: str, first_page: dict = None) -> Optional[dict]:
+    """Como graph_call("GET", ...) para colecciones, pero con todas las páginas en "value".
+
+    Devuelve None si la primera página no se pudo obtener.
+    """
+    items, found = [], False
+    async for page in iter_pages(endpoint, first_page):
+        found = True
+        items.extend(page)
+    return {"value": items} if found else None
@@ -0,0 +1,200 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLList,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+    ValidationRule,
+    get_named_type,
+    get_nullable_type,
+)
+from strawberry.extensions import (
+    AddValidationRules,
+    ParserCache,
+    SchemaExtension,
+    ValidationCache,
+)
+from strawberry.extensions.query_depth_limiter import determine_depth, get_fragments, get_queries_and_mutations
+
+logger = logging.getLogger("crud-planner")
+
+# Coste máximo estimado por operación (≈ llamadas a Graph) y profundidad máxima
+GRAPHQL_MAX_COST = int(os.getenv("GRAPHQL_MAX_COST", "1000"))
+GRAPHQL_MAX_DEPTH = int(os.getenv("GRAPHQL_MAX_DEPTH", "6"))
+# Elementos que se suponen en cada lista al multiplicar el coste de sus hijos
+GRAPHQL_LIST_SIZE = int(os.getenv("GRAPHQL_LIST_SIZE", "10"))
+# Consultas persistidas recordadas (APQ) y documentos parseados/validados en caché
+GRAPHQL_PERSISTED_SIZE = int(os.getenv("GRAPHQL_PERSISTED_SIZE", "500"))
+GRAPHQL_DOCUMENT_CACHE = int(os.getenv("GRAPHQL_DOCUMENT_CACHE", "256"))
+
+# Peso de cada campo "Tipo.campo": lo que cuesta resolverlo una vez (los escalares pesan 0).
+# Se pueden sobreescribir con GRAPHQL_FIELD_COSTS='{"BucketType.tasks": 5}'
+FIELD_COSTS: Dict[str, int] = {
+    "Query.plans": 1,
+    "Query.tasks": 1,
+    "PlanType.buckets": 1,
+    "BucketType.tasks": 1,
+}
+FIELD_COSTS.update(json.loads(os.getenv("GRAPHQL_FIELD_COSTS", "{}")))
+# Cada mutación es al menos una escritura en Graph o en la BD
+MUTATION_COST = int(os.getenv("GRAPHQL_MUTATION_COST", "1"))
+
+
+# -----------------------------
+# Coste estático
+# -----------------------------
+def _selection_cost(selection_set, parent_type, schema, fragments, visited=frozenset()) -> int:
+    if selection_set is None or parent_type is None:
+        return 0
+    total = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            fields = getattr(parent_type, "fields", {})
+            if name.startswith("__") or name not in fields:
+                continue
+            field_type = fields[name].type
+            weight = FIELD_COSTS.get(f"{parent_type.name}.{name}")
+            if weight is None:
+                weight = MUTATION_COST if parent_type is schema.mutation_type else 0
+            children = _selection_cost(selection.selection_set, get_named_type(field_type), schema, fragments, visited)
+            multiplier = GRAPHQL_LIST_SIZE if isinstance(get_nullable_type(field_type), GraphQLList) else 1
+            total += weight + multiplier * children
+        elif isinstance(selection, InlineFragmentNode):
+            fragment_type = schema.get_type(selection.type_condition.name.value) if selection.type_condition else parent_type
+            total += _selection_cost(selection.selection_set, fragment_type, schema, fragments, visited)
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            if fragment is None or name in visited:
+                continue
+            fragment_type = schema.get_type(fragment.type_condition.name.value)
+            total += _selection_cost(fragment.selection_set, fragment_type, schema, fragments, visited | {name})
+    return total
+
+
+def operation_cost(operation: OperationDefinitionNode, schema, fragments: Dict[str, FragmentDefinitionNode]) -> int:
+    root = schema.get_root_type(operation.operation)
+    return _selection_cost(operation.selection_set, root, schema, fragments)
+
+
+class QueryCostRule(ValidationRule):
+    """Rechaza antes de ejecutar las operaciones cuyo coste estimado supera GRAPHQL_MAX_COST."""
+
+    def enter_document(self, node, *_):
+        schema = self.context.schema
+        fragments = {d.name.value: d for d in node.definitions if isinstance(d, FragmentDefinitionNode)}
+        for definition in node.definitions:
+            if not isinstance(definition, OperationDefinitionNode):
+                continue
+            cost = operation_cost(definition, schema, fragments)
+            if cost > GRAPHQL_MAX_COST:
+                name = definition.name.value if definition.name else "anónima"
+                logger.warning(f"[GRAPHQL] Operación {name} rechazada: coste {cost} > {GRAPHQL_MAX_COST}")
+                self.report_error(GraphQLError(
+                    f"La operación '{name}' tiene un coste estimado de {cost} (máximo {GRAPHQL_MAX_COST}). "
+                    "Selecciona menos campos anidados.",
+                    definition,
+                    extensions={"code": "QUERY_TOO_COSTLY", "cost": cost, "maxCost": GRAPHQL_MAX_COST},
+                ))
+
+
+class QueryDepthRule(ValidationRule):
+    """Rechaza las operaciones más profundas que GRAPHQL_MAX_DEPTH.
+
+    Es una clase fija (QueryDepthLimiter crea una nueva en cada instancia): ValidationCache usa
+    las reglas como parte de la clave, y con una clase distinta por petición nunca acertaría.
+    """
+
+    def __init__(self, context):
+        super().__init__(context)
+        definitions = context.document.definitions
+        fragments = get_fragments(definitions)
+        for name, operation in get_queries_and_mutations(definitions).items():
+            determine_depth(node=operation, fragments=fragments, depth_so_far=0, max_depth=GRAPHQL_MAX_DEPTH,
+                            context=context, operation_name=name, should_ignore=None)
+
+
+# -----------------------------
+# Consultas persistidas (protocolo APQ de Apollo)
+# -----------------------------
+class PersistedQueryStore:
+    """LRU de sha256 → texto de la consulta."""
+
+    def __init__(self, maxsize: int = GRAPHQL_PERSISTED_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sha: str) -> Optional[str]:
+        with self._lock:
+            query = self._data.get(sha)
+            if query is not None:
+                self._data.move_to_end(sha)
+            return query
+
+    def put(self, sha: str, query: str):
+        with self._lock:
+            self._data[sha] = query
+            self._data.move_to_end(sha)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def register(self, query: str) -> str:
+        sha = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        self.put(sha, query)
+        return sha
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+persisted_queries = PersistedQueryStore()
+
+
+class PersistedQueries(SchemaExtension):
+    """extensions.persistedQuery.sha256Hash: sin `query` se usa la guardada; con `query` se registra."""
+
+    def on_operation(self):
+        ctx = self.execution_context
+        persisted = (ctx.operation_extensions or {}).get("persistedQuery")
+        if isinstance(persisted, dict) and persisted.get("sha256Hash"):
+            sha = persisted["sha256Hash"]
+            if ctx.query:
+                if hashlib.sha256(ctx.query.encode("utf-8")).hexdigest() != sha:
+                    raise GraphQLError("provided sha does not match query",
+                                       extensions={"code": "PERSISTED_QUERY_HASH_MISMATCH"})
+                persisted_queries.put(sha, ctx.query)
+            else:
+                query = persisted_queries.get(sha)
+                if query is None:
+                    # El cliente reintenta enviando el texto completo junto al hash
+                    raise GraphQLError("PersistedQueryNotFound", extensions={"code": "PERSISTED_QUERY_NOT_FOUND"})
+                ctx.query = query
+        yield
+
+
+def extensions() -> list:
+    # Fábricas: cada petición recibe instancias propias. Las cachés de parseo y validación son
+    # compartidas y las reglas son siempre las mismas clases (parte de la clave de ValidationCache),
+    # así que una consulta repetida (o persistida) no se vuelve a parsear ni validar.
+    return [
+        PersistedQueries,
+        lambda: AddValidationRules([QueryDepthRule, QueryCostRule]),
+        lambda: ParserCache(maxsize=GRAPHQL_DOCUMENT_CACHE),
+        lambda: ValidationCache(maxsize=GRAPHQL_DOCUMENT_CACHE),
+    ]
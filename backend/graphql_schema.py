@@ -4,11 +4,18 @@ from typing import List, Optional
 
 import strawberry
 from fastapi import Request
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from strawberry.dataloader import DataLoader
 from strawberry.types import Info
 
 import database
+import etag_cache
+import graphql_guard
+import listing
 import models
+from graph_batch import get_many
+from graph_client import graph_call, get_all
 
 
 @strawberry.type
@@ -18,6 +25,7 @@ class TaskType:
     percent_complete: int
     bucket_id: strawberry.ID
     plan_id: strawberry.ID
+    etag: Optional[str] = None
 
 
 @strawberry.type
@@ -25,14 +33,23 @@ class BucketType:
     id: strawberry.ID
     name: str
     plan_id: strawberry.ID
-    tasks: List[TaskType]
+    etag: Optional[str] = None
+
+    @strawberry.field
+    async def tasks(self, info: Info) -> List[TaskType]:
+        # Solo se consulta si el cliente selecciona el campo; el loader agrupa todos los buckets
+        return await _loaders(info)["tasks"].load(str(self.id))
 
 
 @strawberry.type
 class PlanType:
     id: strawberry.ID
     name: str
-    buckets: List[BucketType]
+    etag: Optional[str] = None
+
+    @strawberry.field
+    async def buckets(self, info: Info) -> List[BucketType]:
+        return await _loaders(info)["buckets"].load(str(self.id))
 
 
 def _to_task(t: models.Task) -> TaskType:
@@ -46,111 +63,155 @@ def _to_task(t: models.Task) -> TaskType:
 
 
 def _to_bucket(b: models.Bucket) -> BucketType:
-    tasks = getattr(b, "tasks", None) or []
     return BucketType(
-        id=b.id,
+        id=strawberry.ID(str(b.id)),
         name=b.name,
-        plan_id=b.plan_id,
-        tasks=[_to_task(t) for t in tasks],
+        plan_id=strawberry.ID(str(b.plan_id)),
     )
 
 
 def _to_plan(p: models.Plan) -> PlanType:
-    buckets = getattr(p, "buckets", None) or []
     return PlanType(
-        id=p.id,
+        id=strawberry.ID(str(p.id)),
         name=p.name,
-        buckets=[_to_bucket(b) for b in buckets],
+    )
+
+
+def _graph_bucket(b: dict, plan_id: str) -> BucketType:
+    return BucketType(
+        id=strawberry.ID(b["id"]),
+        name=b["name"],
+        plan_id=strawberry.ID(b.get("planId") or plan_id),
+        etag=b.get("@odata.etag"),
+    )
+
+
+def _graph_task(t: dict, bucket_id: str) -> TaskType:
+    return TaskType(
+        id=strawberry.ID(t["id"]),
+        title=t["title"],
+        percent_complete=t.get("percentComplete", 0),
+        bucket_id=strawberry.ID(bucket_id),
+        plan_id=strawberry.ID(t.get("planId", "")),
+        etag=t.get("@odata.etag"),
+    )
+
+
+def _local_task(t: models.Task) -> TaskType:
+    return TaskType(
+        id=strawberry.ID(str(t.id)),
+        title=t.title,
+        percent_complete=t.percent_complete,
+        bucket_id=strawberry.ID(str(t.bucket_id)),
+        plan_id=strawberry.ID(str(t.plan_id)),
+    )
+
+
+# -----------------------------
+# DataLoaders por petición (plan → buckets, bucket → tareas)
+# -----------------------------
+async def _load_children(keys: List[str], endpoint: str, to_graph, model, parent_column, to_local) -> List[list]:
+    """Carga los hijos de varios padres: IDs de Graph en un /$batch, IDs locales en un solo SELECT."""
+    children = {key: [] for key in keys}
+    remote = [key for key in keys if not key.isdigit()]
+    local = [int(key) for key in keys if key.isdigit()]
+    if remote:
+        for key, data in zip(remote, await get_many([endpoint.format(key) for key in remote])):
+            if data and "value" in data:
+                children[key] = [to_graph(item, key) for item in data["value"]]
+    if local:
+        # Sesión propia: los loaders pueden resolverse en paralelo con otros campos
+        async with database.AsyncSessionLocal() as db:
+            rows = (await db.scalars(select(model).where(parent_column.in_(local)).order_by(model.id))).all()
+        for row in rows:
+            children[str(getattr(row, parent_column.key))].append(to_local(row))
+    return [children[key] for key in keys]
+
+
+def build_loaders() -> dict:
+    return {
+        "buckets": DataLoader(load_fn=lambda keys: _load_children(
+            keys, "/planner/plans/{}/buckets", _graph_bucket, models.Bucket, models.Bucket.plan_id, _to_bucket)),
+        "tasks": DataLoader(load_fn=lambda keys: _load_children(
+            keys, "/planner/buckets/{}/tasks", _graph_task, models.Task, models.Task.bucket_id, _local_task)),
+    }
+
+
+def _loaders(info: Info) -> dict:
+    if "loaders" not in info.context:
+        info.context["loaders"] = build_loaders()
+    return info.context["loaders"]
+
+
+@strawberry.type
+class TaskPage:
+    items: List[TaskType]
+    next_cursor: Optional[str] = None
+
+
+def _row_to_task(row: dict) -> TaskType:
+    return TaskType(
+        id=strawberry.ID(row["id"]),
+        title=row["title"],
+        percent_complete=row["percent_complete"] or 0,
+        bucket_id=strawberry.ID(row["bucket_id"]),
+        plan_id=strawberry.ID(row["plan_id"]),
     )
 
 
 @strawberry.type
 class Query:
     @strawberry.field
-    async def plans(self, info: Info) -> List[PlanType]:
-        from main import graph_call
-        
+    async def plans(self, info: Info, limit: Optional[int] = None, after: Optional[strawberry.ID] = None) -> List[PlanType]:
+        # Buckets y tareas se resuelven bajo demanda con los DataLoaders (una ola por nivel seleccionado)
         # 1. Intentar obtener de Microsoft Graph
-        graph_data = await graph_call("GET", "/me/planner/plans")
+        graph_data = await get_all("/me/planner/plans")
         if graph_data and "value" in graph_data:
-            result_plans = []
-            for p in graph_data["value"]:
-                plan_id = p["id"]
-                # Obtener buckets para este plan
-                buckets_data = await graph_call("GET", f"/planner/plans/{plan_id}/buckets")
-                plan_buckets = []
-                if buckets_data and "value" in buckets_data:
-                    for b in buckets_data["value"]:
-                        bucket_id = b["id"]
-                        # Obtener tareas para este bucket
-                        tasks_data = await graph_call("GET", f"/planner/buckets/{bucket_id}/tasks")
-                        bucket_tasks = []
-                        if tasks_data and "value" in tasks_data:
-                            for t in tasks_data["value"]:
-                                bucket_tasks.append(TaskType(
-                                    id=strawberry.ID(t["id"]),
-                                    title=t["title"],
-                                    percent_complete=t.get("percentComplete", 0),
-                                    bucket_id=strawberry.ID(bucket_id),
-                                    plan_id=strawberry.ID(plan_id)
-                                ))
-                        
-                        plan_buckets.append(BucketType(
-                            id=strawberry.ID(bucket_id),
-                            name=b["name"],
-                            plan_id=strawberry.ID(plan_id),
-                            tasks=bucket_tasks
-                        ))
-                
-                result_plans.append(PlanType(
-                    id=strawberry.ID(plan_id),
-                    name=p["title"],
-                    buckets=plan_buckets
-                ))
-            return result_plans
+            rows, _ = listing.paginate(graph_data["value"], limit, after)
+            return [PlanType(
+                id=strawberry.ID(p["id"]),
+                name=p["title"],
+                etag=p.get("@odata.etag"),
+            ) for p in rows]
 
         # 2. Fallback a Base de Datos Local
-        db: Session = info.context["db"]
-        plans = (
-            db.query(models.Plan)
-            .options(joinedload(models.Plan.buckets).joinedload(models.Bucket.tasks))
-            .all()
-        )
-        return [PlanType(
-            id=strawberry.ID(str(p.id)),
-            name=p.name,
-            buckets=[BucketType(
-                id=strawberry.ID(str(b.id)),
-                name=b.name,
-                plan_id=strawberry.ID(str(p.id)),
-                tasks=[TaskType(
-                    id=strawberry.ID(str(t.id)),
-                    title=t.title,
-                    percent_complete=t.percent_complete,
-                    bucket_id=strawberry.ID(str(b.id)),
-                    plan_id=strawberry.ID(str(p.id))
-                ) for t in b.tasks]
-            ) for b in p.buckets]
-        ) for p in plans]
+        db: AsyncSession = info.context["db"]
+        rows, _ = await listing.local_page(db, models.Plan, [], limit, after, lambda p: {"id": str(p.id), "name": p.name})
+        return [PlanType(id=strawberry.ID(p["id"]), name=p["name"]) for p in rows]
+
+    @strawberry.field
+    async def tasks(
+        self,
+        info: Info,
+        plan_id: Optional[strawberry.ID] = None,
+        bucket_id: Optional[strawberry.ID] = None,
+        min_percent: Optional[int] = None,
+        max_percent: Optional[int] = None,
+        limit: int = listing.LIST_PAGE_SIZE,
+        after: Optional[strawberry.ID] = None,
+    ) -> TaskPage:
+        # Misma paginación keyset que GET /tasks: after = next_cursor de la página anterior
+        limit = max(1, min(limit, listing.LIST_PAGE_MAX))
+        filters = listing.TaskFilter(plan_id, bucket_id, min_percent, max_percent)
+        rows, next_cursor = await listing.list_tasks(info.context["db"], filters, limit, after)
+        return TaskPage(items=[_row_to_task(r) for r in rows], next_cursor=next_cursor)
 
 
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    def create_plan(self, info: Info, name: str) -> PlanType:
-        db: Session = info.context["db"]
-        if db.query(models.Plan).filter(models.Plan.name == name).first():
+    async def create_plan(self, info: Info, name: str) -> PlanType:
+        db: AsyncSession = info.context["db"]
+        if await db.scalar(select(models.Plan).where(models.Plan.name == name).limit(1)):
             raise ValueError("Ya existe un plan con ese nombre.")
         db_plan = models.Plan(name=name)
         db.add(db_plan)
-        db.commit()
-        db.refresh(db_plan)
-        return PlanType(id=db_plan.id, name=db_plan.name, buckets=[])
+        await db.commit()
+        await db.refresh(db_plan)
+        return PlanType(id=db_plan.id, name=db_plan.name)
 
     @strawberry.mutation
     async def create_bucket(self, info: Info, name: str, plan_id: strawberry.ID) -> BucketType:
-        from main import graph_call
-        
         # 1. Si plan_id es UUID (Microsoft Planner)
         if not str(plan_id).isdigit():
             res = await graph_call("POST", "/planner/buckets", data={
@@ -158,22 +219,21 @@ class Mutation:
                 "planId": str(plan_id)
             })
             if res:
-                return BucketType(id=res["id"], name=res["name"], plan_id=plan_id, tasks=[])
+                return BucketType(id=res["id"], name=res["name"], plan_id=plan_id, etag=res.get("@odata.etag"))
             raise ValueError("No se pudo crear el bucket en Microsoft Graph")
 
         # 2. Local fallback
-        db: Session = info.context["db"]
-        if not db.query(models.Plan).filter(models.Plan.id == int(plan_id)).first():
+        db: AsyncSession = info.context["db"]
+        if not await db.get(models.Plan, int(plan_id)):
             raise ValueError("El plan asociado no existe.")
         db_bucket = models.Bucket(name=name, plan_id=int(plan_id))
         db.add(db_bucket)
-        db.commit()
-        db.refresh(db_bucket)
+        await db.commit()
+        await db.refresh(db_bucket)
         return BucketType(
             id=strawberry.ID(str(db_bucket.id)),
             name=db_bucket.name,
             plan_id=strawberry.ID(str(db_bucket.plan_id)),
-            tasks=[],
         )
 
     @strawberry.mutation
@@ -185,8 +245,6 @@ class Mutation:
         plan_id: strawberry.ID,
         percent_complete: int = 0,
     ) -> TaskType:
-        from main import graph_call
-        
         # 1. Si plan_id es UUID (Microsoft Planner)
         if not str(plan_id).isdigit():
             res = await graph_call("POST", "/planner/tasks", data={
@@ -201,13 +259,14 @@ class Mutation:
                     title=res["title"],
                     percent_complete=res.get("percentComplete", 0),
                     bucket_id=bucket_id,
-                    plan_id=plan_id
+                    plan_id=plan_id,
+                    etag=res.get("@odata.etag"),
                 )
             raise ValueError("No se pudo crear la tarea en Microsoft Graph")
 
         # 2. Local fallback
-        db: Session = info.context["db"]
-        if not db.query(models.Plan).filter(models.Plan.id == int(plan_id)).first():
+        db: AsyncSession = info.context["db"]
+        if not await db.get(models.Plan, int(plan_id)):
             raise ValueError("El plan asociado no existe.")
         
         db_task = models.Task(
@@ -217,8 +276,8 @@ class Mutation:
             plan_id=int(plan_id),
         )
         db.add(db_task)
-        db.commit()
-        db.refresh(db_task)
+        await db.commit()
+        await db.refresh(db_task)
         return _to_task(db_task)
 
     @strawberry.mutation
@@ -230,13 +289,13 @@ class Mutation:
         percent_complete: Optional[int] = None,
         bucket_id: Optional[strawberry.ID] = None,
         plan_id: Optional[strawberry.ID] = None,
+        etag: Optional[str] = None,
     ) -> TaskType:
-        from main import graph_call, logger
-        
+
         # 1. Intentar local (ID entero)
         if str(id).isdigit():
-            db: Session = info.context["db"]
-            db_task = db.query(models.Task).filter(models.Task.id == int(id)).first()
+            db: AsyncSession = info.context["db"]
+            db_task = await db.get(models.Task, int(id))
             if not db_task:
                 raise ValueError("Task not found")
 
@@ -248,8 +307,8 @@ class Mutation:
             if percent_complete is not None: db_task.percent_complete = percent_complete
             db_task.bucket_id = new_bucket_id
             db_task.plan_id = new_plan_id
-            db.commit()
-            db.refresh(db_task)
+            await db.commit()
+            await db.refresh(db_task)
             return _to_task(db_task)
             
         # 2. Intentar Graph (ID UUID)
@@ -258,135 +317,111 @@ class Mutation:
         if percent_complete is not None: patch_data["percentComplete"] = percent_complete
         if bucket_id is not None: patch_data["bucketId"] = str(bucket_id)
         
-        # Lazy ETag Fetch para Graph
-        logger.info(f"[GQL] Obteniendo ETag para actualizar tarea {id}...")
-        task_info = await graph_call("GET", f"/planner/tasks/{id}")
-        etag = task_info.get("@odata.etag") if task_info else None
-        
-        res = await graph_call("PATCH", f"/planner/tasks/{id}", data=patch_data, etag=etag)
-        if res:
+        # ETag en caché; solo se consulta Graph si falta o resulta obsoleto
+        res = await etag_cache.conditional_write("tasks", str(id), "PATCH", data=patch_data, if_match=etag)
+        if res.ok:
+             data = res.data if isinstance(res.data, dict) else {}
              return TaskType(
                 id=id, 
-                title=title or "Tarea de Graph", 
-                percent_complete=percent_complete or 0,
-                bucket_id=bucket_id or strawberry.ID(""),
-                plan_id=plan_id or strawberry.ID("")
+                title=title or data.get("title") or "Tarea de Graph", 
+                percent_complete=percent_complete if percent_complete is not None else data.get("percentComplete", 0),
+                bucket_id=bucket_id or strawberry.ID(data.get("bucketId", "")),
+                plan_id=plan_id or strawberry.ID(data.get("planId", "")),
+                etag=res.etag,
             )
         raise ValueError("No se pudo actualizar la tarea en Microsoft Graph")
 
     @strawberry.mutation
-    async def update_plan(self, info: Info, id: strawberry.ID, name: str) -> PlanType:
-        from main import graph_call, logger
-        
+    async def update_plan(self, info: Info, id: strawberry.ID, name: str, etag: Optional[str] = None) -> PlanType:
         # 1. Graph attempt
         if not str(id).isdigit():
-            logger.info(f"[GQL] Obteniendo ETag para actualizar plan {id}...")
-            plan_info = await graph_call("GET", f"/planner/plans/{id}")
-            etag = plan_info.get("@odata.etag") if plan_info else None
-            
-            res = await graph_call("PATCH", f"/planner/plans/{id}", data={"title": name}, etag=etag)
-            if res:
-                return PlanType(id=id, name=name, buckets=[])
+            res = await etag_cache.conditional_write("plans", str(id), "PATCH", data={"title": name}, if_match=etag)
+            if res.ok:
+                return PlanType(id=id, name=name, etag=res.etag)
         
         # 2. Local fallback
-        db: Session = info.context["db"]
-        db_plan = db.query(models.Plan).filter(models.Plan.id == int(id) if str(id).isdigit() else 0).first()
+        db: AsyncSession = info.context["db"]
+        db_plan = await db.get(models.Plan, int(id)) if str(id).isdigit() else None
         if not db_plan:
             raise ValueError("Plan not found")
         db_plan.name = name
-        db.commit()
-        db.refresh(db_plan)
-        return PlanType(id=strawberry.ID(str(db_plan.id)), name=db_plan.name, buckets=[])
+        await db.commit()
+        await db.refresh(db_plan)
+        return PlanType(id=strawberry.ID(str(db_plan.id)), name=db_plan.name)
 
     @strawberry.mutation
     async def delete_plan(self, info: Info, id: strawberry.ID) -> bool:
-        db: Session = info.context["db"]
+        db: AsyncSession = info.context["db"]
         if str(id).isdigit():
-            db_plan = db.query(models.Plan).filter(models.Plan.id == int(id)).first()
+            db_plan = await db.get(models.Plan, int(id))
             if db_plan:
-                db.delete(db_plan)
-                db.commit()
+                await db.delete(db_plan)
+                await db.commit()
                 return True
         raise ValueError("Microsoft Graph no permite eliminar planes directamente. Se debe eliminar el Grupo de O365 asociado.")
 
     @strawberry.mutation
-    async def update_bucket(self, info: Info, id: strawberry.ID, name: str) -> BucketType:
-        from main import graph_call, logger
-        
+    async def update_bucket(self, info: Info, id: strawberry.ID, name: str, etag: Optional[str] = None) -> BucketType:
         # 1. Graph attempt
         if not str(id).isdigit():
-            logger.info(f"[GQL] Obteniendo ETag para actualizar bucket {id}...")
-            bucket_info = await graph_call("GET", f"/planner/buckets/{id}")
-            etag = bucket_info.get("@odata.etag") if bucket_info else None
-
-            res = await graph_call("PATCH", f"/planner/buckets/{id}", data={"name": name}, etag=etag)
-            if res:
-                return BucketType(id=id, name=name, plan_id=strawberry.ID(""), tasks=[])
+            res = await etag_cache.conditional_write("buckets", str(id), "PATCH", data={"name": name}, if_match=etag)
+            if res.ok:
+                plan_id = res.data.get("planId", "") if isinstance(res.data, dict) else ""
+                return BucketType(id=id, name=name, plan_id=strawberry.ID(plan_id), etag=res.etag)
             
         # 2. Local fallback
-        db: Session = info.context["db"]
-        db_bucket = db.query(models.Bucket).filter(models.Bucket.id == int(id) if str(id).isdigit() else 0).first()
+        db: AsyncSession = info.context["db"]
+        db_bucket = await db.get(models.Bucket, int(id)) if str(id).isdigit() else None
         if not db_bucket:
             raise ValueError("Bucket not found")
         db_bucket.name = name
-        db.commit()
-        db.refresh(db_bucket)
-        return BucketType(id=strawberry.ID(str(db_bucket.id)), name=db_bucket.name, plan_id=strawberry.ID(str(db_bucket.plan_id)), tasks=[])
+        await db.commit()
+        await db.refresh(db_bucket)
+        return _to_bucket(db_bucket)
 
     @strawberry.mutation
-    async def delete_bucket(self, info: Info, id: strawberry.ID) -> bool:
-        from main import graph_call, logger
-        
+    async def delete_bucket(self, info: Info, id: strawberry.ID, etag: Optional[str] = None) -> bool:
         # 1. Graph attempt
         if not str(id).isdigit():
-            logger.info(f"[GQL] Obteniendo ETag para borrar bucket {id}...")
-            bucket_info = await graph_call("GET", f"/planner/buckets/{id}")
-            etag = bucket_info.get("@odata.etag") if bucket_info else None
-            
-            res = await graph_call("DELETE", f"/planner/buckets/{id}", etag=etag)
-            if res is not None:
+            res = await etag_cache.conditional_write("buckets", str(id), "DELETE", if_match=etag)
+            if res.ok:
                 return True
             
         # 2. Local fallback
-        db: Session = info.context["db"]
+        db: AsyncSession = info.context["db"]
         if str(id).isdigit():
-            db_bucket = db.query(models.Bucket).filter(models.Bucket.id == int(id)).first()
+            db_bucket = await db.get(models.Bucket, int(id))
             if db_bucket:
-                db.delete(db_bucket)
-                db.commit()
+                await db.delete(db_bucket)
+                await db.commit()
                 return True
         return False
 
     @strawberry.mutation
-    async def delete_task(self, info: Info, id: strawberry.ID) -> bool:
-        from main import graph_call
-
-        # Intentar DELETE en Graph si el ID es un UUID (no numérico)
+    async def delete_task(self, info: Info, id: strawberry.ID, etag: Optional[str] = None) -> bool:
+        # Intentar DELETE en Graph si el ID es un UUID (no numérico); Graph exige If-Match
         if not str(id).isdigit():
-            res = await graph_call("DELETE", f"/planner/tasks/{id}")
-            if res is not None:
+            res = await etag_cache.conditional_write("tasks", str(id), "DELETE", if_match=etag)
+            if res.ok:
                 return True
 
         # Fallback: buscar en DB local por ID entero
-        db: Session = info.context["db"]
+        db: AsyncSession = info.context["db"]
         if str(id).isdigit():
-            db_task = db.query(models.Task).filter(models.Task.id == int(id)).first()
+            db_task = await db.get(models.Task, int(id))
             if db_task:
-                db.delete(db_task)
-                db.commit()
+                await db.delete(db_task)
+                await db.commit()
                 return True
 
         raise ValueError(f"Tarea {id} no encontrada ni en Graph ni en la base de datos local.")
 
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+schema = strawberry.Schema(query=Query, mutation=Mutation, extensions=graphql_guard.extensions())
 
 
 async def get_context(request: Request):
-    # Crear sesión de base de datos para GraphQL
-    db = database.SessionLocal()
-    try:
-        yield {"request": request, "db": db}
-    finally:
-        db.close()
+    # Crear sesión asíncrona de base de datos para GraphQL (y loaders nuevos: la caché dura una petición)
+    async with database.AsyncSessionLocal() as db:
+        yield {"request": request, "db": db, "loaders": build_loaders()}
 
@@ -0,0 +1,183 @@
+import os
+import json
+import zlib
+from typing import Any, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el json estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se negocia gzip
+    brotli = None
+
+# Respuestas más pequeñas que esto (bytes) se envían sin comprimir
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+# Trozos a partir de este tamaño se comprimen en el threadpool para no bloquear el event loop
+_THREAD_MIN_SIZE = 64 * 1024
+
+
+# -----------------------------
+# Serialización JSON
+# -----------------------------
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON con orjson para datos ya construidos por el backend (sin pasar por response_model)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# -----------------------------
+# Compresión negociada (br > gzip)
+# -----------------------------
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Accept-Encoding → {codificación: q}; q=0 rechaza explícitamente esa codificación."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    accepted = accepted_encodings(accept_encoding)
+    options = [("br", brotli is not None), ("gzip", True)]
+    best = max(((accepted.get(name, accepted.get("*", 0)), -i, name) for i, (name, ok) in enumerate(options) if ok),
+               default=(0, 0, "identity"))
+    return best[2] if best[0] > 0 else "identity"
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 → cabecera gzip
+
+    def __call__(self, body: bytes, more_body: bool) -> bytes:
+        # Con más cuerpo pendiente se vacía el bloque: los streams NDJSON llegan sin esperar al final
+        return self._z.compress(body) + self._z.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def __call__(self, body: bytes, more_body: bool) -> bytes:
+        data = self._compressor.process(body)
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+def weak_etag(etag: str) -> str:
+    """El cuerpo comprimido no es idéntico byte a byte al original: solo admite un ETag débil."""
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+class _CompressingSend:
+    """Envoltorio de send para una respuesta: decide con el primer trozo si comprime o la deja pasar."""
+
+    def __init__(self, send: Send, encoding: str, compressor: Callable[[], Callable[[bytes, bool], bytes]],
+                 minimum_size: int, exclude_content_types: tuple):
+        self.send = send
+        self.encoding = encoding
+        self.make_compressor = compressor
+        self.minimum_size = minimum_size
+        self.exclude_content_types = exclude_content_types
+        self.start: Optional[Message] = None
+        self.compressor = None
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._flush_start()
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start is not None:
+            headers = MutableHeaders(scope=self.start)
+            if ("content-encoding" in headers
+                    or headers.get("content-type", "").startswith(self.exclude_content_types)
+                    or (not more_body and len(body) < self.minimum_size)):
+                if self.start["status"] == 304 and "etag" in headers:
+                    # El 304 repite el ETag que llevaría el 200 comprimido para esta codificación
+                    headers["ETag"] = weak_etag(headers["etag"])
+                    headers.add_vary_header("Accept-Encoding")
+                await self._flush_start()
+                await self.send(message)
+                return
+            self.compressor = self.make_compressor()
+            body = await self._compress(body, more_body)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                headers["ETag"] = weak_etag(headers["etag"])
+            if more_body:
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self._flush_start()
+        elif self.compressor is not None:
+            body = await self._compress(body, more_body)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _flush_start(self):
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self.send(start)
+
+    async def _compress(self, body: bytes, more_body: bool) -> bytes:
+        if len(body) >= _THREAD_MIN_SIZE:
+            return await run_in_threadpool(self.compressor, body, more_body)
+        return self.compressor(body, more_body)
+
+
+class CompressionMiddleware:
+    """Middleware ASGI de compresión: brotli cuando el cliente lo prefiere (y está instalado), si no gzip."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_SIZE, compresslevel: int = COMPRESS_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESS_BROTLI_QUALITY,
+                 exclude_content_types: tuple = ("text/event-stream",)):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.brotli_quality = brotli_quality
+        self.exclude_content_types = exclude_content_types
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding == "br":
+            compressor = lambda: _BrotliCompressor(self.brotli_quality)
+        elif encoding == "gzip":
+            compressor = lambda: _GzipCompressor(self.compresslevel)
+        else:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding, compressor, self.minimum_size,
+                                                        self.exclude_content_types))
@@ -0,0 +1,193 @@
+import os
+import hashlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import http_encoding
+import mirror
+import models
+from graph_client import get_all
+
+# Tamaño de página por defecto y máximo de los listados (GraphQL tasks, y GET /tasks con ?after)
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "500"))
+LIST_PAGE_MAX = int(os.getenv("LIST_PAGE_MAX", "5000"))
+
+# Cabecera con el cursor de la siguiente página (ausente en la última)
+CURSOR_HEADER = "X-Next-Cursor"
+
+Page = Tuple[List[dict], Optional[str]]
+
+# Política de caché HTTP de cada listado. Por defecto el navegador guarda la respuesta pero
+# la revalida siempre (If-None-Match → 304), así un cambio se ve en el siguiente refresco.
+CACHE_CONTROL = {
+    "plans": os.getenv("CACHE_CONTROL_PLANS", "private, no-cache"),
+    "buckets": os.getenv("CACHE_CONTROL_BUCKETS", "private, no-cache"),
+    "tasks": os.getenv("CACHE_CONTROL_TASKS", "private, no-cache"),
+}
+
+
+@dataclass
+class TaskFilter:
+    plan_id: Optional[str] = None
+    bucket_id: Optional[str] = None
+    min_percent: Optional[int] = None
+    max_percent: Optional[int] = None
+
+    @property
+    def local(self) -> bool:
+        return (self.bucket_id or "").isdigit() or (self.plan_id or "").isdigit()
+
+    def matches(self, row: dict) -> bool:
+        if self.plan_id and row.get("plan_id") != self.plan_id:
+            return False
+        if self.bucket_id and row.get("bucket_id") != self.bucket_id:
+            return False
+        percent = row.get("percent_complete") or 0
+        if self.min_percent is not None and percent < self.min_percent:
+            return False
+        if self.max_percent is not None and percent > self.max_percent:
+            return False
+        return True
+
+    def criteria(self, model, local: bool = False) -> list:
+        """Condiciones SQL; en las tablas locales los IDs no numéricos no filtran (como antes)."""
+        where = []
+        for column, value in ((model.plan_id, self.plan_id), (model.bucket_id, self.bucket_id)):
+            if value and not local:
+                where.append(column == value)
+            elif value and value.isdigit():
+                where.append(column == int(value))
+        if self.min_percent is not None:
+            where.append(model.percent_complete >= self.min_percent)
+        if self.max_percent is not None:
+            where.append(model.percent_complete <= self.max_percent)
+        return where
+
+
+def split_page(rows: List[dict], limit: Optional[int]) -> Page:
+    """rows trae hasta limit + 1 elementos: el extra solo indica que hay otra página."""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, rows[-1]["id"]
+
+
+def paginate(rows: List[dict], limit: Optional[int], after: Optional[str] = None) -> Page:
+    """Keyset en memoria para colecciones de Graph: orden estable por id."""
+    if limit is None and after is None:
+        return rows, None
+    rows = sorted(rows, key=lambda r: r["id"])
+    if after:
+        rows = [r for r in rows if r["id"] > after]
+    return split_page(rows[:limit + 1] if limit is not None else rows, limit)
+
+
+async def local_page(db: AsyncSession, model, criteria: list, limit: Optional[int], after: Optional[str], to_row) -> Page:
+    # WHERE filtros AND id > cursor ORDER BY id LIMIT n + 1: usa los índices (filtro, id)
+    query = select(model).where(*criteria)
+    if after and after.isdigit():
+        query = query.where(model.id > int(after))
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return split_page([to_row(obj) for obj in (await db.scalars(query)).all()], limit)
+
+
+# -----------------------------
+# GET condicional (ETag / If-None-Match)
+# -----------------------------
+def page_etag(body: bytes, cursor: Optional[str] = None) -> str:
+    """Validador fuerte: hash de los bytes exactos de la página y de su cursor."""
+    digest = hashlib.blake2b(body, digest_size=16)
+    digest.update((cursor or "").encode("utf-8"))
+    return '"' + digest.hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    # If-None-Match usa la comparación débil: W/"x" equivale a "x"
+    return "*" in candidates or etag in [c[2:] if c.startswith("W/") else c for c in candidates]
+
+
+def conditional_page(request: Request, kind: str, rows: List[dict], cursor: Optional[str] = None) -> Response:
+    """Serializa la página una sola vez (orjson) y devuelve 304 si el cliente ya la tiene.
+
+    Las filas las construye el backend con la forma de schemas.*, así que no se revalidan
+    con el response_model del endpoint.
+    """
+    response = http_encoding.FastJSONResponse(rows, headers={"Cache-Control": CACHE_CONTROL[kind]})
+    response.headers["ETag"] = page_etag(response.body, cursor)
+    if cursor:
+        response.headers[CURSOR_HEADER] = cursor
+    if etag_matches(request.headers.get("If-None-Match"), response.headers["ETag"]):
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "content-type")}
+        return Response(status_code=304, headers=headers)
+    return response
+
+
+# -----------------------------
+# Tareas: espejo → Graph → BD local
+# -----------------------------
+def graph_task_row(t: dict, bucket_id: str = None) -> dict:
+    return {
+        "id": t["id"],
+        "title": t["title"],
+        "percent_complete": t.get("percentComplete", 0),
+        "bucket_id": bucket_id or t.get("bucketId", ""),
+        "plan_id": t.get("planId", "")
+    }
+
+
+def local_task_row(t: models.Task) -> dict:
+    return {
+        "id": str(t.id),
+        "title": t.title,
+        "percent_complete": t.percent_complete,
+        "bucket_id": str(t.bucket_id),
+        "plan_id": str(t.plan_id)
+    }
+
+
+async def _graph_tasks(filters: TaskFilter) -> Optional[List[dict]]:
+    if filters.bucket_id:
+        graph_data = await get_all(f"/planner/buckets/{filters.bucket_id}/tasks")
+        if graph_data and "value" in graph_data:
+            return [graph_task_row(t, filters.bucket_id) for t in graph_data["value"]]
+    if filters.plan_id:
+        graph_data = await get_all(f"/planner/plans/{filters.plan_id}/tasks")
+        if graph_data and "value" in graph_data:
+            return [graph_task_row(t) for t in graph_data["value"]]
+    # Intentar obtener todas las tareas del usuario de Graph
+    graph_all = await get_all("/me/planner/tasks")
+    if graph_all and "value" in graph_all:
+        return [graph_task_row(t) for t in graph_all["value"]]
+    return None
+
+
+async def list_tasks(db: AsyncSession, filters: TaskFilter, limit: Optional[int], after: Optional[str] = None) -> Page:
+    """Una página de tareas (ORDER BY id) y el cursor de la siguiente; limit=None → todas."""
+    if not filters.local:
+        if mirror.MIRROR_ENABLED:
+            # Filtros y keyset resueltos en SQL sobre el espejo
+            criteria = filters.criteria(models.MirrorTask)
+            rows = None
+            if filters.bucket_id:
+                rows = await mirror.read_tasks_page(db, filters.bucket_id, criteria, limit, after)
+            if rows is None:
+                # El ámbito del plan también contiene las tareas del bucket: se conserva su criterio
+                rows = await mirror.read_tasks_page(db, None, criteria, limit, after, plan_id=filters.plan_id)
+            if rows is not None:
+                return split_page(rows, limit)
+
+        rows = await _graph_tasks(filters)
+        if rows is not None:
+            return paginate([r for r in rows if filters.matches(r)], limit, after)
+
+    # Fallback a local
+    return await local_page(db, models.Task, filters.criteria(models.Task, local=True), limit, after, local_task_row)
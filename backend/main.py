@@ -1,17 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import os
+import json
 import time
+import asyncio
 import logging
 import models
 import schemas
 import database
 import auth
-import httpx
+import graph_client
+import graph_batch
+import mirror
+import delta_sync
+import etag_cache
+import listing
+import http_encoding
+import change_feed
+import scheduler
+from graph_client import get_all
+from graph_batch import BatchRequest, batch_call, get_many, graph_call_batched
 from strawberry.fastapi import GraphQLRouter
 from graphql_schema import schema, get_context
 
@@ -81,9 +95,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", listing.CURSOR_HEADER],
 )
 
-GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+# gzip/brotli según Accept-Encoding para la API y el minisite (/app) a partir de COMPRESS_MIN_SIZE
+app.add_middleware(http_encoding.CompressionMiddleware)
+
+GRAPH_BASE = graph_client.GRAPH_BASE
+# Tope de elementos por petición en /tasks/bulk
+TASKS_BULK_MAX = int(os.getenv("TASKS_BULK_MAX", "500"))
 
 @app.on_event("startup")
 async def startup_event():
@@ -99,6 +119,32 @@ async def startup_event():
             if i == max_retries - 1:
                 raise
             time.sleep(2)
+    await graph_client.start_client()
+    if delta_sync.DELTA_INTERVAL > 0:
+        # Igual que el planificador: las pasadas delta escriben en el espejo
+        if mirror.MIRROR_ENABLED:
+            app.state.delta_task = asyncio.create_task(delta_sync.run_forever())
+        else:
+            logger.warning("[DELTA] PLANNER_DELTA_INTERVAL requiere PLANNER_MIRROR=true; no se inicia")
+    if scheduler.SCHEDULER_INTERVAL > 0:
+        # El planificador refresca el espejo: sin PLANNER_MIRROR no tendría dónde escribir
+        if mirror.MIRROR_ENABLED:
+            app.state.scheduler = scheduler.SyncScheduler()
+            app.state.scheduler.start()
+        else:
+            logger.warning("[SCHED] SCHEDULER_INTERVAL requiere PLANNER_MIRROR=true; no se inicia")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    delta_task = getattr(app.state, "delta_task", None)
+    if delta_task is not None:
+        delta_task.cancel()
+    sync_scheduler = getattr(app.state, "scheduler", None)
+    if sync_scheduler is not None:
+        await sync_scheduler.stop()
+    await graph_batch.batcher.close()
+    await graph_client.close_client()
+    auth.save_cache()
 
 # -----------------------------
 # Autenticación (MS Graph)
@@ -139,247 +185,456 @@ def auth_status():
             account_name = accounts[0].get("username")
     return {"authenticated": token is not None, "user": account_name}
 
+# -----------------------------
+# Sincronización incremental (delta de Planner)
+# -----------------------------
+@app.post("/sync/delta")
+async def run_delta_sync(reset: bool = False, db: AsyncSession = Depends(database.get_async_db)):
+    if reset:
+        await delta_sync.reset_delta(db)
+    stats = await delta_sync.sync_delta(db)
+    if stats is None:
+        raise HTTPException(status_code=502, detail="No se pudo obtener el delta de Microsoft Graph")
+    return stats
+
+# Estado del planificador en segundo plano (pasadas, scopes refrescados, si este worker es el líder)
+@app.get("/sync/scheduler")
+def scheduler_status():
+    sync_scheduler = getattr(app.state, "scheduler", None)
+    if sync_scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, "interval": sync_scheduler.interval, "owner": sync_scheduler.lease.owner,
+            **sync_scheduler.stats}
+
+# Contadores del cliente de Graph (reintentos, throttling, espera del limitador)
+@app.get("/graph/stats")
+def graph_stats():
+    return graph_client.stats
+
+# Estado del circuit breaker: "open" = se sirve el fallback local sin esperar a Graph
+@app.get("/graph/status")
+def graph_status():
+    return graph_client.breaker.snapshot()
+
+# Feed de cambios (SSE): altas, cambios y bajas de planes, buckets y tareas
+@app.get("/changes")
+async def changes(last_event_id: Optional[str] = None,
+                  last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    # EventSource reenvía Last-Event-ID al reconectar; ?last_event_id= para la primera conexión
+    return StreamingResponse(
+        change_feed.stream(last_event_id_header or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # GraphQL (para demo y consumo desde el minisite)
 graphql_app = GraphQLRouter(schema, context_getter=get_context)
 app.include_router(graphql_app, prefix="/graphql")
 
-# -----------------------------
-# Helper para Graph API
-# -----------------------------
-async def graph_call(method: str, endpoint: str, data: dict = None, etag: str = None):
-    token = auth.get_access_token()
-    if not token:
-        logger.warning(f"[GRAPH] {method} {endpoint} — No access token, skipping")
-        return None
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
+def _set_etag(response: Response, etag: Optional[str]):
+    # Devolver el nuevo ETag para que el cliente lo envíe como If-Match en la próxima escritura
     if etag:
-        headers["If-Match"] = etag
-
-    url = f"https://graph.microsoft.com/v1.0{endpoint}"
-    async with httpx.AsyncClient() as client:
-        logger.debug(f"[GRAPH] {method} {url}")
-        res = await client.request(method, url, headers=headers, json=data)
-        if res.status_code == 412:
-            logger.warning(f"[GRAPH] 412 Precondition Failed — ETag mismatch: {endpoint}")
-            return None
-        if res.status_code >= 400:
-            logger.error(f"[GRAPH] {res.status_code} Error on {endpoint}: {res.text[:200]}")
-            return None
-        logger.info(f"[GRAPH] {method} {endpoint} → {res.status_code}")
-        return res.json() if res.status_code != 204 else {"ok": True}
+        response.headers["ETag"] = etag
 
-# -----------------------------
 # -----------------------------
 # CRUD de Planes
 # -----------------------------
 @app.get("/plans", response_model=List[schemas.Plan])
-async def get_plans(db: Session = Depends(database.get_db)):
+async def get_plans(request: Request, limit: Optional[int] = Query(None, ge=1, le=listing.LIST_PAGE_MAX),
+                    after: Optional[str] = None, db: AsyncSession = Depends(database.get_async_db)):
+    rows, next_cursor = await _list_plans(db, limit, after)
+    return listing.conditional_page(request, "plans", rows, next_cursor)
+
+async def _list_plans(db: AsyncSession, limit: Optional[int], after: Optional[str]) -> listing.Page:
+    # Modo espejo: servir desde la copia local de Planner
+    if mirror.MIRROR_ENABLED:
+        rows = await mirror.read_plans(db)
+        if rows is not None:
+            return listing.paginate(rows, limit, after)
+
     # Intentar obtener de Graph
-    graph_data = await graph_call("GET", "/me/planner/plans")
+    graph_data = await get_all("/me/planner/plans")
     if graph_data and "value" in graph_data:
-        return [{"id": p["id"], "name": p.get("title")} for p in graph_data["value"]]
+        return listing.paginate([{"id": p["id"], "name": p.get("title")} for p in graph_data["value"]], limit, after)
     
     # Fallback a local
-    return [{"id": str(p.id), "name": p.name} for p in db.query(models.Plan).all()]
+    return await listing.local_page(db, models.Plan, [], limit, after, lambda p: {"id": str(p.id), "name": p.name})
 
 @app.post("/plans", response_model=schemas.Plan)
-async def create_plan(plan: schemas.PlanCreate, db: Session = Depends(database.get_db)):
-    db_plan = models.Plan(name=plan.name)
-    db.add(db_plan)
-    db.commit()
-    db.refresh(db_plan)
-    return schemas.Plan(id=str(db_plan.id), name=db_plan.name)
+async def create_plan(plan: schemas.PlanCreate):
+    # Agrupado con otras escrituras locales concurrentes en una transacción
+    def insert(session):
+        db_plan = models.Plan(name=plan.name)
+        session.add(db_plan)
+        session.flush()
+        return {"id": str(db_plan.id), "name": db_plan.name}
+    return schemas.Plan(**await database.group_commit.submit(insert))
 
 @app.put("/plans/{plan_id}", response_model=schemas.Plan)
-async def update_plan(plan_id: str, plan: schemas.PlanCreate, db: Session = Depends(database.get_db)):
+async def update_plan(plan_id: str, plan: schemas.PlanCreate, response: Response,
+                      if_match: str = None, if_match_header: Optional[str] = Header(None, alias="If-Match")):
     if plan_id.isdigit():
-        db_plan = db.query(models.Plan).filter(models.Plan.id == int(plan_id)).first()
-        if db_plan:
+        def update(session):
+            db_plan = session.get(models.Plan, int(plan_id))
+            if db_plan is None:
+                return None
             db_plan.name = plan.name
-            db.commit()
-            db.refresh(db_plan)
-            return schemas.Plan(id=str(db_plan.id), name=db_plan.name)
+            session.flush()
+            return {"id": str(db_plan.id), "name": db_plan.name}
+        row = await database.group_commit.submit(update)
+        if row:
+            return schemas.Plan(**row)
     
-    # Intento en Graph (PATCH /planner/plans/{id})
-    # Requiere eTag, por ahora fallback o error si no se maneja eTag
-    res = await graph_call("PATCH", f"/planner/plans/{plan_id}", data={"title": plan.name})
-    if res:
+    # Intento en Graph (PATCH /planner/plans/{id}) con el ETag en caché
+    res = await etag_cache.conditional_write("plans", plan_id, "PATCH", data={"title": plan.name}, if_match=if_match or if_match_header)
+    if res.ok:
+        _set_etag(response, res.etag)
         return schemas.Plan(id=plan_id, name=plan.name)
+    if res.status == 412:
+        raise HTTPException(status_code=412, detail="Conflicto de concurrencia al actualizar plan.")
     raise HTTPException(status_code=404, detail="Plan no encontrado")
 
 @app.delete("/plans/{plan_id}")
-async def delete_plan(plan_id: str, db: Session = Depends(database.get_db)):
+async def delete_plan(plan_id: str,
+                      if_match: str = None, if_match_header: Optional[str] = Header(None, alias="If-Match")):
     # 1. Local Fallback
     if plan_id.isdigit():
-        db_plan = db.query(models.Plan).filter(models.Plan.id == int(plan_id)).first()
-        if db_plan:
-            db.delete(db_plan)
-            db.commit()
+        def remove(session):
+            db_plan = session.get(models.Plan, int(plan_id))
+            if db_plan is not None:
+                session.delete(db_plan)
+            return db_plan is not None
+        if await database.group_commit.submit(remove):
             return {"ok": True}
         raise HTTPException(status_code=404, detail="Plan local no encontrado")
     
     # 2. Microsoft Graph Support
-    # Necesitamos el ETag para el DELETE
-    plan_data = await graph_call("GET", f"/planner/plans/{plan_id}")
-    if not plan_data:
-        raise HTTPException(status_code=404, detail="Plan no encontrado en Microsoft Graph")
-    
-    etag = plan_data.get("@odata.etag")
-    res = await graph_call("DELETE", f"/planner/plans/{plan_id}", headers={"If-Match": etag})
-    
-    # DELETE exitoso devuelve status 204 (res suele ser None en nuestro wrapper)
-    return {"ok": True, "detail": "Plan eliminado de Microsoft Graph"}
+    # El DELETE necesita If-Match: se usa el ETag en caché y solo se relee ante un 412
+    res = await etag_cache.conditional_write("plans", plan_id, "DELETE", if_match=if_match or if_match_header)
+    if res.ok:
+        return {"ok": True, "detail": "Plan eliminado de Microsoft Graph"}
+    if res.status == 412:
+        raise HTTPException(status_code=412, detail="Conflicto de concurrencia al eliminar plan.")
+    raise HTTPException(status_code=404, detail="Plan no encontrado en Microsoft Graph")
 
 # -----------------------------
 # CRUD de Buckets
 # -----------------------------
 @app.get("/buckets", response_model=List[schemas.Bucket])
-async def get_buckets(plan_id: str = None, db: Session = Depends(database.get_db)):
+async def get_buckets(request: Request, plan_id: str = None,
+                      limit: Optional[int] = Query(None, ge=1, le=listing.LIST_PAGE_MAX),
+                      after: Optional[str] = None, db: AsyncSession = Depends(database.get_async_db)):
+    rows, next_cursor = await _list_buckets(db, plan_id, limit, after)
+    return listing.conditional_page(request, "buckets", rows, next_cursor)
+
+async def _list_buckets(db: AsyncSession, plan_id: Optional[str], limit: Optional[int], after: Optional[str]) -> listing.Page:
     all_buckets = []
+
+    if mirror.MIRROR_ENABLED and not (plan_id or "").isdigit():
+        all_buckets = await mirror.read_buckets(db, plan_id) or []
+        if all_buckets:
+            return listing.paginate(all_buckets, limit, after)
     
     if plan_id:
-        graph_data = await graph_call("GET", f"/planner/plans/{plan_id}/buckets")
+        graph_data = await get_all(f"/planner/plans/{plan_id}/buckets")
         if graph_data and "value" in graph_data:
             all_buckets = [{"id": b["id"], "name": b["name"], "plan_id": plan_id} for b in graph_data["value"]]
     else:
         # Si no hay plan_id, intentar traer buckets de TODOS los planes del usuario
-        plans_data = await graph_call("GET", "/me/planner/plans")
+        plans_data = await get_all("/me/planner/plans")
         if plans_data and "value" in plans_data:
-            for p in plans_data["value"]:
-                p_id = p["id"]
-                b_data = await graph_call("GET", f"/planner/plans/{p_id}/buckets")
+            plan_ids = [p["id"] for p in plans_data["value"]]
+            results = await get_many([f"/planner/plans/{p_id}/buckets" for p_id in plan_ids])
+            for p_id, b_data in zip(plan_ids, results):
                 if b_data and "value" in b_data:
                     all_buckets.extend([{"id": b["id"], "name": b["name"], "plan_id": p_id} for b in b_data["value"]])
 
     if all_buckets:
-        return all_buckets
+        return listing.paginate(all_buckets, limit, after)
     
     # Fallback a local
-    query = db.query(models.Bucket)
-    if plan_id and plan_id.isdigit():
-        query = query.filter(models.Bucket.plan_id == int(plan_id))
-    return [{"id": str(b.id), "name": b.name, "plan_id": str(b.plan_id)} for b in query.all()]
+    criteria = [models.Bucket.plan_id == int(plan_id)] if plan_id and plan_id.isdigit() else []
+    return await listing.local_page(db, models.Bucket, criteria, limit, after,
+                                    lambda b: {"id": str(b.id), "name": b.name, "plan_id": str(b.plan_id)})
 
 @app.post("/buckets", response_model=schemas.Bucket)
-async def create_bucket(bucket: schemas.BucketCreate, db: Session = Depends(database.get_db)):
+async def create_bucket(bucket: schemas.BucketCreate, response: Response):
     # Si plan_id es UUID (Microsoft Planner)
     if not bucket.plan_id.isdigit():
-        res = await graph_call("POST", "/planner/buckets", data={
+        # Altas concurrentes de varios clientes comparten el mismo /$batch
+        res = await graph_call_batched("POST", "/planner/buckets", data={
             "name": bucket.name,
             "planId": bucket.plan_id
         })
         if res:
+            _set_etag(response, res.get("@odata.etag"))
             return schemas.Bucket(id=res["id"], name=res["name"], plan_id=bucket.plan_id)
         raise HTTPException(status_code=400, detail="No se pudo crear el bucket en Microsoft Graph")
 
-    # Local fallback
-    db_bucket = models.Bucket(name=bucket.name, plan_id=int(bucket.plan_id))
-    db.add(db_bucket)
-    db.commit()
-    db.refresh(db_bucket)
-    return schemas.Bucket(id=str(db_bucket.id), name=db_bucket.name, plan_id=str(db_bucket.plan_id))
+    # Local fallback (agrupado con otras escrituras concurrentes en una transacción)
+    def insert(session):
+        db_bucket = models.Bucket(name=bucket.name, plan_id=int(bucket.plan_id))
+        session.add(db_bucket)
+        session.flush()
+        return {"id": str(db_bucket.id), "name": db_bucket.name, "plan_id": str(db_bucket.plan_id)}
+    return schemas.Bucket(**await database.group_commit.submit(insert))
 
 @app.put("/buckets/{bucket_id}", response_model=schemas.Bucket)
-async def update_bucket(bucket_id: str, bucket: schemas.BucketCreate, db: Session = Depends(database.get_db), if_match: str = None):
+async def update_bucket(bucket_id: str, bucket: schemas.BucketCreate, response: Response,
+                        if_match: str = None, if_match_header: Optional[str] = Header(None, alias="If-Match")):
     if bucket_id.isdigit():
-        db_bucket = db.query(models.Bucket).filter(models.Bucket.id == int(bucket_id)).first()
-        if db_bucket:
+        def update(session):
+            db_bucket = session.get(models.Bucket, int(bucket_id))
+            if db_bucket is None:
+                return None
             db_bucket.name = bucket.name
             db_bucket.plan_id = int(bucket.plan_id) if bucket.plan_id.isdigit() else db_bucket.plan_id
-            db.commit()
-            db.refresh(db_bucket)
-            return schemas.Bucket(id=str(db_bucket.id), name=db_bucket.name, plan_id=str(db_bucket.plan_id))
+            session.flush()
+            return {"id": str(db_bucket.id), "name": db_bucket.name, "plan_id": str(db_bucket.plan_id)}
+        row = await database.group_commit.submit(update)
+        if row:
+            return schemas.Bucket(**row)
     
-    # Graph PATCH /planner/buckets/{id}
-    # Si no hay ETag, lo obtenemos
-    if not if_match:
-        logger.info(f"[BUCKET] Obteniendo ETag para bucket {bucket_id}...")
-        bucket_info = await graph_call("GET", f"/planner/buckets/{bucket_id}")
-        if bucket_info and "@odata.etag" in bucket_info:
-            if_match = bucket_info["@odata.etag"]
-
-    res = await graph_call("PATCH", f"/planner/buckets/{bucket_id}", data={"name": bucket.name}, etag=if_match)
-    if res:
+    # Graph PATCH /planner/buckets/{id} (ETag del cliente, de la caché o, en último caso, GET)
+    res = await etag_cache.conditional_write("buckets", bucket_id, "PATCH", data={"name": bucket.name}, if_match=if_match or if_match_header)
+    if res.ok:
+        _set_etag(response, res.etag)
         return schemas.Bucket(id=bucket_id, name=bucket.name, plan_id=bucket.plan_id)
-    if res is None and if_match:
+    if res.status == 412:
          raise HTTPException(status_code=412, detail="Conflicto de concurrencia al actualizar bucket.")
     raise HTTPException(status_code=404, detail="Bucket no encontrado")
 
 @app.delete("/buckets/{bucket_id}")
-async def delete_bucket(bucket_id: str, db: Session = Depends(database.get_db), if_match: str = None):
+async def delete_bucket(bucket_id: str,
+                        if_match: str = None, if_match_header: Optional[str] = Header(None, alias="If-Match")):
     if bucket_id.isdigit():
-        db_bucket = db.query(models.Bucket).filter(models.Bucket.id == int(bucket_id)).first()
-        if db_bucket:
-            db.delete(db_bucket)
-            db.commit()
+        def remove(session):
+            db_bucket = session.get(models.Bucket, int(bucket_id))
+            if db_bucket is not None:
+                session.delete(db_bucket)
+            return db_bucket is not None
+        if await database.group_commit.submit(remove):
             return {"ok": True}
     
     # Graph DELETE /planner/buckets/{id}
-    if not if_match:
-        logger.info(f"[BUCKET] Obteniendo ETag para borrar bucket {bucket_id}...")
-        bucket_info = await graph_call("GET", f"/planner/buckets/{bucket_id}")
-        if bucket_info and "@odata.etag" in bucket_info:
-            if_match = bucket_info["@odata.etag"]
-
-    res = await graph_call("DELETE", f"/planner/buckets/{bucket_id}", etag=if_match)
-    if res is not None:
+    res = await etag_cache.conditional_write("buckets", bucket_id, "DELETE", if_match=if_match or if_match_header)
+    if res.ok:
         return {"ok": True}
+    if res.status == 412:
+        raise HTTPException(status_code=412, detail="Conflicto de concurrencia al eliminar bucket.")
     raise HTTPException(status_code=404, detail="Bucket no encontrado en Graph")
 
 # -----------------------------
 # CRUD de Tareas
 # -----------------------------
 @app.get("/tasks", response_model=List[schemas.Task])
-async def get_tasks(bucket_id: str = None, plan_id: str = None, db: Session = Depends(database.get_db)):
-    if bucket_id:
-        graph_data = await graph_call("GET", f"/planner/buckets/{bucket_id}/tasks")
-        if graph_data and "value" in graph_data:
-            return [{
-                "id": t["id"],
-                "title": t["title"],
-                "percent_complete": t.get("percentComplete", 0),
-                "bucket_id": bucket_id,
-                "plan_id": t.get("planId", "")
-            } for t in graph_data["value"]]
-    
-    # Intentar obtener todas las tareas del usuario de Graph
-    graph_all = await graph_call("GET", "/me/planner/tasks")
-    if graph_all and "value" in graph_all:
-         return [{
-                "id": t["id"],
-                "title": t["title"],
-                "percent_complete": t.get("percentComplete", 0),
-                "bucket_id": t.get("bucketId", ""),
-                "plan_id": t.get("planId", "")
-            } for t in graph_all["value"]]
+async def get_tasks(request: Request, bucket_id: str = None, plan_id: str = None,
+                    min_percent: Optional[int] = Query(None, ge=0, le=100),
+                    max_percent: Optional[int] = Query(None, ge=0, le=100),
+                    limit: Optional[int] = Query(None, ge=1, le=listing.LIST_PAGE_MAX),
+                    after: Optional[str] = None,
+                    db: AsyncSession = Depends(database.get_async_db)):
+    # Paginación keyset: ?after=<último id> con el valor de la cabecera X-Next-Cursor.
+    # Sin limit ni after se devuelven todas las tareas (clientes que no conocen el cursor)
+    if limit is None and after is not None:
+        limit = listing.LIST_PAGE_SIZE
+    filters = listing.TaskFilter(plan_id, bucket_id, min_percent, max_percent)
+    rows, next_cursor = await listing.list_tasks(db, filters, limit, after)
+    # Un refresco sin cambios responde 304 sin cuerpo
+    return listing.conditional_page(request, "tasks", rows, next_cursor)
+
+@app.get("/tasks/stream")
+async def stream_tasks(bucket_id: str = None, plan_id: str = None):
+    """Tareas en NDJSON (una por línea), enviadas a medida que llegan las páginas de Graph."""
+    first_page, pages = None, None
+    if not (bucket_id or "").isdigit() and not (plan_id or "").isdigit():
+        if bucket_id:
+            endpoint = f"/planner/buckets/{bucket_id}/tasks"
+        elif plan_id:
+            endpoint = f"/planner/plans/{plan_id}/tasks"
+        else:
+            endpoint = "/me/planner/tasks"
+        pages = graph_client.iter_pages(endpoint)
+        first_page = await anext(pages, None)
+
+    if first_page is not None:
+        async def graph_rows():
+            page = first_page
+            while page is not None:
+                yield "".join(json.dumps(listing.graph_task_row(t, bucket_id)) + "\n" for t in page)
+                page = await anext(pages, None)
+        return StreamingResponse(graph_rows(), media_type="application/x-ndjson")
+
+    # Fallback a local: lectura por lotes para no cargar toda la tabla en memoria
+    async def local_rows():
+        async with database.AsyncSessionLocal() as db:
+            query = select(models.Task).execution_options(yield_per=500)
+            if bucket_id and bucket_id.isdigit():
+                query = query.where(models.Task.bucket_id == int(bucket_id))
+            if plan_id and plan_id.isdigit():
+                query = query.where(models.Task.plan_id == int(plan_id))
+            async for t in await db.stream_scalars(query):
+                yield json.dumps(listing.local_task_row(t)) + "\n"
+    return StreamingResponse(local_rows(), media_type="application/x-ndjson")
 
-    # Fallback a local
-    query = db.query(models.Task)
-    if bucket_id and bucket_id.isdigit():
-        query = query.filter(models.Task.bucket_id == int(bucket_id))
-    return [{
-        "id": str(t.id),
-        "title": t.title,
-        "percent_complete": t.percent_complete,
-        "bucket_id": str(t.bucket_id),
-        "plan_id": str(t.plan_id)
-    } for t in query.all()]
+# -----------------------------
+# Operaciones masivas de Tareas
+# -----------------------------
+def _check_bulk_size(items: list):
+    if len(items) > TASKS_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {TASKS_BULK_MAX} tareas por petición")
+
+def _bulk_result(index: int, status: Optional[int], task_id: str = None, task: dict = None,
+                 etag: str = None, detail: str = None) -> schemas.BulkItemResult:
+    if status is None:
+        status = 503 if graph_client.breaker.is_open() else 401
+    if detail is None and status >= 400:
+        detail = {401: "Sin token de Microsoft Graph", 404: "Tarea no encontrada",
+                  412: "Conflicto: La tarea fue modificada por otro usuario.",
+                  503: "Microsoft Graph no disponible (circuito abierto)"}.get(status, "Error en Microsoft Graph")
+    return schemas.BulkItemResult(index=index, id=task_id, status=status, ok=status < 400,
+                                  task=task, etag=etag, detail=detail)
+
+async def _submit_local_bulk(writes: list) -> list:
+    """Envía las escrituras locales de un lote al group commit: comparten transacción y la que falla
+    queda aislada en su SAVEPOINT, así que cada elemento recibe su propio resultado o excepción."""
+    return await asyncio.gather(*(database.group_commit.submit(fn) for fn in writes), return_exceptions=True)
+
+def _local_bulk_error(index: int, task_id: Optional[str], error: Exception) -> schemas.BulkItemResult:
+    if isinstance(error, IntegrityError):
+        # FK o restricción violada (p. ej. bucket o plan inexistente): el resto del lote sigue adelante
+        return _bulk_result(index, 409, task_id, detail=f"Conflicto de integridad: {error.orig}")
+    logger.error(f"[DB] Escritura masiva {index} falló: {error}")
+    return _bulk_result(index, 500, task_id, detail="Error al escribir en la base de datos local")
+
+@app.post("/tasks/bulk", response_model=List[schemas.BulkItemResult])
+async def create_tasks_bulk(tasks: List[schemas.TaskCreate]):
+    """Crea varias tareas: las de Planner en /$batch y las locales en una sola transacción agrupada."""
+    _check_bulk_size(tasks)
+    results: List[Optional[schemas.BulkItemResult]] = [None] * len(tasks)
+    remote = [i for i, t in enumerate(tasks) if not t.plan_id.isdigit()]
+    local = []
+    for i, t in enumerate(tasks):
+        if not t.plan_id.isdigit():
+            continue
+        if not t.bucket_id.isdigit():
+            results[i] = _bulk_result(i, 400, detail="bucket_id debe ser numérico en un plan local")
+            continue
+        local.append(i)
+
+    if remote:
+        batch = await batch_call([BatchRequest("POST", "/planner/tasks", data={
+            "planId": tasks[i].plan_id,
+            "bucketId": tasks[i].bucket_id,
+            "title": tasks[i].title,
+            "percentComplete": tasks[i].percent_complete,
+        }) for i in remote])
+        for i, res in zip(remote, batch):
+            if res is None or res.status >= 400:
+                results[i] = _bulk_result(i, res.status if res else None)
+                continue
+            body = res.value()
+            results[i] = _bulk_result(i, res.status, body["id"], listing.graph_task_row(body, tasks[i].bucket_id), res.etag)
+
+    if local:
+        def insert(task: schemas.TaskCreate):
+            def write(session):
+                db_task = models.Task(
+                    title=task.title,
+                    percent_complete=task.percent_complete,
+                    bucket_id=int(task.bucket_id),
+                    plan_id=int(task.plan_id)
+                )
+                session.add(db_task)
+                session.flush()
+                return listing.local_task_row(db_task)
+            return write
+        for i, row in zip(local, await _submit_local_bulk([insert(tasks[i]) for i in local])):
+            if isinstance(row, Exception):
+                results[i] = _local_bulk_error(i, None, row)
+            else:
+                results[i] = _bulk_result(i, 201, row["id"], row)
+    return results
+
+@app.put("/tasks/bulk", response_model=List[schemas.BulkItemResult])
+async def update_tasks_bulk(tasks: List[schemas.TaskBulkUpdate]):
+    """Actualiza varias tareas; cada una informa su propio resultado (404/409/412 no abortan el lote)."""
+    _check_bulk_size(tasks)
+    results: List[Optional[schemas.BulkItemResult]] = [None] * len(tasks)
+    remote = [i for i, t in enumerate(tasks) if not t.id.isdigit()]
+    local = [i for i, t in enumerate(tasks) if t.id.isdigit()]
+
+    if remote:
+        writes = []
+        for i in remote:
+            patch_body = {"title": tasks[i].title, "percentComplete": tasks[i].percent_complete}
+            if tasks[i].bucket_id:
+                patch_body["bucketId"] = tasks[i].bucket_id
+            writes.append((tasks[i].id, patch_body, tasks[i].etag))
+        for i, res in zip(remote, await etag_cache.conditional_write_many("tasks", "PATCH", writes)):
+            task = tasks[i].model_dump(exclude={"etag"}) if res.ok else None
+            results[i] = _bulk_result(i, res.status, tasks[i].id, task, res.etag)
+
+    if local:
+        def update(task: schemas.TaskBulkUpdate):
+            def write(session):
+                db_task = session.get(models.Task, int(task.id))
+                if db_task is None:
+                    return None
+                db_task.title = task.title
+                db_task.percent_complete = task.percent_complete
+                db_task.bucket_id = int(task.bucket_id) if task.bucket_id.isdigit() else db_task.bucket_id
+                db_task.plan_id = int(task.plan_id) if task.plan_id.isdigit() else db_task.plan_id
+                session.flush()
+                return listing.local_task_row(db_task)
+            return write
+        for i, row in zip(local, await _submit_local_bulk([update(tasks[i]) for i in local])):
+            if isinstance(row, Exception):
+                results[i] = _local_bulk_error(i, tasks[i].id, row)
+            else:
+                results[i] = _bulk_result(i, 200 if row else 404, tasks[i].id, row)
+    return results
+
+@app.delete("/tasks/bulk", response_model=List[schemas.BulkItemResult])
+async def delete_tasks_bulk(tasks: List[schemas.TaskBulkDelete]):
+    _check_bulk_size(tasks)
+    results: List[Optional[schemas.BulkItemResult]] = [None] * len(tasks)
+    remote = [i for i, t in enumerate(tasks) if not t.id.isdigit()]
+    local = [i for i, t in enumerate(tasks) if t.id.isdigit()]
+
+    if remote:
+        writes = [(tasks[i].id, None, tasks[i].etag) for i in remote]
+        for i, res in zip(remote, await etag_cache.conditional_write_many("tasks", "DELETE", writes)):
+            results[i] = _bulk_result(i, res.status, tasks[i].id)
+
+    if local:
+        def remove(task_id: int):
+            def write(session):
+                db_task = session.get(models.Task, task_id)
+                if db_task is not None:
+                    session.delete(db_task)
+                    session.flush()
+                return db_task is not None
+            return write
+        for i, found in zip(local, await _submit_local_bulk([remove(int(tasks[i].id)) for i in local])):
+            if isinstance(found, Exception):
+                results[i] = _local_bulk_error(i, tasks[i].id, found)
+            else:
+                results[i] = _bulk_result(i, 204 if found else 404, tasks[i].id)
+    return results
 
 @app.post("/tasks", response_model=schemas.Task)
-async def create_task(task: schemas.TaskCreate, db: Session = Depends(database.get_db)):
+async def create_task(task: schemas.TaskCreate, response: Response):
     # Si plan_id es UUID (Microsoft Planner)
     if not task.plan_id.isdigit():
-        res = await graph_call("POST", "/planner/tasks", data={
+        res = await graph_call_batched("POST", "/planner/tasks", data={
             "planId": task.plan_id,
             "bucketId": task.bucket_id,
             "title": task.title,
             "percentComplete": task.percent_complete
         })
         if res:
+            _set_etag(response, res.get("@odata.etag"))
             return schemas.Task(
                 id=res["id"],
                 title=res["title"],
@@ -389,43 +644,37 @@ async def create_task(task: schemas.TaskCreate, db: Session = Depends(database.g
             )
         raise HTTPException(status_code=400, detail="No se pudo crear la tarea en Microsoft Graph")
 
-    # Local fallback
-    db_task = models.Task(
-        title=task.title,
-        percent_complete=task.percent_complete,
-        bucket_id=int(task.bucket_id),
-        plan_id=int(task.plan_id)
-    )
-    db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
-    return schemas.Task(
-        id=str(db_task.id),
-        title=db_task.title,
-        percent_complete=db_task.percent_complete,
-        bucket_id=str(db_task.bucket_id),
-        plan_id=str(db_task.plan_id)
-    )
+    # Local fallback (agrupado con otras escrituras concurrentes en una transacción)
+    def insert(session):
+        db_task = models.Task(
+            title=task.title,
+            percent_complete=task.percent_complete,
+            bucket_id=int(task.bucket_id),
+            plan_id=int(task.plan_id)
+        )
+        session.add(db_task)
+        session.flush()
+        return listing.local_task_row(db_task)
+    return schemas.Task(**await database.group_commit.submit(insert))
 
 @app.put("/tasks/{task_id}", response_model=schemas.Task)
-async def update_task(task_id: str, task: schemas.TaskCreate, db: Session = Depends(database.get_db), if_match: str = None):
+async def update_task(task_id: str, task: schemas.TaskCreate, response: Response,
+                      if_match: str = None, if_match_header: Optional[str] = Header(None, alias="If-Match")):
     # Primero intentar local (ID numérico = registro SQLite)
     if task_id.isdigit():
-        db_task = db.query(models.Task).filter(models.Task.id == int(task_id)).first()
-        if db_task:
+        def update(session):
+            db_task = session.get(models.Task, int(task_id))
+            if db_task is None:
+                return None
             db_task.title = task.title
             db_task.percent_complete = task.percent_complete
             db_task.bucket_id = int(task.bucket_id) if task.bucket_id.isdigit() else db_task.bucket_id
             db_task.plan_id = int(task.plan_id) if task.plan_id.isdigit() else db_task.plan_id
-            db.commit()
-            db.refresh(db_task)
-            return schemas.Task(
-                id=str(db_task.id),
-                title=db_task.title,
-                percent_complete=db_task.percent_complete,
-                bucket_id=str(db_task.bucket_id),
-                plan_id=str(db_task.plan_id)
-            )
+            session.flush()
+            return listing.local_task_row(db_task)
+        row = await database.group_commit.submit(update)
+        if row:
+            return schemas.Task(**row)
     
     # ID no numérico = UUID de Microsoft Planner → PATCH a Graph con If-Match
     patch_body = {
@@ -436,15 +685,10 @@ async def update_task(task_id: str, task: schemas.TaskCreate, db: Session = Depe
     if task.bucket_id:
         patch_body["bucketId"] = task.bucket_id
 
-    # Si no hay ETag, lo obtenemos
-    if not if_match:
-        logger.info(f"[TASK] Obteniendo ETag para tarea {task_id}...")
-        task_info = await graph_call("GET", f"/planner/tasks/{task_id}")
-        if task_info and "@odata.etag" in task_info:
-            if_match = task_info["@odata.etag"]
-
-    res = await graph_call("PATCH", f"/planner/tasks/{task_id}", data=patch_body, etag=if_match)
-    if res:
+    # ETag del cliente o de la caché; solo se hace GET si no se conoce o resulta obsoleto
+    res = await etag_cache.conditional_write("tasks", task_id, "PATCH", data=patch_body, if_match=if_match or if_match_header)
+    if res.ok:
+        _set_etag(response, res.etag)
         return schemas.Task(
             id=task_id,
             title=task.title,
@@ -452,30 +696,29 @@ async def update_task(task_id: str, task: schemas.TaskCreate, db: Session = Depe
             bucket_id=task.bucket_id,
             plan_id=task.plan_id
         )
-    if res is None and if_match:
+    if res.status == 412:
         raise HTTPException(status_code=412, detail="Conflicto: La tarea fue modificada por otro usuario. Recarga los datos y vuelve a intentarlo.")
     raise HTTPException(status_code=404, detail="Tarea no encontrada")
 
 @app.delete("/tasks/{task_id}")
-async def delete_task(task_id: str, db: Session = Depends(database.get_db), if_match: str = None):
+async def delete_task(task_id: str,
+                      if_match: str = None, if_match_header: Optional[str] = Header(None, alias="If-Match")):
     # 1. Intentar local (ID numérico)
     if task_id.isdigit():
-        db_task = db.query(models.Task).filter(models.Task.id == int(task_id)).first()
-        if db_task:
-            db.delete(db_task)
-            db.commit()
+        def remove(session):
+            db_task = session.get(models.Task, int(task_id))
+            if db_task is not None:
+                session.delete(db_task)
+            return db_task is not None
+        if await database.group_commit.submit(remove):
             return {"ok": True}
     
     # 2. Intentar Graph (ID no numérico)
-    # Si no tenemos ETag, intentamos obtenerlo primero (Lazy Delete)
-    if not if_match:
-        logger.info(f"[DELETE] Intentando obtener ETag para {task_id} antes de borrar...")
-        task_info = await graph_call("GET", f"/planner/tasks/{task_id}")
-        if task_info and "@odata.etag" in task_info:
-            if_match = task_info["@odata.etag"]
-
-    res = await graph_call("DELETE", f"/planner/tasks/{task_id}", etag=if_match)
-    if res is not None:
+    # ETag en caché (Lazy Delete): solo se consulta Graph si no se conoce o da 412
+    res = await etag_cache.conditional_write("tasks", task_id, "DELETE", if_match=if_match or if_match_header)
+    if res.ok:
         return {"ok": True}
+    if res.status == 412:
+        raise HTTPException(status_code=412, detail="Conflicto: La tarea fue modificada por otro usuario. Recarga los datos y vuelve a intentarlo.")
         
     raise HTTPException(status_code=404, detail="Tarea no encontrada o error al eliminar en Graph API.")
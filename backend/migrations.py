@@ -0,0 +1,147 @@
+import time
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger("crud-planner")
+
+
+# -----------------------------
+# Esquema congelado de cada migración
+# -----------------------------
+# Copia fija de las tablas tal como eran al escribir cada migración: models.py puede seguir
+# cambiando sin que una BD nueva y una migrada terminen con esquemas distintos.
+_schema = MetaData()
+
+_plans = Table(
+    "plans", _schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, nullable=False),
+)
+_buckets = Table(
+    "buckets", _schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, nullable=False),
+    Column("plan_id", Integer, ForeignKey("plans.id"), nullable=False),
+)
+_tasks = Table(
+    "tasks", _schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String, nullable=False),
+    Column("percent_complete", Integer),
+    Column("bucket_id", Integer, ForeignKey("buckets.id"), nullable=False),
+    Column("plan_id", Integer, ForeignKey("plans.id"), nullable=False),
+)
+_mirror_plans = Table(
+    "mirror_plans", _schema,
+    Column("id", String, primary_key=True),
+    Column("title", String, nullable=False),
+    Column("etag", String),
+    Column("synced_at", Float, nullable=False),
+)
+_mirror_buckets = Table(
+    "mirror_buckets", _schema,
+    Column("id", String, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("plan_id", String, nullable=False, index=True),
+    Column("etag", String),
+    Column("synced_at", Float, nullable=False),
+)
+_mirror_tasks = Table(
+    "mirror_tasks", _schema,
+    Column("id", String, primary_key=True),
+    Column("title", String, nullable=False),
+    Column("percent_complete", Integer),
+    Column("bucket_id", String, index=True),
+    Column("plan_id", String, index=True),
+    Column("assigned_to_me", Boolean, nullable=False),
+    Column("etag", String),
+    Column("synced_at", Float, nullable=False),
+)
+_mirror_scopes = Table(
+    "mirror_scopes", _schema,
+    Column("scope", String, primary_key=True),
+    Column("refreshed_at", Float, nullable=False),
+)
+_mirror_delta = Table(
+    "mirror_delta", _schema,
+    Column("scope", String, primary_key=True),
+    Column("delta_link", String),
+    Column("updated_at", Float, nullable=False),
+)
+_V1_TABLES = [_plans, _buckets, _tasks, _mirror_plans, _mirror_buckets, _mirror_tasks, _mirror_scopes, _mirror_delta]
+
+_V2_INDEXES = [
+    Index("ix_buckets_plan_id_id", _buckets.c.plan_id, _buckets.c.id),
+    Index("ix_tasks_bucket_id_id", _tasks.c.bucket_id, _tasks.c.id),
+    Index("ix_tasks_plan_id_id", _tasks.c.plan_id, _tasks.c.id),
+    Index("ix_tasks_percent_complete_id", _tasks.c.percent_complete, _tasks.c.id),
+    Index("ix_mirror_tasks_bucket_id_id", _mirror_tasks.c.bucket_id, _mirror_tasks.c.id),
+    Index("ix_mirror_tasks_assigned_to_me_id", _mirror_tasks.c.assigned_to_me, _mirror_tasks.c.id),
+]
+
+_scheduler_leases_table = Table(
+    "scheduler_leases", _schema,
+    Column("name", String, primary_key=True),
+    Column("owner", String, nullable=False),
+    Column("expires_at", Float, nullable=False),
+)
+
+
+# -----------------------------
+# Migraciones (versión, descripción, función)
+# -----------------------------
+def _initial_schema(conn: Connection):
+    # Tablas existentes antes del control de versiones; no toca las que ya están creadas
+    _schema.create_all(conn, tables=_V1_TABLES)
+
+
+def _list_indexes(conn: Connection):
+    # Índices compuestos de los listados keyset: BD creadas antes de declararlos en models.py
+    for index in _V2_INDEXES:
+        index.create(conn, checkfirst=True)
+
+
+def _scheduler_leases(conn: Connection):
+    _scheduler_leases_table.create(conn, checkfirst=True)
+
+
+def _mirror_scope_access(conn: Connection):
+    # Contador de lecturas compartido por los workers; las BD anteriores no lo tienen
+    columns = {c["name"] for c in inspect(conn).get_columns("mirror_scopes")}
+    if "access_count" not in columns:
+        conn.execute(text("ALTER TABLE mirror_scopes ADD COLUMN access_count FLOAT NOT NULL DEFAULT 0"))
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "esquema inicial", _initial_schema),
+    (2, "índices compuestos para listados paginados", _list_indexes),
+    (3, "lease del planificador en segundo plano", _scheduler_leases),
+    (4, "lecturas por scope del espejo compartidas entre workers", _mirror_scope_access),
+]
+
+
+def current_version(conn: Connection) -> int:
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar_one()
+
+
+def upgrade(engine: Engine) -> int:
+    """Aplica en orden las migraciones pendientes; devuelve la versión final del esquema."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at FLOAT NOT NULL)"
+        ))
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"[DB] Migración {version}: {name}")
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": time.time()},
+            )
+        return current_version(conn)
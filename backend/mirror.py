@@ -0,0 +1,427 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import database
+import graph_client
+import models
+from graph_batch import get_many
+from graph_client import get_all
+
+logger = logging.getLogger("crud-planner")
+
+# Modo espejo: las lecturas de /plans, /buckets y /tasks se sirven desde la BD local
+MIRROR_ENABLED = os.getenv("PLANNER_MIRROR", "false").strip().lower() in ("1", "true", "yes")
+# Segundos tras los que una colección se considera vieja y se refresca en segundo plano
+MIRROR_TTL = float(os.getenv("PLANNER_MIRROR_TTL", "60"))
+
+# Refrescos simultáneos contra Graph: el planificador y los refrescos en segundo plano comparten el cupo
+REFRESH_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "4"))
+
+# Refrescos en curso (evita lanzar dos veces el mismo scope)
+_inflight: Dict[str, asyncio.Task] = {}
+# Lecturas de este worker aún no sumadas a mirror_scopes.access_count (ver flush_access)
+access_counts: Dict[str, float] = {}
+
+_budget: Optional[asyncio.Semaphore] = None
+_budget_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def refresh_budget() -> asyncio.Semaphore:
+    """Semáforo único (por event loop) que limita todos los refrescos del espejo."""
+    global _budget, _budget_loop
+    loop = asyncio.get_running_loop()
+    if _budget is None or _budget_loop is not loop:
+        _budget, _budget_loop = asyncio.Semaphore(REFRESH_CONCURRENCY), loop
+    return _budget
+
+
+# -----------------------------
+# Conversión Graph → filas del espejo
+# -----------------------------
+def _plan_row(p: dict) -> dict:
+    return {"id": p["id"], "title": p.get("title") or "", "etag": p.get("@odata.etag")}
+
+
+def _bucket_row(b: dict, plan_id: str = None) -> dict:
+    return {
+        "id": b["id"],
+        "name": b.get("name") or "",
+        "plan_id": b.get("planId") or plan_id or "",
+        "etag": b.get("@odata.etag"),
+    }
+
+
+def _task_row(t: dict) -> dict:
+    return {
+        "id": t["id"],
+        "title": t.get("title") or "",
+        "percent_complete": t.get("percentComplete", 0),
+        "bucket_id": t.get("bucketId") or "",
+        "plan_id": t.get("planId") or "",
+        "etag": t.get("@odata.etag"),
+    }
+
+
+def _replace(db: Session, model, rows: List[dict], criteria, now: float):
+    """Sustituye el contenido de un scope: upsert de `rows` y borrado de lo que ya no existe."""
+    query = db.query(model)
+    if criteria is not None:
+        query = query.filter(criteria)
+    existing = {obj.id: obj for obj in query}
+    keep = set()
+    for row in rows:
+        keep.add(row["id"])
+        obj = existing.get(row["id"]) or db.get(model, row["id"])
+        if obj is None:
+            obj = model(id=row["id"])
+            db.add(obj)
+        for key, value in row.items():
+            setattr(obj, key, value)
+        obj.synced_at = now
+    for obj_id, obj in existing.items():
+        if obj_id not in keep:
+            db.delete(obj)
+
+
+def _touch(db: Session, scope: str, now: float):
+    state = db.get(models.MirrorScope, scope)
+    if state is None:
+        db.add(models.MirrorScope(scope=scope, refreshed_at=now))
+    else:
+        state.refreshed_at = now
+
+
+# -----------------------------
+# Refrescos desde Graph
+# -----------------------------
+async def refresh_plans(db: AsyncSession) -> bool:
+    data = await get_all("/me/planner/plans")
+    if not data or "value" not in data:
+        return False
+    rows = [_plan_row(p) for p in data["value"]]
+
+    def apply(session: Session):
+        now = time.time()
+        _replace(session, models.MirrorPlan, rows, None, now)
+        _touch(session, "plans", now)
+
+    await db.run_sync(apply)
+    await db.commit()
+    return True
+
+
+async def refresh_buckets(db: AsyncSession, plan_id: str) -> bool:
+    data = await get_all(f"/planner/plans/{plan_id}/buckets")
+    if not data or "value" not in data:
+        return False
+    rows = [_bucket_row(b, plan_id) for b in data["value"]]
+
+    def apply(session: Session):
+        now = time.time()
+        _replace(session, models.MirrorBucket, rows, models.MirrorBucket.plan_id == plan_id, now)
+        _touch(session, f"buckets:{plan_id}", now)
+
+    await db.run_sync(apply)
+    await db.commit()
+    return True
+
+
+async def refresh_all_buckets(db: AsyncSession) -> bool:
+    if not await refresh_plans(db):
+        return False
+    plan_ids = list((await db.scalars(select(models.MirrorPlan.id))).all())
+    results = await get_many([f"/planner/plans/{p_id}/buckets" for p_id in plan_ids])
+
+    def apply(session: Session):
+        now = time.time()
+        for plan_id, data in zip(plan_ids, results):
+            if not data or "value" not in data:
+                continue
+            rows = [_bucket_row(b, plan_id) for b in data["value"]]
+            _replace(session, models.MirrorBucket, rows, models.MirrorBucket.plan_id == plan_id, now)
+            _touch(session, f"buckets:{plan_id}", now)
+        _touch(session, "buckets:*", now)
+
+    await db.run_sync(apply)
+    await db.commit()
+    return True
+
+
+async def refresh_tasks(db: AsyncSession, bucket_id: str) -> bool:
+    data = await get_all(f"/planner/buckets/{bucket_id}/tasks")
+    if not data or "value" not in data:
+        return False
+    rows = [{**_task_row(t), "bucket_id": bucket_id} for t in data["value"]]
+
+    def apply(session: Session):
+        now = time.time()
+        _replace(session, models.MirrorTask, rows, models.MirrorTask.bucket_id == bucket_id, now)
+        _touch(session, f"tasks:{bucket_id}", now)
+
+    await db.run_sync(apply)
+    await db.commit()
+    return True
+
+
+async def refresh_plan_tasks(db: AsyncSession, plan_id: str) -> bool:
+    data = await get_all(f"/planner/plans/{plan_id}/tasks")
+    if not data or "value" not in data:
+        return False
+    rows = [_task_row(t) for t in data["value"]]
+
+    def apply(session: Session):
+        now = time.time()
+        _replace(session, models.MirrorTask, rows, models.MirrorTask.plan_id == plan_id, now)
+        _touch(session, f"plan-tasks:{plan_id}", now)
+
+    await db.run_sync(apply)
+    await db.commit()
+    return True
+
+
+async def refresh_my_tasks(db: AsyncSession) -> bool:
+    data = await get_all("/me/planner/tasks")
+    if not data or "value" not in data:
+        return False
+    rows = [{**_task_row(t), "assigned_to_me": True} for t in data["value"]]
+
+    def apply(session: Session):
+        now = time.time()
+        mine = set()
+        for row in rows:
+            mine.add(row["id"])
+            obj = session.get(models.MirrorTask, row["id"])
+            if obj is None:
+                obj = models.MirrorTask(id=row["id"])
+                session.add(obj)
+            for key, value in row.items():
+                setattr(obj, key, value)
+            obj.synced_at = now
+        # Las tareas que ya no están asignadas siguen en el espejo, pero fuera de "tasks:me"
+        for obj in session.query(models.MirrorTask).filter(models.MirrorTask.assigned_to_me.is_(True)):
+            if obj.id not in mine:
+                obj.assigned_to_me = False
+        _touch(session, "tasks:me", now)
+
+    await db.run_sync(apply)
+    await db.commit()
+    return True
+
+
+async def refresh_scope(db: AsyncSession, scope: str) -> bool:
+    if scope == "plans":
+        return await refresh_plans(db)
+    if scope == "buckets:*":
+        return await refresh_all_buckets(db)
+    if scope == "tasks:me":
+        return await refresh_my_tasks(db)
+    kind, _, key = scope.partition(":")
+    if kind == "buckets":
+        return await refresh_buckets(db, key)
+    if kind == "tasks":
+        return await refresh_tasks(db, key)
+    if kind == "plan-tasks":
+        return await refresh_plan_tasks(db, key)
+    raise ValueError(f"Scope de espejo desconocido: {scope}")
+
+
+async def _background_refresh(scope: str):
+    import delta_sync
+
+    try:
+        async with refresh_budget(), database.AsyncSessionLocal() as db:
+            # Con el delta activo basta con traer lo que cambió desde la última pasada
+            if delta_sync.DELTA_ENABLED and scope != delta_sync.MY_TASKS_SCOPE:
+                ok = await delta_sync.sync_delta(db) is not None or await refresh_scope(db, scope)
+            else:
+                ok = await refresh_scope(db, scope)
+        logger.info(f"[MIRROR] Refresco en segundo plano de {scope} → {'ok' if ok else 'sin datos'}")
+    except Exception as e:
+        logger.warning(f"[MIRROR] Refresco de {scope} falló: {e}")
+    finally:
+        _inflight.pop(scope, None)
+
+
+def schedule_refresh(scope: str):
+    task = _inflight.get(scope)
+    if task is not None and not task.done():
+        return
+    _inflight[scope] = asyncio.get_running_loop().create_task(_background_refresh(scope))
+
+
+# -----------------------------
+# Lecturas (read-through)
+# -----------------------------
+def _rows(db: Session, scope: str) -> List[dict]:
+    if scope == "plans":
+        return [{"id": p.id, "name": p.title} for p in db.query(models.MirrorPlan).order_by(models.MirrorPlan.title, models.MirrorPlan.id)]
+    kind, _, key = scope.partition(":")
+    if kind == "buckets":
+        query = db.query(models.MirrorBucket)
+        if key != "*":
+            query = query.filter(models.MirrorBucket.plan_id == key)
+        return [{"id": b.id, "name": b.name, "plan_id": b.plan_id}
+                for b in query.order_by(models.MirrorBucket.plan_id, models.MirrorBucket.name, models.MirrorBucket.id)]
+    query = db.query(models.MirrorTask)
+    if kind == "plan-tasks":
+        query = query.filter(models.MirrorTask.plan_id == key)
+    elif key == "me":
+        query = query.filter(models.MirrorTask.assigned_to_me.is_(True))
+    else:
+        query = query.filter(models.MirrorTask.bucket_id == key)
+    return [{
+        "id": t.id,
+        "title": t.title,
+        "percent_complete": t.percent_complete or 0,
+        "bucket_id": t.bucket_id or "",
+        "plan_id": t.plan_id or "",
+    } for t in query.order_by(models.MirrorTask.id)]
+
+
+async def ensure_loaded(db: AsyncSession, scope: str) -> bool:
+    """True si el scope está en el espejo (cargándolo de Graph la primera vez).
+
+    Si la copia es más vieja que el TTL se sirve igualmente y se refresca en segundo plano.
+    """
+    access_counts[scope] = access_counts.get(scope, 0) + 1
+    state = await db.get(models.MirrorScope, scope)
+    if state is None:
+        return await refresh_scope(db, scope)
+    if time.time() - state.refreshed_at > MIRROR_TTL:
+        schedule_refresh(scope)
+    return True
+
+
+async def flush_access(db: AsyncSession):
+    """Suma a la BD las lecturas de este worker: el líder prioriza con las de todos."""
+    global access_counts
+    pending, access_counts = access_counts, {}
+    table = models.MirrorScope.__table__
+    for scope, count in pending.items():
+        # Solo scopes ya cargados: la fila la crea el primer refresco
+        await db.execute(update(table).where(table.c.scope == scope)
+                         .values(access_count=table.c.access_count + count))
+    await db.commit()
+
+
+async def hot_scopes(db: AsyncSession, limit: int) -> List[str]:
+    table = models.MirrorScope.__table__
+    query = (select(table.c.scope).where(table.c.access_count > 0)
+             .order_by(table.c.access_count.desc(), table.c.scope).limit(limit))
+    return list((await db.scalars(query)).all())
+
+
+async def decay_access(db: AsyncSession, factor: float = 0.5):
+    table = models.MirrorScope.__table__
+    await db.execute(update(table).values(access_count=table.c.access_count * factor))
+    await db.execute(update(table).where(table.c.access_count < 0.01).values(access_count=0))
+    await db.commit()
+
+
+async def read(db: AsyncSession, scope: str) -> Optional[List[dict]]:
+    """Devuelve la colección desde el espejo; None si nunca se pudo cargar de Graph."""
+    if not await ensure_loaded(db, scope):
+        return None
+    return await db.run_sync(_rows, scope)
+
+
+async def read_plans(db: AsyncSession) -> Optional[List[dict]]:
+    return await read(db, "plans")
+
+
+async def read_buckets(db: AsyncSession, plan_id: str = None) -> Optional[List[dict]]:
+    return await read(db, f"buckets:{plan_id or '*'}")
+
+
+async def read_tasks(db: AsyncSession, bucket_id: str = None) -> Optional[List[dict]]:
+    return await read(db, f"tasks:{bucket_id or 'me'}")
+
+
+async def read_tasks_page(db: AsyncSession, bucket_id: str, criteria: list, limit: Optional[int], after: str = None,
+                          plan_id: str = None) -> Optional[List[dict]]:
+    """Página keyset (ORDER BY id) de las tareas del scope; devuelve hasta limit + 1 filas.
+
+    Scope: el bucket, si no el plan (todas sus tareas, como en Graph), si no "mis tareas".
+    """
+    if bucket_id:
+        scope = f"tasks:{bucket_id}"
+    elif plan_id:
+        scope = f"plan-tasks:{plan_id}"
+    else:
+        scope = "tasks:me"
+    if not await ensure_loaded(db, scope):
+        return None
+    query = select(models.MirrorTask).where(*criteria)
+    if bucket_id:
+        query = query.where(models.MirrorTask.bucket_id == bucket_id)
+    elif plan_id:
+        query = query.where(models.MirrorTask.plan_id == plan_id)
+    else:
+        query = query.where(models.MirrorTask.assigned_to_me.is_(True))
+    if after:
+        query = query.where(models.MirrorTask.id > after)
+    query = query.order_by(models.MirrorTask.id)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = (await db.scalars(query)).all()
+    return [{
+        "id": t.id,
+        "title": t.title,
+        "percent_complete": t.percent_complete or 0,
+        "bucket_id": t.bucket_id or "",
+        "plan_id": t.plan_id or "",
+    } for t in rows]
+
+
+# -----------------------------
+# Escrituras en Graph → espejo
+# -----------------------------
+_ENTITY_RE = re.compile(r"^/planner/(plans|buckets|tasks)(?:/([^/]+))?$")
+_MODELS = {"plans": models.MirrorPlan, "buckets": models.MirrorBucket, "tasks": models.MirrorTask}
+_ROWS = {"plans": _plan_row, "buckets": _bucket_row, "tasks": _task_row}
+_FIELDS = {"title": "title", "name": "name", "percentComplete": "percent_complete", "bucketId": "bucket_id"}
+
+
+async def _on_graph_write(method: str, endpoint: str, data: Optional[dict], result):
+    if not MIRROR_ENABLED or method == "GET":
+        return
+    match = _ENTITY_RE.match(endpoint)
+    if not match:
+        return
+    kind, entity_id = match.groups()
+    model = _MODELS[kind]
+    async with database.AsyncSessionLocal() as db:
+        # change_feed ya publica las escrituras en Graph: este reflejo en el espejo no genera eventos
+        db.info["change_feed"] = False
+        if method == "POST" and entity_id is None and isinstance(result, dict) and "id" in result:
+            row = _ROWS[kind](result)
+            obj = await db.get(model, row["id"]) or model(id=row["id"])
+            for key, value in row.items():
+                setattr(obj, key, value)
+            obj.synced_at = time.time()
+            db.add(obj)
+        elif method == "PATCH" and entity_id:
+            obj = await db.get(model, entity_id)
+            if obj is not None:
+                for graph_key, column in _FIELDS.items():
+                    if data and graph_key in data and hasattr(obj, column):
+                        setattr(obj, column, data[graph_key])
+                # Un PATCH sin representación no devuelve ETag: el guardado queda obsoleto
+                obj.etag = result.get("@odata.etag") if isinstance(result, dict) else None
+                obj.synced_at = time.time()
+        elif method == "DELETE" and entity_id:
+            obj = await db.get(model, entity_id)
+            if obj is not None:
+                await db.delete(obj)
+        await db.commit()
+
+
+graph_client.response_hooks.append(_on_graph_write)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -16,6 +16,8 @@ class Bucket(Base):
     plan_id = Column(Integer, ForeignKey('plans.id'), nullable=False)
     plan = relationship('Plan', back_populates='buckets')
     tasks = relationship('Task', back_populates='bucket', cascade="all, delete-orphan")
+    # Índices compuestos para los listados keyset (filtro + ORDER BY id); se crean vía migrations.py
+    __table_args__ = (Index('ix_buckets_plan_id_id', 'plan_id', 'id'),)
 
 class Task(Base):
     __tablename__ = 'tasks'
@@ -25,3 +27,61 @@ class Task(Base):
     bucket_id = Column(Integer, ForeignKey('buckets.id'), nullable=False)
     plan_id = Column(Integer, ForeignKey('plans.id'), nullable=False)
     bucket = relationship('Bucket', back_populates='tasks')
+    __table_args__ = (
+        Index('ix_tasks_bucket_id_id', 'bucket_id', 'id'),
+        Index('ix_tasks_plan_id_id', 'plan_id', 'id'),
+        Index('ix_tasks_percent_complete_id', 'percent_complete', 'id'),
+    )
+
+# ─── Espejo local de Microsoft Planner (IDs de Graph) ───────────
+class MirrorPlan(Base):
+    __tablename__ = 'mirror_plans'
+    id = Column(String, primary_key=True)
+    title = Column(String, nullable=False, default="")
+    etag = Column(String)
+    synced_at = Column(Float, nullable=False, default=0)
+
+class MirrorBucket(Base):
+    __tablename__ = 'mirror_buckets'
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=False, default="")
+    plan_id = Column(String, nullable=False, index=True)
+    etag = Column(String)
+    synced_at = Column(Float, nullable=False, default=0)
+
+class MirrorTask(Base):
+    __tablename__ = 'mirror_tasks'
+    id = Column(String, primary_key=True)
+    title = Column(String, nullable=False, default="")
+    percent_complete = Column(Integer, default=0)
+    bucket_id = Column(String, index=True)
+    plan_id = Column(String, index=True)
+    assigned_to_me = Column(Boolean, nullable=False, default=False)
+    etag = Column(String)
+    synced_at = Column(Float, nullable=False, default=0)
+    __table_args__ = (
+        Index('ix_mirror_tasks_bucket_id_id', 'bucket_id', 'id'),
+        Index('ix_mirror_tasks_assigned_to_me_id', 'assigned_to_me', 'id'),
+    )
+
+class MirrorScope(Base):
+    # Última sincronización de cada colección ("plans", "buckets:<plan>", "tasks:<bucket>", ...)
+    __tablename__ = 'mirror_scopes'
+    scope = Column(String, primary_key=True)
+    refreshed_at = Column(Float, nullable=False, default=0)
+    # Lecturas recientes sumadas de todos los workers (con decaimiento): prioridad del planificador
+    access_count = Column(Float, nullable=False, default=0, server_default="0")
+
+class MirrorDelta(Base):
+    # deltaLink de Graph para continuar la sincronización incremental
+    __tablename__ = 'mirror_delta'
+    scope = Column(String, primary_key=True)
+    delta_link = Column(String)
+    updated_at = Column(Float, nullable=False, default=0)
+
+class SchedulerLease(Base):
+    # Líder del planificador en segundo plano: un solo worker de uvicorn sincroniza a la vez
+    __tablename__ = 'scheduler_leases'
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False, default=0)
@@ -0,0 +1,180 @@
+import os
+import time
+import uuid
+import random
+import socket
+import asyncio
+import logging
+from typing import List, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+import database
+import delta_sync
+import graph_client
+import mirror
+import models
+
+logger = logging.getLogger("crud-planner")
+
+# Intervalo (s) entre pasadas del planificador; 0 lo desactiva
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "0"))
+# Variación aleatoria del intervalo (fracción): los workers y réplicas no coinciden en el tiempo
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.2"))
+# Scopes más leídos que se refrescan en cada pasada (además de planes, buckets y "mis tareas")
+SCHEDULER_HOT_SCOPES = int(os.getenv("SCHEDULER_HOT_SCOPES", "20"))
+# Duración (s) del lease de líder; por defecto tres intervalos
+SCHEDULER_LEASE = float(os.getenv("SCHEDULER_LEASE", "0"))
+
+LEASE_NAME = "planner-sync"
+# Scopes que se mantienen siempre al día; "plans" no va aparte: "buckets:*" ya relee la lista de planes
+BASE_SCOPES = ["buckets:*", "tasks:me"]
+_COVERED_SCOPES = set(BASE_SCOPES) | {"plans"}
+
+
+def jittered(interval: float, jitter: float = None) -> float:
+    jitter = SCHEDULER_JITTER if jitter is None else jitter
+    return max(0.0, interval * (1 + random.uniform(-jitter, jitter)))
+
+
+class LeaderLease:
+    """Lease en la BD compartida: solo el worker que lo tiene sincroniza; caduca si muere."""
+
+    def __init__(self, name: str = LEASE_NAME, ttl: float = 60, owner: str = None, session_factory=None):
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.session_factory = session_factory or database.AsyncSessionLocal
+
+    async def acquire(self) -> bool:
+        """Toma o renueva el lease; False si lo tiene otro worker y no ha caducado."""
+        now = time.time()
+        table = models.SchedulerLease.__table__
+        async with self.session_factory() as db:
+            # Un único UPDATE condicional: renovar el propio o quedarse con uno caducado
+            result = await db.execute(
+                update(table)
+                .where(table.c.name == self.name)
+                .where((table.c.owner == self.owner) | (table.c.expires_at < now))
+                .values(owner=self.owner, expires_at=now + self.ttl)
+            )
+            if result.rowcount == 0:
+                try:
+                    await db.execute(insert(table).values(name=self.name, owner=self.owner, expires_at=now + self.ttl))
+                except IntegrityError:
+                    await db.rollback()
+                    return False
+            await db.commit()
+            return True
+
+    async def release(self):
+        table = models.SchedulerLease.__table__
+        async with self.session_factory() as db:
+            await db.execute(
+                update(table)
+                .where(table.c.name == self.name, table.c.owner == self.owner)
+                .values(expires_at=0)
+            )
+            await db.commit()
+
+
+class SyncScheduler:
+    def __init__(self, interval: float = None, hot_scopes: int = None, lease: Optional[LeaderLease] = None):
+        self.interval = interval or SCHEDULER_INTERVAL
+        self.hot_scopes = hot_scopes or SCHEDULER_HOT_SCOPES
+        self.lease = lease or LeaderLease(ttl=SCHEDULER_LEASE or self.interval * 3)
+        self.stats = {"runs": 0, "skipped": 0, "refreshed": 0, "failed": 0, "leader": False}
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def scopes(self, db) -> List[str]:
+        """Scopes base y, detrás, los más leídos (en todos los workers) desde la última pasada."""
+        hot = [s for s in await mirror.hot_scopes(db, self.hot_scopes) if s not in _COVERED_SCOPES]
+        return BASE_SCOPES + hot
+
+    async def _refresh(self, scope: str) -> bool:
+        # Mismo cupo que los refrescos en segundo plano del espejo (mirror.schedule_refresh)
+        async with mirror.refresh_budget():
+            if self._stop.is_set():
+                return False
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    return await mirror.refresh_scope(db, scope)
+            except Exception as e:
+                logger.warning(f"[SCHED] Refresco de {scope} falló: {e}")
+                return False
+
+    async def run_once(self) -> Optional[dict]:
+        """Una pasada; None si otro worker es el líder o Graph no está disponible."""
+        # Todos los workers vuelcan sus lecturas; el líder ordena los scopes con el total
+        async with database.AsyncSessionLocal() as db:
+            await mirror.flush_access(db)
+        self.stats["leader"] = await self.lease.acquire()
+        if not self.stats["leader"]:
+            self.stats["skipped"] += 1
+            return None
+        if graph_client.breaker.is_open():
+            logger.info("[SCHED] Circuito de Graph abierto, se omite la pasada")
+            self.stats["skipped"] += 1
+            return None
+        self.stats["runs"] += 1
+        # Con el delta activo una sola pasada incremental cubre todos los scopes
+        if delta_sync.DELTA_ENABLED and await delta_sync.sync_delta() is not None:
+            # Salvo "tasks:me": las asignaciones al usuario no llegan en el delta
+            mine = await self._refresh(delta_sync.MY_TASKS_SCOPE)
+            self.stats["refreshed"] += 1 + int(mine)
+            await self._decay()
+            return {"delta": True}
+        async with database.AsyncSessionLocal() as db:
+            scopes = await self.scopes(db)
+        results = await asyncio.gather(*(self._refresh(scope) for scope in scopes))
+        ok = sum(1 for r in results if r)
+        self.stats["refreshed"] += ok
+        self.stats["failed"] += len(results) - ok
+        await self._decay()
+        logger.info(f"[SCHED] Pasada: {ok}/{len(scopes)} scopes refrescados")
+        return {"delta": False, "scopes": scopes, "refreshed": ok}
+
+    async def _decay(self):
+        async with database.AsyncSessionLocal() as db:
+            await mirror.decay_access(db)
+
+    async def run_forever(self):
+        logger.info(f"[SCHED] Planificador cada ~{self.interval}s (lease {self.lease.owner})")
+        # Primer arranque también con jitter: los workers no compiten por el lease a la vez
+        delay = jittered(self.interval) * random.random()
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=delay)
+                break
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[SCHED] Pasada fallida: {e}")
+            delay = jittered(self.interval)
+
+    def start(self) -> asyncio.Task:
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self.run_forever())
+        return self._task
+
+    async def stop(self, timeout: float = 10):
+        """Deja terminar la pasada en curso (hasta timeout) y libera el lease."""
+        self._stop.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+        if self.stats["leader"]:
+            try:
+                await self.lease.release()
+            except Exception as e:
+                logger.warning(f"[SCHED] No se pudo liberar el lease: {e}")
+            self.stats["leader"] = False
@@ -34,3 +34,21 @@ class TaskCreate(TaskBase):
 class Task(TaskBase):
     id: str
     model_config = ConfigDict(from_attributes=True)
+
+# Operaciones masivas (/tasks/bulk)
+class TaskBulkUpdate(TaskCreate):
+    id: str
+    etag: Optional[str] = None
+
+class TaskBulkDelete(BaseModel):
+    id: str
+    etag: Optional[str] = None
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: int
+    ok: bool
+    task: Optional[Task] = None
+    etag: Optional[str] = None
+    detail: Optional[str] = None
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+
+
+class FakeMsalApp:
+    def __init__(self):
+        self.calls = 0
+
+    def get_accounts(self):
+        return [{"username": "user@example.com"}]
+
+    def acquire_token_silent(self, scopes, account=None):
+        self.calls += 1
+        time.sleep(0.05)
+        return {"access_token": f"tok-{self.calls}", "expires_in": 3600}
+
+
+def test_token_holder_refreshes_once_for_concurrent_callers(monkeypatch):
+    fake = FakeMsalApp()
+    monkeypatch.setattr(auth, "has_cached_account", lambda: True)
+    monkeypatch.setattr(auth, "get_msal_app", lambda: fake)
+    monkeypatch.setattr(auth, "schedule_save", lambda: None)
+    holder = auth.TokenHolder(margin=300)
+
+    async def run():
+        return await asyncio.gather(*(holder.get() for _ in range(10)))
+
+    assert asyncio.run(run()) == ["tok-1"] * 10
+    assert asyncio.run(holder.get()) == "tok-1"
+    assert fake.calls == 1
+
+    # Dentro del margen de expiración se renueva
+    holder._expires_at = time.time() + 100
+    assert asyncio.run(holder.get()) == "tok-2"
+    assert fake.calls == 2
+
+
+def test_token_holder_without_account_skips_msal(monkeypatch):
+    monkeypatch.setattr(auth, "has_cached_account", lambda: False)
+    monkeypatch.setattr(auth, "get_msal_app", lambda: (_ for _ in ()).throw(AssertionError("MSAL no debería usarse")))
+    assert asyncio.run(auth.TokenHolder().get()) is None
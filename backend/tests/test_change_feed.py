@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import change_feed
+import graph_client
+import models
+
+
+def _events(chunks):
+    return [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("id: ")]
+
+
+def test_db_commits_publish_only_visible_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(change_feed, "feed", change_feed.ChangeFeed())
+    engine = create_engine(f"sqlite:///{tmp_path / 'feed.db'}")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    with Session() as db:
+        db.add(models.MirrorTask(id="t1", title="A", percent_complete=0, bucket_id="b", plan_id="p", synced_at=1))
+        db.commit()
+        task = db.get(models.MirrorTask, "t1")
+        task.synced_at = 2  # refresco sin cambios visibles
+        db.commit()
+        task.percent_complete = 50
+        db.commit()
+        task.title = "descartado"
+        db.flush()
+        db.rollback()
+        db.delete(db.get(models.MirrorTask, "t1"))
+        db.commit()
+    engine.dispose()
+
+    history = change_feed.feed.since(f"{change_feed.BOOT_ID}-0")
+    assert [(e["entity"], e["op"], e["source"]) for e in history] == [
+        ("tasks", "created", "graph"), ("tasks", "updated", "graph"), ("tasks", "deleted", "graph")]
+    assert history[1]["data"]["percent_complete"] == 50
+
+
+def test_graph_writes_publish_events(monkeypatch):
+    monkeypatch.setattr(change_feed, "feed", change_feed.ChangeFeed())
+
+    async def run():
+        await graph_client.notify_response("PATCH", "/planner/tasks/abc", {"title": "Nuevo"}, {"ok": True})
+        await graph_client.notify_response("POST", "/planner/plans", {}, {"id": "p9", "title": "Plan G"})
+        await graph_client.notify_response("GET", "/planner/tasks/abc", None, {"id": "abc"})
+
+    asyncio.run(run())
+    history = change_feed.feed.since(f"{change_feed.BOOT_ID}-0")
+    assert [e["data"] for e in history] == [{"id": "abc", "title": "Nuevo"}, {"id": "p9", "name": "Plan G"}]
+
+
+def test_stream_resume_heartbeat_and_reset(monkeypatch):
+    feed = change_feed.ChangeFeed(history=3)
+    monkeypatch.setattr(change_feed, "feed", feed)
+
+    async def take(last_event_id, n, publish=()):
+        gen = change_feed.stream(last_event_id, heartbeat=0.01)
+        out = [await gen.__anext__()]
+        for entity in publish:
+            feed.publish(entity, "updated", {"id": "x"})
+        while len(out) < n:
+            out.append(await gen.__anext__())
+        await gen.aclose()
+        return out
+
+    for i in range(5):
+        feed.publish("tasks", "created", {"id": str(i)})
+    # Reanudar desde el 3.º: el 4.º y el 5.º siguen en el histórico
+    chunks = asyncio.run(take(f"{change_feed.BOOT_ID}-3", 4))
+    assert chunks[0].startswith("retry: ")
+    assert [e["id"] for e in _events(chunks)] == ["3", "4"]
+    assert chunks[3] == ": ping\n\n"
+    # Demasiado antiguo (fuera del histórico) o de otro arranque → reset
+    assert asyncio.run(take(f"{change_feed.BOOT_ID}-1", 2))[1].startswith("event: reset")
+    assert asyncio.run(take("otro-3", 2))[1].startswith("event: reset")
+    # En vivo
+    live = asyncio.run(take(None, 2, publish=["plans"]))
+    assert _events(live)[0]["entity"] == "plans"
+    assert len(feed) == 0
+
+
+def test_slow_subscriber_is_disconnected(monkeypatch):
+    feed = change_feed.ChangeFeed(buffer=2)
+    monkeypatch.setattr(change_feed, "feed", feed)
+
+    async def run():
+        gen = change_feed.stream(None, heartbeat=10)
+        await gen.__anext__()
+        for i in range(10):
+            feed.publish("tasks", "created", {"id": str(i)})
+        rest = [chunk async for chunk in gen]
+        return rest
+
+    # Buffer lleno: se cierra el flujo sin acumular los 10 eventos
+    assert asyncio.run(run()) == []
+    assert len(feed) == 0
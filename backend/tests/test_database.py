@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import models
+
+
+def _engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'group.db'}")
+    database.apply_sqlite_profile(engine.sync_engine, "tuned")
+    return engine
+
+
+def test_sqlite_profile_pragmas(tmp_path):
+    async def run():
+        engine = _engine(tmp_path)
+        async with engine.connect() as conn:
+            mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+            sync = (await conn.execute(text("PRAGMA synchronous"))).scalar()
+        await engine.dispose()
+        return mode, sync
+
+    mode, sync = asyncio.run(run())
+    assert mode == "wal" and sync == 1  # 1 = NORMAL
+
+
+def test_group_commit_batches_and_isolates_failures(tmp_path):
+    async def run():
+        engine = _engine(tmp_path)
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        commits = []
+        event.listen(engine.sync_engine, "commit", lambda conn: commits.append(1))
+        committer = database.GroupCommitter(window_ms=20, session_factory=async_sessionmaker(engine, expire_on_commit=False))
+
+        def insert(title):
+            def write(session):
+                task = models.Task(title=title, percent_complete=0, bucket_id=1, plan_id=1)
+                session.add(task)
+                session.flush()
+                return task.id
+            return write
+
+        results = await asyncio.gather(*(committer.submit(insert(t)) for t in ["a", None, "b", "c"]), return_exceptions=True)
+        async with async_sessionmaker(engine)() as db:
+            count = await db.scalar(select(func.count()).select_from(models.Task))
+        await engine.dispose()
+        return results, count, len(commits)
+
+    results, count, commits = asyncio.run(run())
+    assert isinstance(results[1], Exception)
+    assert [r for r in results if not isinstance(r, Exception)] == [1, 2, 3]
+    assert count == 3 and commits == 1
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+
+import httpx
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+import database
+import delta_sync
+import graph_client
+import models
+
+
+async def fake_token():
+    return "tok"
+
+
+def test_delta_sync_applies_pages_and_resumes(monkeypatch):
+    task = "#microsoft.graph.plannerTask"
+    pages = {
+        "/beta/me/planner/all/delta": {
+            "value": [
+                {"@odata.type": "#microsoft.graph.plannerPlan", "id": "p1", "title": "Plan"},
+                {"@odata.type": task, "id": "t1", "title": "Uno", "bucketId": "b1", "planId": "p1", "@odata.etag": "W/\"1\""},
+            ],
+            "@odata.nextLink": "https://graph.microsoft.com/beta/me/planner/all/delta?page=2",
+        },
+        "page=2": {
+            "value": [{"@odata.type": task, "id": "t2", "title": "Dos", "bucketId": "b1", "planId": "p1"}],
+            "@odata.deltaLink": "https://graph.microsoft.com/beta/me/planner/all/delta?token=A",
+        },
+        "token=A": {
+            "value": [
+                {"@odata.type": task, "id": "t1", "percentComplete": 100, "@odata.etag": "W/\"2\""},
+                {"@odata.type": task, "id": "t2", "@removed": {"reason": "deleted"}},
+                {"@odata.type": "#microsoft.graph.plannerTaskDetails", "id": "t1", "description": "x"},
+            ],
+            "@odata.deltaLink": "https://graph.microsoft.com/beta/me/planner/all/delta?token=B",
+        },
+    }
+    seen = []
+
+    def handler(request):
+        key = request.url.query.decode() or request.url.path
+        seen.append(key)
+        return httpx.Response(200, json=pages[key])
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    database.engine.dispose()
+    asyncio.run(database.async_engine.dispose())
+    database.init_db()
+    db = database.SessionLocal()
+    for model in (models.MirrorPlan, models.MirrorTask, models.MirrorDelta):
+        db.query(model).delete()
+    db.commit()
+
+    db.close()
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        async with database.AsyncSessionLocal() as session:
+            first = await delta_sync.sync_delta(session)
+            second = await delta_sync.sync_delta(session)
+        await graph_client.close_client()
+        await database.async_engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["full"] is True and first["mirror_tasks"] == 2
+    assert second["full"] is False and second["removed"] == 1
+    assert seen == ["/beta/me/planner/all/delta", "page=2", "token=A"]
+
+    db = database.SessionLocal()
+    t1 = db.get(models.MirrorTask, "t1")
+    assert (t1.title, t1.percent_complete, t1.etag) == ("Uno", 100, "W/\"2\"")
+    assert db.get(models.MirrorTask, "t2") is None
+    assert db.get(models.MirrorDelta, "me").delta_link.endswith("token=B")
+    db.close()
+
+
+def test_delta_sync_repeated_ids_and_my_tasks_scope(monkeypatch):
+    task = "#microsoft.graph.plannerTask"
+    pages = {
+        "/beta/me/planner/all/delta": {
+            "value": [
+                {"@odata.type": task, "id": "t1", "title": "Uno", "planId": "p1"},
+                {"@odata.type": task, "id": "t3", "title": "Tres", "planId": "p1"},
+            ],
+            "@odata.nextLink": "https://graph.microsoft.com/beta/me/planner/all/delta?page=2",
+        },
+        "page=2": {
+            # La misma tarea en otra página de la misma pasada (y una creada y borrada)
+            "value": [
+                {"@odata.type": task, "id": "t1", "percentComplete": 50},
+                {"@odata.type": task, "id": "t3", "@removed": {"reason": "deleted"}},
+            ],
+            "@odata.deltaLink": "https://graph.microsoft.com/beta/me/planner/all/delta?token=A",
+        },
+    }
+
+    def handler(request):
+        return httpx.Response(200, json=pages[request.url.query.decode() or request.url.path])
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    database.engine.dispose()
+    asyncio.run(database.async_engine.dispose())
+    database.init_db()
+    db = database.SessionLocal()
+    for model in (models.MirrorTask, models.MirrorDelta, models.MirrorScope):
+        db.query(model).delete()
+    db.add_all([models.MirrorScope(scope="tasks:me", refreshed_at=1), models.MirrorScope(scope="plans", refreshed_at=1)])
+    db.commit()
+    db.close()
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        async with database.AsyncSessionLocal() as session:
+            stats = await delta_sync.sync_delta(session)
+        await graph_client.close_client()
+        await database.async_engine.dispose()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats is not None and stats["removed"] == 1
+
+    db = database.SessionLocal()
+    t1 = db.get(models.MirrorTask, "t1")
+    assert (t1.title, t1.percent_complete) == ("Uno", 50)
+    assert db.get(models.MirrorTask, "t3") is None
+    assert db.get(models.MirrorScope, "plans").refreshed_at > 1
+    assert db.get(models.MirrorScope, "tasks:me").refreshed_at == 1
+    db.close()
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+import etag_cache
+import graph_client
+
+
+async def fake_token():
+    return "tok"
+
+
+def _graph(current_etag, seen):
+    def handler(request):
+        seen.append((request.method, request.url.path.replace("/v1.0", "")))
+        if request.method == "GET":
+            return httpx.Response(200, json={"id": "t1", "@odata.etag": current_etag[0]})
+        if request.headers.get("If-Match") != current_etag[0]:
+            return httpx.Response(412, json={"error": {"code": "PreconditionFailed"}})
+        current_etag[0] = current_etag[0] + "+"
+        if request.method == "DELETE":
+            return httpx.Response(204)
+        return httpx.Response(200, json={"id": "t1", "title": "x", "@odata.etag": current_etag[0]})
+    return handler
+
+
+def _batch_graph(current, calls):
+    def answer(method, path, if_match):
+        entity_id = path.rsplit("/", 1)[-1]
+        if entity_id not in current:
+            return 404, {"error": {"code": "NotFound"}}
+        if method == "GET":
+            return 200, {"id": entity_id, "@odata.etag": current[entity_id]}
+        if if_match != current[entity_id]:
+            return 412, {"error": {"code": "PreconditionFailed"}}
+        current[entity_id] += "+"
+        return 200, {"id": entity_id, "@odata.etag": current[entity_id]}
+
+    def handler(request):
+        if not request.url.path.endswith("/$batch"):
+            # Un lote de un solo elemento se envía como petición directa
+            calls.append([request.method])
+            status, payload = answer(request.method, request.url.path, request.headers.get("If-Match"))
+            return httpx.Response(status, json=payload)
+        body = json.loads(request.content)
+        calls.append([r["method"] for r in body["requests"]])
+        responses = []
+        for r in body["requests"]:
+            status, payload = answer(r["method"], r["url"], r.get("headers", {}).get("If-Match"))
+            responses.append({"id": r["id"], "status": status, "body": payload})
+        return httpx.Response(200, json={"responses": responses})
+    return handler
+
+
+def _run(handler, coro_fn):
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        try:
+            return await coro_fn()
+        finally:
+            await graph_client.close_client()
+    return asyncio.run(run())
+
+
+def test_lru_is_bounded():
+    cache = etag_cache.ETagCache(maxsize=2)
+    cache.put("tasks", "a", "1")
+    cache.put("tasks", "b", "2")
+    cache.get("tasks", "a")
+    cache.put("tasks", "c", "3")
+    assert cache.get("tasks", "b") is None
+    assert cache.get("tasks", "a") == "1" and len(cache) == 2
+
+
+def test_conditional_write_skips_get_when_cached(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    etag_cache.etags.clear()
+    current, seen = ["W/\"1\""], []
+
+    async def flow():
+        # La lectura de la colección llena la caché
+        await graph_client.graph_call("GET", "/planner/tasks/t1")
+        seen.clear()
+        first = await etag_cache.conditional_write("tasks", "t1", "PATCH", data={"title": "x"})
+        second = await etag_cache.conditional_write("tasks", "t1", "PATCH", data={"title": "y"})
+        return first, second
+
+    first, second = _run(_graph(current, seen), flow)
+    assert seen == [("PATCH", "/planner/tasks/t1"), ("PATCH", "/planner/tasks/t1")]
+    assert first.ok and first.etag == "W/\"1\"+"
+    assert second.etag == "W/\"1\"++"
+
+
+def test_conditional_write_refetches_on_stale_cache(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    etag_cache.etags.clear()
+    etag_cache.etags.put("tasks", "t1", "W/\"viejo\"")
+    current, seen = ["W/\"5\""], []
+
+    res = _run(_graph(current, seen), lambda: etag_cache.conditional_write("tasks", "t1", "DELETE"))
+    assert res.ok
+    assert [m for m, _ in seen] == ["DELETE", "GET", "DELETE"]
+    assert etag_cache.etags.get("tasks", "t1") is None
+
+
+def test_conditional_write_respects_client_etag(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    etag_cache.etags.clear()
+    current, seen = ["W/\"5\""], []
+
+    res = _run(_graph(current, seen), lambda: etag_cache.conditional_write("tasks", "t1", "PATCH", data={}, if_match="W/\"1\""))
+    assert res.status == 412
+    assert [m for m, _ in seen] == ["PATCH"]
+
+
+def test_conditional_write_many_reports_per_item(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    etag_cache.etags.clear()
+    etag_cache.etags.put("tasks", "a", "W/\"viejo\"")
+    current = {"a": "W/\"1\"", "b": "W/\"2\""}
+    calls = []
+
+    handler = _batch_graph(current, calls)
+
+    items = [("a", {"title": "x"}, None), ("b", {"title": "y"}, None), ("zz", {"title": "z"}, None)]
+    results = _run(handler, lambda: etag_cache.conditional_write_many("tasks", "PATCH", items))
+    assert [r.status for r in results] == [200, 200, 404]
+    assert results[0].etag == "W/\"1\"+" and results[1].etag == "W/\"2\"+"
+    # GET de los ETags que faltan, PATCH en lote y reintento solo del ETag obsoleto
+    assert calls == [["GET", "GET"], ["PATCH", "PATCH"], ["GET"], ["PATCH"]]
+
+
+def test_concurrent_writes_share_etag_batch(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    etag_cache.etags.clear()
+    current = {"a": "W/\"1\"", "b": "W/\"2\"", "c": "W/\"3\""}
+    calls = []
+
+    async def flow():
+        return await asyncio.gather(*(
+            etag_cache.conditional_write("tasks", entity_id, "PATCH", data={"title": entity_id}) for entity_id in current
+        ))
+
+    results = _run(_batch_graph(current, calls), flow)
+    assert [r.status for r in results] == [200, 200, 200]
+    assert [r.etag for r in results] == ["W/\"1\"+", "W/\"2\"+", "W/\"3\"+"]
+    # Los tres ETags que faltaban se leen en un único /$batch
+    assert calls == [["GET", "GET", "GET"], ["PATCH"], ["PATCH"], ["PATCH"]]
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+import graph_batch
+import graph_client
+from graph_batch import BatchRequest
+
+
+async def fake_token():
+    return "tok"
+
+
+def _batch_handler(posts):
+    def handler(request):
+        assert request.url.path.endswith("/$batch")
+        items = json.loads(request.content)["requests"]
+        posts.append(items)
+        responses = []
+        for item in items:
+            if item.get("headers", {}).get("If-Match") == "W/\"old\"":
+                responses.append({"id": item["id"], "status": 412, "body": {"error": {"code": "PreconditionFailed"}}})
+            elif item["method"] == "PATCH":
+                responses.append({"id": item["id"], "status": 200, "headers": {"ETag": "W/\"new\""}, "body": {"id": item["url"]}})
+            else:
+                responses.append({"id": item["id"], "status": 200, "body": {"id": item["url"], "@odata.etag": "W/\"e\""}})
+        return httpx.Response(200, json={"responses": list(reversed(responses))})
+    return handler
+
+
+def test_batch_call_chunks_and_unpacks(monkeypatch):
+    posts = []
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    # Cubetas del limitador vacías de peticiones de otros tests
+    monkeypatch.setattr(graph_client, "_buckets", {})
+
+    reqs = [BatchRequest("GET", f"/planner/tasks/t{i}") for i in range(45)]
+    reqs.append(BatchRequest("PATCH", "/planner/tasks/x", data={"title": "x"}, etag="W/\"old\""))
+    reqs.append(BatchRequest("PATCH", "/planner/tasks/y", data={"title": "y"}, etag="W/\"cur\""))
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(_batch_handler(posts)))
+        results = await graph_batch.batch_call(reqs)
+        await graph_client.close_client()
+        return results
+
+    results = asyncio.run(run())
+    assert [len(p) for p in posts] == [20, 20, 7]
+    assert [r.body["id"] for r in results[:45]] == [f"/planner/tasks/t{i}" for i in range(45)]
+    assert results[45].precondition_failed and results[45].value() is None
+    assert results[46].etag == "W/\"new\""
+    assert results[46].value()["@odata.etag"] == "W/\"new\""
+
+
+def test_batcher_groups_requests_in_window(monkeypatch):
+    posts = []
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(_batch_handler(posts)))
+        results = await asyncio.gather(*(
+            graph_batch.graph_call_batched("GET", f"/planner/plans/p{i}") for i in range(5)
+        ))
+        await graph_client.close_client()
+        return results
+
+    results = asyncio.run(run())
+    assert len(posts) == 1
+    assert [r["id"] for r in results] == [f"/planner/plans/p{i}" for i in range(5)]
+
+
+def test_batcher_close_flushes_window_and_waits(monkeypatch):
+    posts = []
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    batcher = graph_batch.GraphBatcher(window_ms=60_000)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(_batch_handler(posts)))
+        calls = [asyncio.ensure_future(batcher.submit(BatchRequest("GET", f"/planner/plans/p{i}"))) for i in range(3)]
+        await asyncio.sleep(0)
+        # Sin cerrar, la ventana de un minuto retendría las peticiones
+        await batcher.close()
+        assert not batcher._dispatches
+        results = await asyncio.gather(*calls)
+        await graph_client.close_client()
+        return results
+
+    results = asyncio.run(run())
+    assert len(posts) == 1
+    assert [r.body["id"] for r in results] == [f"/planner/plans/p{i}" for i in range(3)]
+
+def test_batch_call_retries_only_throttled_subrequests(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    sent = []
+
+    def handler(request):
+        if not request.url.path.endswith("/$batch"):
+            sent.append([request.url.path.rsplit("/", 1)[-1]])
+            return httpx.Response(200, json={"id": "t1"})
+        items = json.loads(request.content)["requests"]
+        sent.append([item["url"].rsplit("/", 1)[-1] for item in items])
+        responses = [{"id": item["id"], "status": 200, "body": {"id": item["url"]}} for item in items]
+        responses[1] = {"id": items[1]["id"], "status": 429, "headers": {"Retry-After": "0"}}
+        return httpx.Response(200, json={"responses": responses})
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        results = await graph_batch.batch_call([BatchRequest("GET", f"/planner/tasks/t{i}") for i in range(3)])
+        await graph_client.close_client()
+        return results
+
+    results = asyncio.run(run())
+    assert [r.status for r in results] == [200, 200, 200]
+    assert sent == [["t0", "t1", "t2"], ["t1"]]
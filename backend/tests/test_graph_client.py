@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+import graph_client
+from graph_client import graph_call
+
+
+async def fake_token():
+    return "tok"
+
+
+def test_graph_call_reuses_shared_client(monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"value": []})
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+
+    async def run():
+        client = await graph_client.start_client(httpx.MockTransport(handler))
+        await graph_call("GET", "/me/planner/plans")
+        await graph_call("GET", "/me/planner/plans")
+        assert graph_client.get_client() is client
+        await graph_client.close_client()
+
+    asyncio.run(run())
+    assert len(seen) == 2
+    assert str(seen[0].url) == "https://graph.microsoft.com/v1.0/me/planner/plans"
+    assert seen[0].headers["Authorization"] == "Bearer tok"
+
+
+def test_graph_call_error_returns_none(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(lambda r: httpx.Response(404, json={})))
+        res = await graph_call("GET", "/planner/plans/x")
+        await graph_client.close_client()
+        return res
+
+    assert asyncio.run(run()) is None
+
+
+def test_fan_out_keeps_order_and_limit():
+    in_flight = 0
+    peak = 0
+
+    async def work(n):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01 * (5 - n % 5))
+        in_flight -= 1
+        return n * 10
+
+    result = asyncio.run(graph_client.fan_out(range(12), work, limit=3))
+    assert result == [n * 10 for n in range(12)]
+    assert peak == 3
+
+
+def test_graphql_plans_fans_out_in_order(monkeypatch):
+    from graphql_schema import schema
+
+    def route(path):
+        if path == "/me/planner/plans":
+            return 200, {"value": [{"id": "p1", "title": "Uno"}, {"id": "p2", "title": "Dos"}]}
+        if path.endswith("/buckets"):
+            plan_id = path.split("/")[3]
+            return 200, {"value": [{"id": f"{plan_id}-b{i}", "name": f"B{i}"} for i in range(2)]}
+        if path.endswith("/tasks"):
+            bucket_id = path.split("/")[3]
+            return 200, {"value": [{"id": f"{bucket_id}-t", "title": "T", "percentComplete": 50}]}
+        return 404, {}
+
+    def handler(request):
+        path = request.url.path.replace("/v1.0", "")
+        if path == "/$batch":
+            responses = []
+            for item in json.loads(request.content)["requests"]:
+                status, body = route(item["url"])
+                responses.append({"id": item["id"], "status": status, "body": body})
+            return httpx.Response(200, json={"responses": responses[::-1]})
+        status, body = route(path)
+        return httpx.Response(status, json=body)
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        result = await schema.execute("{ plans { id buckets { id tasks { id } } } }", context_value={"db": None})
+        await graph_client.close_client()
+        return result
+
+    result = asyncio.run(run())
+    assert result.errors is None
+    plans = result.data["plans"]
+    assert [p["id"] for p in plans] == ["p1", "p2"]
+    assert [b["id"] for b in plans[1]["buckets"]] == ["p2-b0", "p2-b1"]
+    assert plans[0]["buckets"][1]["tasks"] == [{"id": "p1-b1-t"}]
+
+
+def test_get_all_follows_next_link(monkeypatch):
+    next_url = "https://graph.microsoft.com/v1.0/planner/buckets/b1/tasks?$skiptoken=2"
+
+    def handler(request):
+        if "skiptoken" in str(request.url):
+            return httpx.Response(200, json={"value": [{"id": "t3"}]})
+        return httpx.Response(200, json={"value": [{"id": "t1"}, {"id": "t2"}], "@odata.nextLink": next_url})
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        full = await graph_client.get_all("/planner/buckets/b1/tasks")
+        streamed = [t["id"] async for t in graph_client.iter_collection("/planner/buckets/b1/tasks")]
+        await graph_client.close_client()
+        return full, streamed
+
+    full, streamed = asyncio.run(run())
+    assert [t["id"] for t in full["value"]] == ["t1", "t2", "t3"]
+    assert streamed == ["t1", "t2", "t3"]
+
+
+def test_graph_call_retries_throttled_with_retry_after(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    monkeypatch.setattr(graph_client, "stats", dict.fromkeys(graph_client.stats, 0))
+    answers = [httpx.Response(429, headers={"Retry-After": "0"}), httpx.Response(503), httpx.Response(200, json={"id": "p1"})]
+    monkeypatch.setattr(graph_client, "GRAPH_RETRY_BASE", 0.001)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(lambda r: answers.pop(0)))
+        res = await graph_call("GET", "/planner/plans/p1")
+        await graph_client.close_client()
+        return res
+
+    assert asyncio.run(run())["id"] == "p1"
+    assert graph_client.stats["retries"] == 2 and graph_client.stats["throttled"] == 2
+
+
+def test_graph_call_gives_up_on_long_retry_after(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        res = await graph_call("GET", "/planner/plans/p1")
+        await graph_client.close_client()
+        return res
+
+    assert asyncio.run(run()) is None
+    assert len(seen) == 1
+
+
+def test_token_bucket_spaces_out_bursts():
+    bucket = graph_client.TokenBucket(rate=100, capacity=2)
+
+    async def run():
+        return [await bucket.acquire() for _ in range(4)]
+
+    waits = asyncio.run(run())
+    assert waits[:2] == [0.0, 0.0]
+    assert all(w > 0 for w in waits[2:])
+
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    breaker = graph_client.CircuitBreaker(threshold=2, cooldown=0.05)
+    monkeypatch.setattr(graph_client, "breaker", breaker)
+    seen = []
+    down = [True]
+
+    def handler(request):
+        seen.append(request)
+        if down[0]:
+            raise httpx.ConnectError("sin red", request=request)
+        return httpx.Response(200, json={"id": "p1"})
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        results = [await graph_call("GET", "/planner/plans/p1") for _ in range(4)]
+        assert breaker.state == "open" and len(seen) == 2
+        await asyncio.sleep(0.06)
+        down[0] = False
+        results.append(await graph_call("GET", "/planner/plans/p1"))
+        await graph_client.close_client()
+        return results
+
+    results = asyncio.run(run())
+    assert results[:4] == [None] * 4
+    assert results[4]["id"] == "p1" and breaker.state == "closed"
+    assert len(seen) == 3
+
+
+def test_graphql_plans_only_fetches_selected_fields(monkeypatch):
+    from graphql_schema import schema
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path.replace("/v1.0", ""))
+        return httpx.Response(200, json={"value": [{"id": "p1", "title": "Uno"}]})
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        result = await schema.execute("{ plans { id name } }", context_value={"db": None})
+        await graph_client.close_client()
+        return result
+
+    result = asyncio.run(run())
+    assert result.errors is None and result.data["plans"] == [{"id": "p1", "name": "Uno"}]
+    assert paths == ["/me/planner/plans"]
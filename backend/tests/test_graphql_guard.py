@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import os
+import sys
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graphql_guard
+from graphql_schema import schema
+
+
+def _execute(query, extensions=None):
+    return asyncio.run(schema.execute(query, context_value={"db": None}, operation_extensions=extensions))
+
+
+def test_cost_counts_nested_lists():
+    from graphql import parse
+    doc = parse("{ plans { id buckets { id tasks { id } } } }")
+    cost = graphql_guard.operation_cost(doc.definitions[0], schema._schema, {})
+    # 1 (plans) + 10 planes × (1 buckets + 10 buckets × 1 tasks)
+    assert cost == 111
+
+
+def test_costly_query_rejected_with_cost(monkeypatch):
+    monkeypatch.setattr(graphql_guard, "GRAPHQL_MAX_COST", 200)
+    aliases = " ".join(f"a{i}: plans {{ buckets {{ tasks {{ id }} }} }}" for i in range(2))
+    result = _execute(f"query Caro {{ {aliases} }}")
+    assert result.data is None
+    error = result.errors[0]
+    assert error.extensions["code"] == "QUERY_TOO_COSTLY" and error.extensions["cost"] == 222
+
+
+def test_depth_limit(monkeypatch):
+    monkeypatch.setattr(graphql_guard, "GRAPHQL_MAX_DEPTH", 2)
+    result = _execute("query Hondo { plans { buckets { tasks { title } } } }")
+    assert result.data is None
+    assert "exceeds maximum operation depth" in result.errors[0].message
+
+
+def test_persisted_query_roundtrip():
+    graphql_guard.persisted_queries.clear()
+    query = "{ __typename }"
+    sha = hashlib.sha256(query.encode()).hexdigest()
+    ext = {"persistedQuery": {"version": 1, "sha256Hash": sha}}
+
+    missing = _execute(None, ext)
+    assert missing.errors[0].extensions["code"] == "PERSISTED_QUERY_NOT_FOUND"
+
+    assert _execute(query, ext).data == {"__typename": "Query"}
+    assert _execute(None, ext).data == {"__typename": "Query"}
+
+    mismatch = _execute("{ __typename __schema { queryType { name } } }", ext)
+    assert mismatch.errors[0].extensions["code"] == "PERSISTED_QUERY_HASH_MISMATCH"
+
+
+def test_validation_is_cached_across_requests():
+    from strawberry.extensions.validation_cache import _get_validate_cache
+
+    cache = _get_validate_cache(graphql_guard.GRAPHQL_DOCUMENT_CACHE)
+    before = cache.cache_info()
+    for _ in range(3):
+        assert _execute("query Cacheada { __typename }").errors is None
+    after = cache.cache_info()
+    assert after.misses - before.misses == 1 and after.hits - before.hits == 2
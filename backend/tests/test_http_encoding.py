@@ -0,0 +1,98 @@
+import os
+import sys
+import gzip
+import json
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_encoding
+
+
+def _app():
+    app = FastAPI()
+    app.add_middleware(http_encoding.CompressionMiddleware, minimum_size=100)
+
+    @app.get("/big")
+    def big():
+        return http_encoding.FastJSONResponse([{"id": str(i), "title": f"Tarea {i}"} for i in range(200)])
+
+    @app.get("/small")
+    def small():
+        return http_encoding.FastJSONResponse({"ok": True})
+
+    @app.get("/tagged")
+    def tagged():
+        return http_encoding.FastJSONResponse([{"id": str(i)} for i in range(200)], headers={"ETag": '"v1"'})
+
+    @app.get("/stream")
+    def stream():
+        rows = (json.dumps({"id": i}) + "\n" for i in range(50))
+        return StreamingResponse(rows, media_type="application/x-ndjson", headers={"ETag": 'W/"s1"'})
+
+    return app
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(http_encoding, "brotli", object())
+    assert http_encoding.choose_encoding("gzip, deflate, br") == "br"
+    assert http_encoding.choose_encoding("br;q=0.5, gzip") == "gzip"
+    assert http_encoding.choose_encoding("br;q=0, *") == "gzip"
+    assert http_encoding.choose_encoding("identity") == "identity"
+    monkeypatch.setattr(http_encoding, "brotli", None)
+    assert http_encoding.choose_encoding("br") == "identity"
+
+
+def test_gzip_above_threshold_only():
+    with TestClient(_app()) as client:
+        # El cliente de pruebas descomprime solo; se lee el cuerpo crudo
+        raw = client.get("/big", headers={"Accept-Encoding": "gzip"})
+        assert raw.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in raw.headers["Vary"]
+        assert len(raw.json()) == 200
+        assert int(raw.headers["Content-Length"]) < len(json.dumps(raw.json()))
+
+        small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in small.headers and small.json() == {"ok": True}
+
+        plain = client.get("/big", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in plain.headers
+
+
+def test_fast_json_response_matches_json():
+    rows = [{"id": "a", "title": "ñandú", "percent_complete": 50}]
+    assert json.loads(http_encoding.FastJSONResponse(rows).body) == rows
+    assert gzip.decompress(gzip.compress(http_encoding.dumps(rows))) == http_encoding.dumps(rows)
+
+
+def test_compressed_responses_get_weak_etag():
+    with TestClient(_app()) as client:
+        compressed = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert compressed.headers["ETag"] == 'W/"v1"'
+        # Sin comprimir el cuerpo es el original: el ETag fuerte se conserva
+        assert client.get("/tagged", headers={"Accept-Encoding": "identity"}).headers["ETag"] == '"v1"'
+
+
+def test_streamed_gzip_without_content_length():
+    with TestClient(_app()) as client:
+        with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+            raw = b"".join(response.iter_raw())
+        assert response.headers["Content-Encoding"] == "gzip" and "Content-Length" not in response.headers
+        assert response.headers["ETag"] == 'W/"s1"'
+        lines = zlib.decompress(raw, 31).decode().splitlines()
+        assert [json.loads(line)["id"] for line in lines] == list(range(50))
+
+
+def test_brotli_round_trip():
+    brotli = pytest.importorskip("brotli")
+    with TestClient(_app()) as client:
+        with client.stream("GET", "/big", headers={"Accept-Encoding": "br"}) as response:
+            raw = b"".join(response.iter_raw())
+        assert response.headers["Content-Encoding"] == "br"
+        assert len(json.loads(brotli.decompress(raw))) == 200
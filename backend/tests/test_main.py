@@ -1,5 +1,7 @@
 import pytest
+import asyncio
 import os
+import json
 import sys
 from fastapi.testclient import TestClient
 
@@ -10,14 +12,20 @@ os.environ["DATABASE_URL"] = "sqlite:///./test.db"
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from main import app
+import database
+import listing
 
 @pytest.fixture(scope="module", autouse=True)
 def cleanup():
-    # Eliminar DB de test si existe antes de empezar
+    # Eliminar DB de test si existe antes de empezar (cerrando conexiones abiertas por otros tests)
+    database.engine.dispose()
+    asyncio.run(database.async_engine.dispose())
     if os.path.exists("./test.db"):
         os.remove("./test.db")
     yield
     # Limpieza final opcional
+    database.engine.dispose()
+    asyncio.run(database.async_engine.dispose())
     if os.path.exists("./test.db"):
         os.remove("./test.db")
 
@@ -48,3 +56,148 @@ def test_create_plan_local():
         data = response.json()
         assert data["name"] == "Test Plan Local"
         assert "id" in data
+
+def test_stream_tasks_local_ndjson():
+    with TestClient(app) as client:
+        plan = client.post("/plans", json={"name": "Plan Stream"}).json()
+        bucket = client.post("/buckets", json={"name": "B", "plan_id": plan["id"]}).json()
+        for i in range(3):
+            client.post("/tasks", json={"title": f"T{i}", "bucket_id": bucket["id"], "plan_id": plan["id"]})
+        response = client.get(f"/tasks/stream?bucket_id={bucket['id']}")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["title"] for r in rows] == ["T0", "T1", "T2"]
+
+def test_graphql_local_fallback_async_session():
+    with TestClient(app) as client:
+        created = client.post("/graphql", json={"query": 'mutation { createPlan(name: "GQL Local") { id name } }'}).json()
+        assert created["data"]["createPlan"]["name"] == "GQL Local"
+        plans = client.post("/graphql", json={"query": "{ plans { name buckets { id tasks { id } } } }"}).json()
+        assert "GQL Local" in [p["name"] for p in plans["data"]["plans"]]
+
+def test_bulk_tasks_local_partial_failures():
+    with TestClient(app) as client:
+        plan = client.post("/plans", json={"name": "Plan Bulk"}).json()
+        bucket = client.post("/buckets", json={"name": "B", "plan_id": plan["id"]}).json()
+        created = client.post("/tasks/bulk", json=[
+            {"title": f"Bulk {i}", "bucket_id": bucket["id"], "plan_id": plan["id"]} for i in range(3)
+        ]).json()
+        assert [r["status"] for r in created] == [201, 201, 201]
+        ids = [r["id"] for r in created]
+
+        updates = [{"id": task_id, "title": "Hecha", "percent_complete": 100,
+                    "bucket_id": bucket["id"], "plan_id": plan["id"]} for task_id in ids + ["999999"]]
+        updated = client.put("/tasks/bulk", json=updates).json()
+        assert [r["ok"] for r in updated] == [True, True, True, False]
+        assert updated[3]["status"] == 404 and updated[0]["task"]["percent_complete"] == 100
+
+        deleted = client.request("DELETE", "/tasks/bulk", json=[{"id": ids[0]}, {"id": "999999"}]).json()
+        assert [r["status"] for r in deleted] == [204, 404]
+        remaining = client.get(f"/tasks?bucket_id={bucket['id']}").json()
+        assert sorted(t["id"] for t in remaining) == sorted(ids[1:])
+
+def test_graph_stats_counters():
+    with TestClient(app) as client:
+        data = client.get("/graph/stats").json()
+        assert {"retries", "throttled", "throttled_seconds", "limiter_wait_seconds"} <= set(data)
+
+def test_graph_status_reports_breaker_state():
+    with TestClient(app) as client:
+        data = client.get("/graph/status").json()
+        assert data["state"] in ("closed", "open", "half_open")
+
+def test_graphql_local_loaders_resolve_nested_fields():
+    with TestClient(app) as client:
+        plan = client.post("/plans", json={"name": "Plan Loader"}).json()
+        bucket = client.post("/buckets", json={"name": "BL", "plan_id": plan["id"]}).json()
+        client.post("/tasks", json={"title": "TL", "bucket_id": bucket["id"], "plan_id": plan["id"]})
+        data = client.post("/graphql", json={"query": "{ plans { id buckets { name tasks { title } } } }"}).json()
+        loaded = next(p for p in data["data"]["plans"] if p["id"] == plan["id"])
+        assert loaded["buckets"] == [{"name": "BL", "tasks": [{"title": "TL"}]}]
+
+def test_tasks_keyset_pagination_and_filters(monkeypatch):
+    with TestClient(app) as client:
+        plan = client.post("/plans", json={"name": "Plan Keyset"}).json()
+        bucket = client.post("/buckets", json={"name": "K", "plan_id": plan["id"]}).json()
+        client.post("/tasks/bulk", json=[
+            {"title": f"K{i}", "percent_complete": i * 10, "bucket_id": bucket["id"], "plan_id": plan["id"]} for i in range(5)
+        ])
+        seen, after = [], None
+        while True:
+            params = {"bucket_id": bucket["id"], "limit": 2, **({"after": after} if after else {})}
+            response = client.get("/tasks", params=params)
+            seen += [t["title"] for t in response.json()]
+            after = response.headers.get("X-Next-Cursor")
+            if not after:
+                break
+        assert seen == ["K0", "K1", "K2", "K3", "K4"]
+
+        # Sin limit ni after: todas las tareas, sin cursor (clientes anteriores a la paginación)
+        monkeypatch.setattr(listing, "LIST_PAGE_SIZE", 2)
+        unbounded = client.get("/tasks", params={"bucket_id": bucket["id"]})
+        assert len(unbounded.json()) == 5 and "X-Next-Cursor" not in unbounded.headers
+
+        mid = client.get("/tasks", params={"plan_id": plan["id"], "min_percent": 10, "max_percent": 30}).json()
+        assert [t["title"] for t in mid] == ["K1", "K2", "K3"]
+
+        page = client.post("/graphql", json={"query": "query($p: ID) { tasks(planId: $p, limit: 2, minPercent: 20) { items { title } nextCursor } }",
+                                             "variables": {"p": plan["id"]}}).json()["data"]["tasks"]
+        assert [t["title"] for t in page["items"]] == ["K2", "K3"] and page["nextCursor"]
+
+def test_list_conditional_get():
+    with TestClient(app) as client:
+        plan = client.post("/plans", json={"name": "Plan 304"}).json()
+        bucket = client.post("/buckets", json={"name": "C", "plan_id": plan["id"]}).json()
+        client.post("/tasks", json={"title": "C1", "bucket_id": bucket["id"], "plan_id": plan["id"]})
+        params = {"bucket_id": bucket["id"]}
+        first = client.get("/tasks", params=params)
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        again = client.get("/tasks", params=params, headers={"If-None-Match": etag})
+        assert again.status_code == 304 and again.content == b"" and again.headers["ETag"] == etag
+
+        client.post("/tasks", json={"title": "C2", "bucket_id": bucket["id"], "plan_id": plan["id"]})
+        changed = client.get("/tasks", params=params, headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+        assert [t["title"] for t in changed.json()] == ["C1", "C2"]
+
+        # Sin compresión el ETag es fuerte; su forma débil también valida (comparación débil)
+        plans = client.get("/plans", headers={"Accept-Encoding": "identity"})
+        assert not plans.headers["ETag"].startswith("W/")
+        assert client.get("/plans", headers={"If-None-Match": f'W/{plans.headers["ETag"]}'}).status_code == 304
+
+def test_local_mutations_reach_change_feed():
+    import change_feed
+    with TestClient(app) as client:
+        start = f"{change_feed.BOOT_ID}-{change_feed.feed._seq}"
+        plan = client.post("/plans", json={"name": "Plan Feed"}).json()
+        bucket = client.post("/buckets", json={"name": "F", "plan_id": plan["id"]}).json()
+        task = client.post("/tasks", json={"title": "F1", "bucket_id": bucket["id"], "plan_id": plan["id"]}).json()
+        client.delete(f"/tasks/{task['id']}")
+        events = [(e["entity"], e["op"], e["id"]) for e in change_feed.feed.since(start)]
+        assert events == [("plans", "created", plan["id"]), ("buckets", "created", bucket["id"]),
+                          ("tasks", "created", task["id"]), ("tasks", "deleted", task["id"])]
+
+def test_bulk_tasks_local_reports_invalid_items(monkeypatch):
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    # Motor propio con claves foráneas activas para que un bucket inexistente dé IntegrityError
+    engine = create_async_engine(database.ASYNC_DATABASE_URL)
+    event.listen(engine.sync_engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    monkeypatch.setattr(database, "group_commit", database.GroupCommitter(
+        window_ms=20, session_factory=async_sessionmaker(engine, expire_on_commit=False)))
+    with TestClient(app) as client:
+        plan = client.post("/plans", json={"name": "Plan Bulk Inválido"}).json()
+        bucket = client.post("/buckets", json={"name": "B", "plan_id": plan["id"]}).json()
+        created = client.post("/tasks/bulk", json=[
+            {"title": "Ok", "bucket_id": bucket["id"], "plan_id": plan["id"]},
+            {"title": "Sin bucket", "bucket_id": "no-numerico", "plan_id": plan["id"]},
+            {"title": "Huérfana", "bucket_id": "999999", "plan_id": plan["id"]},
+        ])
+        assert created.status_code == 200
+        assert [r["status"] for r in created.json()] == [201, 400, 409]
+        remaining = client.get(f"/tasks?bucket_id={bucket['id']}").json()
+        assert [t["title"] for t in remaining] == ["Ok"]
+    asyncio.run(engine.dispose())
@@ -0,0 +1,41 @@
+import os
+import sys
+
+from sqlalchemy import create_engine, inspect, text
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations
+
+
+def test_upgrade_adds_indexes_to_existing_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    # BD creada antes de las migraciones: tablas sin índices compuestos
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE plans (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL)"))
+        conn.execute(text("CREATE TABLE buckets (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, plan_id INTEGER NOT NULL)"))
+        conn.execute(text("CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, percent_complete INTEGER, "
+                          "bucket_id INTEGER NOT NULL, plan_id INTEGER NOT NULL)"))
+
+    assert migrations.upgrade(engine) == len(migrations.MIGRATIONS)
+    indexes = {i["name"] for i in inspect(engine).get_indexes("tasks")}
+    assert {"ix_tasks_bucket_id_id", "ix_tasks_plan_id_id", "ix_tasks_percent_complete_id"} <= indexes
+    # Idempotente: una segunda pasada no vuelve a aplicar nada
+    assert migrations.upgrade(engine) == len(migrations.MIGRATIONS)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar_one() == len(migrations.MIGRATIONS)
+    engine.dispose()
+
+
+def test_fresh_upgrade_matches_models(tmp_path):
+    import models
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert migrations.upgrade(engine) == len(migrations.MIGRATIONS)
+    # La migración 1 está congelada: las siguientes deben llevarla hasta lo que declara models.py
+    inspector = inspect(engine)
+    for table in models.Base.metadata.sorted_tables:
+        assert {c["name"] for c in inspector.get_columns(table.name)} == set(table.columns.keys())
+        assert {i["name"] for i in inspector.get_indexes(table.name)} == {i.name for i in table.indexes}
+    engine.dispose()
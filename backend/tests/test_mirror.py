@@ -0,0 +1,147 @@
+import asyncio
+import os
+import sys
+
+import httpx
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+import database
+import graph_client
+import mirror
+import models
+
+
+async def fake_token():
+    return "tok"
+
+
+def _reset_mirror():
+    # test_main borra test.db al terminar: descartar conexiones a ese fichero
+    database.engine.dispose()
+    asyncio.run(database.async_engine.dispose())
+    database.init_db()
+    db = database.SessionLocal()
+    for model in (models.MirrorPlan, models.MirrorBucket, models.MirrorTask, models.MirrorScope):
+        db.query(model).delete()
+    db.commit()
+    return db
+
+
+def test_mirror_read_through_and_ttl(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"value": [{"id": "p1", "title": "Plan", "@odata.etag": "W/\"1\""}]})
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    monkeypatch.setattr(mirror, "MIRROR_ENABLED", True)
+    _reset_mirror().close()
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        async with database.AsyncSessionLocal() as db:
+            first = await mirror.read_plans(db)
+            second = await mirror.read_plans(db)
+            assert len(calls) == 1
+
+            # Copia vieja: se sirve al momento y se refresca en segundo plano
+            monkeypatch.setattr(mirror, "MIRROR_TTL", -1)
+            third = await mirror.read_plans(db)
+            await asyncio.gather(*mirror._inflight.values())
+            etag = (await db.get(models.MirrorPlan, "p1")).etag
+        await graph_client.close_client()
+        await database.async_engine.dispose()
+        return first, second, third, etag
+
+    first, second, third, etag = asyncio.run(run())
+    assert first == second == third == [{"id": "p1", "name": "Plan"}]
+    assert len(calls) == 2
+    assert etag == "W/\"1\""
+
+
+def test_mirror_applies_graph_writes(monkeypatch):
+    monkeypatch.setattr(mirror, "MIRROR_ENABLED", True)
+    db = _reset_mirror()
+    db.add(models.MirrorTask(id="t1", title="Vieja", bucket_id="b1", plan_id="p1", etag="W/\"1\""))
+    db.commit()
+
+
+    async def notify(*args):
+        await graph_client.notify_response(*args)
+        await database.async_engine.dispose()
+
+    asyncio.run(notify("PATCH", "/planner/tasks/t1", {"title": "Nueva", "percentComplete": 50}, {"ok": True}))
+    asyncio.run(notify("POST", "/planner/tasks", None, {"id": "t2", "title": "Creada", "bucketId": "b1", "planId": "p1"}))
+
+    db.expire_all()
+    t1 = db.get(models.MirrorTask, "t1")
+    assert (t1.title, t1.percent_complete, t1.etag) == ("Nueva", 50, None)
+    assert db.get(models.MirrorTask, "t2").title == "Creada"
+
+    asyncio.run(notify("DELETE", "/planner/tasks/t1", None, {"ok": True}))
+    db.expire_all()
+    assert db.get(models.MirrorTask, "t1") is None
+    db.close()
+
+
+def test_mirror_plan_filter_reads_whole_plan(monkeypatch):
+    import listing
+
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"value": [
+            {"id": "t1", "title": "Mía", "bucketId": "b1", "planId": "p1"},
+            {"id": "t2", "title": "De otro", "bucketId": "b2", "planId": "p1"},
+        ]})
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    monkeypatch.setattr(mirror, "MIRROR_ENABLED", True)
+    db = _reset_mirror()
+    db.add(models.MirrorTask(id="t1", title="Mía", bucket_id="b1", plan_id="p1", assigned_to_me=True))
+    db.commit()
+    db.close()
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        async with database.AsyncSessionLocal() as session:
+            page = await listing.list_tasks(session, listing.TaskFilter(plan_id="p1"), None)
+        await graph_client.close_client()
+        await database.async_engine.dispose()
+        return page
+
+    rows, cursor = asyncio.run(run())
+    assert [r["id"] for r in rows] == ["t1", "t2"] and cursor is None
+    assert calls == ["/v1.0/planner/plans/p1/tasks"]
+
+
+def test_mirror_bucket_filter_kept_on_plan_fallback(monkeypatch):
+    import listing
+
+    def handler(request):
+        if request.url.path.startswith("/v1.0/planner/buckets/"):
+            return httpx.Response(404, json={"error": {"code": "NotFound"}})
+        return httpx.Response(200, json={"value": [
+            {"id": "t1", "title": "Mía", "bucketId": "b1", "planId": "p1"},
+            {"id": "t2", "title": "De otro", "bucketId": "b2", "planId": "p1"},
+        ]})
+
+    monkeypatch.setattr(auth, "get_access_token_async", fake_token)
+    monkeypatch.setattr(mirror, "MIRROR_ENABLED", True)
+    _reset_mirror().close()
+
+    async def run():
+        await graph_client.start_client(httpx.MockTransport(handler))
+        async with database.AsyncSessionLocal() as session:
+            page = await listing.list_tasks(session, listing.TaskFilter(plan_id="p1", bucket_id="b2"), None)
+        await graph_client.close_client()
+        await database.async_engine.dispose()
+        return page
+
+    rows, cursor = asyncio.run(run())
+    assert [r["id"] for r in rows] == ["t2"] and cursor is None
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import delta_sync
+import mirror
+import models
+import scheduler
+
+
+def _sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'lease.db'}")
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+def test_leader_lease_is_exclusive(tmp_path, monkeypatch):
+    async def run():
+        engine, sessions = _sessions(tmp_path)
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        a = scheduler.LeaderLease(ttl=60, owner="a", session_factory=sessions)
+        b = scheduler.LeaderLease(ttl=60, owner="b", session_factory=sessions)
+        results = [await a.acquire(), await b.acquire(), await a.acquire()]
+        await a.release()
+        results.append(await b.acquire())
+        # Un lease caducado (worker caído) lo toma otro
+        monkeypatch.setattr(scheduler.time, "time", lambda: 10 ** 10)
+        results.append(await a.acquire())
+        await engine.dispose()
+        return results
+
+    assert asyncio.run(run()) == [True, False, True, True, True]
+
+
+class _Lease:
+    owner = "test"
+
+    def __init__(self, leader=True):
+        self.leader = leader
+        self.released = False
+
+    async def acquire(self):
+        return self.leader
+
+    async def release(self):
+        self.released = True
+
+
+def test_run_once_prioritises_hot_scopes_within_budget(tmp_path, monkeypatch):
+    refreshed, active, peak = [], [0], [0]
+
+    async def fake_refresh(db, scope):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        refreshed.append(scope)
+        return scope != "tasks:bad"
+
+    monkeypatch.setattr(mirror, "refresh_scope", fake_refresh)
+    monkeypatch.setattr(delta_sync, "DELTA_ENABLED", False)
+    monkeypatch.setattr(mirror, "REFRESH_CONCURRENCY", 2)
+    monkeypatch.setattr(mirror, "_budget", None)
+
+    async def run():
+        engine, sessions = _sessions(tmp_path)
+        monkeypatch.setattr(scheduler.database, "AsyncSessionLocal", sessions)
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        # Lecturas ya volcadas por otros workers y las pendientes de este
+        async with sessions() as db:
+            db.add_all([models.MirrorScope(scope=s, refreshed_at=1, access_count=n)
+                        for s, n in (("tasks:cold", 1), ("tasks:hot", 7), ("tasks:bad", 5), ("plans", 3))])
+            await db.commit()
+        monkeypatch.setattr(mirror, "access_counts", {"tasks:hot": 2, "tasks:unknown": 50})
+
+        sched = scheduler.SyncScheduler(interval=60, hot_scopes=2, lease=_Lease())
+        result = await sched.run_once()
+        async with sessions() as db:
+            counts = {s.scope: s.access_count for s in (await db.scalars(select(models.MirrorScope))).all()}
+
+        follower = scheduler.SyncScheduler(interval=60, lease=_Lease(leader=False))
+        skipped = await follower.run_once()
+        await engine.dispose()
+        return sched, result, counts, follower, skipped
+
+    sched, result, counts, follower, skipped = asyncio.run(run())
+    # "plans" no se refresca aparte: "buckets:*" ya vuelve a pedir la lista de planes
+    assert result["scopes"] == ["buckets:*", "tasks:me", "tasks:hot", "tasks:bad"]
+    assert sorted(refreshed) == sorted(result["scopes"]) and result["refreshed"] == 3
+    assert peak[0] == 2 and sched.stats["failed"] == 1
+    # Las lecturas pierden peso en cada pasada; las de scopes sin cargar se descartan
+    assert counts["tasks:hot"] == 4.5 and "tasks:unknown" not in counts
+    assert skipped is None and follower.stats["skipped"] == 1
+
+
+def test_scheduler_stops_gracefully(monkeypatch):
+    runs = []
+
+    async def fake_run_once(self):
+        self.stats["leader"] = True
+        runs.append(1)
+
+    monkeypatch.setattr(scheduler.SyncScheduler, "run_once", fake_run_once)
+    monkeypatch.setattr(scheduler, "jittered", lambda interval, jitter=None: 0.01)
+
+    async def run():
+        lease = _Lease()
+        sched = scheduler.SyncScheduler(interval=0.01, lease=lease)
+        task = sched.start()
+        await asyncio.sleep(0.1)
+        await sched.stop()
+        return task, lease
+
+    task, lease = asyncio.run(run())
+    assert task.done() and not task.cancelled()
+    assert runs and lease.released
+
+
+def test_jitter_bounds():
+    values = [scheduler.jittered(100, 0.2) for _ in range(200)]
+    assert all(80 <= v <= 120 for v in values) and len(set(values)) > 1
@@ -96,14 +96,36 @@ function showTab(tabId) {
 // Resumen (GraphQL)
 // -----------------------------
 
+// Consultas persistidas (APQ): se envía solo el hash y el texto únicamente si el servidor no lo conoce
+const queryHashes = new Map();
+
+async function sha256Hex(text) {
+    if (!window.crypto?.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function postGraphql(body) {
+    const res = await fetch(`${api}/graphql`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    return await res.json();
+}
+
 async function graphqlRequest(query, variables = {}) {
     try {
-        const res = await fetch(`${api}/graphql`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ query, variables })
-        });
-        return await res.json();
+        if (!queryHashes.has(query)) queryHashes.set(query, await sha256Hex(query));
+        const hash = queryHashes.get(query);
+        if (!hash) return await postGraphql({ query, variables });
+
+        const extensions = { persistedQuery: { version: 1, sha256Hash: hash } };
+        const payload = await postGraphql({ variables, extensions });
+        if (payload.errors?.some(err => err.extensions?.code === 'PERSISTED_QUERY_NOT_FOUND')) {
+            return await postGraphql({ query, variables, extensions });
+        }
+        return payload;
     } catch (e) {
         log('Error en conexión GraphQL: ' + e.message, 'error');
         throw e;
@@ -268,10 +290,32 @@ function renderTable(tableId, data, columns, filterFn) {
     });
 }
 
+// Listados ya descargados por URL: se revalidan con If-None-Match y un 304 reutiliza el cuerpo
+const listCache = {};
+
+async function cachedGet(path) {
+    const url = `${api}${path}`;
+    const cached = listCache[url];
+    // cache: 'no-store' para que el navegador no revalide por su cuenta y el 304 llegue aquí
+    const res = await fetch(url, {
+        cache: 'no-store',
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    if (res.status === 304 && cached) return cached;
+    if (!res.ok) throw new Error(`GET ${path}: ${res.status}`);
+    const entry = {
+        etag: res.headers.get('ETag'),
+        cursor: res.headers.get('X-Next-Cursor'),
+        data: await res.json()
+    };
+    if (entry.etag) listCache[url] = entry;
+    else delete listCache[url];
+    return entry;
+}
+
 async function listarPlanes() {
     try {
-        const res = await fetch(`${api}/plans`);
-        const data = await res.json();
+        const { data } = await cachedGet('/plans');
         currentPlans = data;
         populateSelects();
         log('Planes listados', 'info');
@@ -280,18 +324,29 @@ async function listarPlanes() {
 
 async function listarBuckets() {
     try {
-        const res = await fetch(`${api}/buckets`);
-        const data = await res.json();
+        const { data } = await cachedGet('/buckets');
         currentBuckets = data;
         populateSelects();
         log('Buckets listados', 'info');
     } catch (e) { log('Error en listarBuckets: ' + e.message, 'error'); }
 }
 
+// GET /tasks pagina por keyset: se siguen los cursores de X-Next-Cursor hasta la última página
+async function fetchAllPages(path) {
+    const items = [];
+    let after = null;
+    do {
+        const sep = path.includes('?') ? '&' : '?';
+        const page = await cachedGet(`${path}${after ? `${sep}after=${encodeURIComponent(after)}` : ''}`);
+        items.push(...page.data);
+        after = page.cursor;
+    } while (after);
+    return items;
+}
+
 async function listarTareas() {
     try {
-        const res = await fetch(`${api}/tasks`);
-        const data = await res.json();
+        const data = await fetchAllPages('/tasks');
         currentTasks = data;
         populateSelects();
         log('Tareas listadas', 'info');
@@ -381,10 +436,25 @@ function updateBucketSelect(planSelId, bucketSelId) {
     fillSelect(bucketSelId, filteredBuckets, 'id', 'name', 'Seleccionar Bucket...');
 }
 
+// ETags devueltos por el backend tras cada escritura (se reenvían como If-Match)
+const knownEtags = {};
+
+function etagHeaders(endpoint) {
+    return knownEtags[endpoint] ? { 'If-Match': knownEtags[endpoint] } : {};
+}
+
+function rememberEtag(endpoint, res) {
+    const etag = res.headers.get('ETag');
+    if (etag && res.ok) knownEtags[endpoint] = etag;
+    else delete knownEtags[endpoint];
+}
+
 async function apiDelete(endpoint) {
     const res = await fetch(`${api}${endpoint}`, {
-        method: 'DELETE'
+        method: 'DELETE',
+        headers: etagHeaders(endpoint)
     });
+    delete knownEtags[endpoint];
     if (!res.ok) {
         const err = await res.json();
         throw new Error(err.detail || 'Fallo en DELETE');
@@ -395,9 +465,10 @@ async function apiDelete(endpoint) {
 async function apiPut(endpoint, body) {
     const res = await fetch(`${api}${endpoint}`, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...etagHeaders(endpoint) },
         body: JSON.stringify(body)
     });
+    rememberEtag(endpoint, res);
     if (!res.ok) {
         const err = await res.json();
         throw new Error(err.detail || 'Fallo en PUT');
@@ -653,6 +724,45 @@ async function iniciarSesion() {
         log('Error al iniciar sesión: ' + e.message, 'error');
     }
 }
+// -----------------------------
+// Feed de cambios (SSE)
+// -----------------------------
+// Altas, cambios y bajas de otros usuarios o del espejo de Graph se aplican sobre las
+// colecciones en memoria, sin recargarlas. EventSource reconecta solo y envía Last-Event-ID.
+let feedRender = null;
+
+function aplicarCambio(change) {
+    const lists = { plans: currentPlans, buckets: currentBuckets, tasks: currentTasks };
+    const list = lists[change.entity];
+    if (!list) return;
+    const idx = list.findIndex(item => String(item.id) === String(change.id));
+    if (change.op === 'deleted') {
+        if (idx >= 0) list.splice(idx, 1);
+    } else if (idx >= 0) {
+        Object.assign(list[idx], change.data);
+    } else if (change.op === 'created') {
+        list.push(change.data);
+    }
+    // Varios eventos seguidos se pintan una sola vez
+    if (!feedRender) {
+        feedRender = requestAnimationFrame(() => {
+            feedRender = null;
+            populateSelects();
+        });
+    }
+}
+
+function iniciarFeed() {
+    if (!window.EventSource) return;
+    const source = new EventSource(`${api}/changes`);
+    source.addEventListener('change', e => aplicarCambio(JSON.parse(e.data)));
+    // El servidor ya no tiene los eventos perdidos: recarga completa
+    source.addEventListener('reset', () => {
+        log('Feed de cambios reiniciado, recargando datos', 'info');
+        refreshAll();
+    });
+}
+
 // -----------------------------
 // Inicialización
 // -----------------------------
@@ -660,5 +770,6 @@ async function iniciarSesion() {
 window.onload = () => {
     switchSlide('slide-dashboard');
     refreshAll();
+    iniciarFeed();
     log('Sistema Optisa Planner Listo 🚀', 'success');
 };
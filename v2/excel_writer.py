@@ -0,0 +1,145 @@
+from contextlib import contextmanager
+
+import sync_snapshot
+
+# Excel no acepta direcciones de más de 255 caracteres en Range("2:3,7:7,...")
+MAX_ADDRESS_LEN = 255
+
+
+def col_name(n):
+    """1 → A, 27 → AA (como xw.utils.col_name, sin depender de xlwings)."""
+    name = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def _runs(numbers):
+    """[2, 3, 4, 7, 9, 10] → [(2, 4), (7, 7), (9, 10)]"""
+    runs = []
+    for n in sorted(numbers):
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return [tuple(r) for r in runs]
+
+
+class WritePlan:
+    """
+    Acumula los cambios de una sincronización y los aplica con las mínimas llamadas COM:
+    celdas contiguas → un rango rectangular, filas con el mismo color → un rango multiárea.
+    """
+
+    def __init__(self):
+        self.cells = {}    # (fila, columna) → valor; filas y columnas empiezan en 1
+        self.colors = {}   # fila → color (None = sin relleno)
+        self.clears = []   # direcciones a vaciar
+        self.calls = 0
+
+    def __bool__(self):
+        return bool(self.cells or self.colors or self.clears)
+
+    def set(self, row, col, value):
+        self.cells[(row, col)] = value
+
+    def set_row(self, row, values, first_col=1):
+        for offset, value in enumerate(values):
+            self.cells[(row, first_col + offset)] = value
+
+    def diff_rows(self, current, target, first_row=2):
+        """
+        Compara las filas actuales de la hoja con las deseadas. De cada fila distinta se
+        escribe el tramo entre la primera y la última celda cambiada. Devuelve las filas tocadas.
+        """
+        changed = 0
+        for offset, row in enumerate(target):
+            old = current[offset] if offset < len(current) else []
+            width = max(len(row), len(old))
+            row = list(row) + [""] * (width - len(row))
+            old = list(old) + [None] * (width - len(old))
+            diffs = [c for c in range(width) if sync_snapshot.normalize_cell(old[c]) != sync_snapshot.normalize_cell(row[c])]
+            if diffs:
+                self.set_row(first_row + offset, row[diffs[0]:diffs[-1] + 1], first_col=diffs[0] + 1)
+                changed += 1
+        return changed
+
+    def highlight(self, row, color):
+        self.colors[row] = color
+
+    def clear(self, address):
+        self.clears.append(address)
+
+    def blocks(self):
+        """Rectángulos (fila, columna, matriz): tramos por fila unidos con las filas vecinas de igual tramo."""
+        by_row = {}
+        for (row, col) in self.cells:
+            by_row.setdefault(row, []).append(col)
+        segments = []
+        for row, cols in by_row.items():
+            for c1, c2 in _runs(cols):
+                segments.append((c1, c2, row))
+        blocks = []
+        for c1, c2, row in sorted(segments):
+            last = blocks[-1] if blocks else None
+            if last and last[1] == c1 and last[2] == c2 and last[3] + 1 == row:
+                last[3] = row
+            else:
+                blocks.append([row, c1, c2, row])
+        return [
+            (r1, c1, [[self.cells[(r, c)] for c in range(c1, c2 + 1)] for r in range(r1, r2 + 1)])
+            for r1, c1, c2, r2 in blocks
+        ]
+
+    def color_areas(self):
+        """(color, "2:4,7:7,...") agrupando las filas de cada color en rangos multiárea."""
+        by_color = {}
+        for row, color in self.colors.items():
+            by_color.setdefault(color, []).append(row)
+        areas = []
+        for color, rows in by_color.items():
+            address = ""
+            for r1, r2 in _runs(rows):
+                part = f"{r1}:{r2}"
+                if address and len(address) + len(part) + 1 > MAX_ADDRESS_LEN:
+                    areas.append((color, address))
+                    address = ""
+                address = f"{address},{part}" if address else part
+            if address:
+                areas.append((color, address))
+        return areas
+
+    def apply(self, sheet):
+        for address in self.clears:
+            sheet.range(address).clear_contents()
+            self.calls += 1
+        for row, col, matrix in self.blocks():
+            sheet.range(f"{col_name(col)}{row}").value = matrix
+            self.calls += 1
+        for color, address in self.color_areas():
+            sheet.range(address).color = color
+            self.calls += 1
+        return self.calls
+
+
+@contextmanager
+def suspended(app):
+    """Sin repintado, recálculo ni eventos mientras se escribe; se restaura siempre."""
+    saved = {}
+    try:
+        saved = {"screen_updating": app.screen_updating, "calculation": app.calculation,
+                 "enable_events": app.enable_events}
+        app.screen_updating = False
+        app.calculation = "manual"
+        app.enable_events = False
+    except Exception:
+        pass
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            try:
+                setattr(app, key, value)
+            except Exception:
+                pass
@@ -0,0 +1,218 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GRAPH_ROOT = "https://graph.microsoft.com/v1.0"
+
+# Peticiones simultáneas contra Graph (hilos del pool y conexiones keep-alive)
+SYNC_WORKERS = int(os.getenv("PLANNER_SYNC_WORKERS", "8"))
+# Peticiones por llamada a /$batch (máximo de Graph: 20)
+SYNC_BATCH_SIZE = min(20, int(os.getenv("PLANNER_SYNC_BATCH_SIZE", "20")))
+# Reintentos ante 429/503/504 respetando Retry-After
+SYNC_MAX_RETRIES = int(os.getenv("PLANNER_SYNC_MAX_RETRIES", "4"))
+
+RETRY_STATUSES = (429, 503, 504)
+
+# Campos fijos de cada tarea; el resto son columnas dinámicas de ##Tag
+TASK_FIELDS = ("Task ID", "Plan ID", "Plan Name", "Bucket Name", "Task Title", "Status", "ETag")
+
+
+def _retry_after(headers, attempt):
+    try:
+        return min(30.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return min(30.0, 0.5 * 2 ** attempt)
+
+
+class GraphFetcher:
+    """
+    Cliente de Graph para la sincronización: una sola requests.Session (conexiones
+    reutilizadas), un pool de hilos acotado y /$batch para las peticiones por tarea.
+    """
+
+    def __init__(self, token, workers=SYNC_WORKERS, batch_size=SYNC_BATCH_SIZE, session=None):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.stats = {"requests": 0, "batches": 0, "retries": 0, "details_fetched": 0, "details_skipped": 0}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _send(self, method, url, **kwargs):
+        for attempt in range(SYNC_MAX_RETRIES + 1):
+            self._count("requests")
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == SYNC_MAX_RETRIES:
+                response.raise_for_status()
+                return response.json()
+            self._count("retries")
+            time.sleep(_retry_after(response.headers, attempt))
+
+    def get(self, url):
+        """GET de una colección siguiendo @odata.nextLink; devuelve {"value": [...]}."""
+        data = self._send("GET", url if url.startswith("http") else GRAPH_ROOT + url)
+        return self._follow(data)
+
+    def _follow(self, data):
+        items = list(data.get("value", []))
+        next_link = data.get("@odata.nextLink")
+        while next_link:
+            page = self._send("GET", next_link)
+            items.extend(page.get("value", []))
+            next_link = page.get("@odata.nextLink")
+        return {**data, "value": items}
+
+    def _batch_chunk(self, batch):
+        """Un /$batch de hasta 20 peticiones → [(status, body)]; reintenta solo las limitadas."""
+        results = [(None, None)] * len(batch)
+        pending = list(range(len(batch)))
+        for attempt in range(SYNC_MAX_RETRIES + 1):
+            self._count("batches")
+            body = {"requests": [{"id": str(i), **batch[i]} for i in pending]}
+            data = self._send("POST", f"{GRAPH_ROOT}/$batch", json=body)
+            throttled, wait = [], 0.0
+            for item in data.get("responses", []):
+                i = int(item["id"])
+                status = item.get("status", 500)
+                if status in RETRY_STATUSES and attempt < SYNC_MAX_RETRIES:
+                    throttled.append(i)
+                    wait = max(wait, _retry_after(item.get("headers") or {}, attempt))
+                else:
+                    results[i] = (status, item.get("body") or {})
+            if not throttled:
+                break
+            self._count("retries", len(throttled))
+            pending = throttled
+            time.sleep(wait)
+        return results
+
+    def _get_chunk(self, paths):
+        results = self._batch_chunk([{"method": "GET", "url": path} for path in paths])
+        for path, (status, body) in zip(paths, results):
+            if status is None or status >= 400:
+                raise requests.HTTPError(f"{status} en {path}: {body}")
+        return [body for _, body in results]
+
+    def send_many(self, batch):
+        """Peticiones independientes ({"method", "url", "headers", "body"}) vía /$batch en paralelo.
+
+        Devuelve [(status, body)] en el mismo orden; los errores no se lanzan.
+        """
+        chunks = [batch[i:i + self.batch_size] for i in range(0, len(batch), self.batch_size)]
+        results = []
+        for chunk_results in self.pool.map(self._batch_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def get_many(self, paths):
+        """GET de muchas rutas relativas ("/planner/tasks/{id}/details") vía /$batch en paralelo.
+
+        Devuelve los cuerpos en el mismo orden que `paths`.
+        """
+        chunks = [paths[i:i + self.batch_size] for i in range(0, len(paths), self.batch_size)]
+        results = []
+        for chunk_results in self.pool.map(self._get_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def get_collections(self, paths):
+        """Como get_many, pero siguiendo el nextLink de cada colección paginada."""
+        first = self.get_many(paths)
+        return list(self.pool.map(self._follow, first))
+
+
+def status_label(percent):
+    """percentComplete de Planner → texto de la columna Status."""
+    return "Completada" if percent == 100 else ("Iniciada" if percent > 0 else "No Iniciada")
+
+
+def _task_record(plan, bucket, task, parsed_tags):
+    return {
+        "Task ID": task["id"],
+        "Plan ID": plan["id"],
+        "Plan Name": plan["title"],
+        "Bucket Name": bucket["name"],
+        "Task Title": task.get("title", ""),
+        "Status": status_label(task.get("percentComplete", 0)),
+        "ETag": task.get("@odata.etag", ""),
+        **parsed_tags,
+    }
+
+
+def iter_planner_tasks(fetcher, parse_description, snapshot=None):
+    """
+    Planes → buckets → tareas → detalles, en el mismo orden que el recorrido secuencial
+    original de planner_sync.sync, pero entregando cada tarea en cuanto está completa.
+
+    Los buckets se procesan por ventanas (workers × batch_size): en memoria solo están las
+    tareas de la ventana en curso, así que exportar planes muy grandes no crece con su tamaño.
+    Con `snapshot` (sync_snapshot.SyncSnapshot) solo se piden los detalles de las tareas
+    cuyo ETag cambió; el resto reutiliza las etiquetas ya parseadas.
+    """
+    plans = fetcher.get("/planner/plans").get("value", [])
+    buckets_per_plan = fetcher.get_collections([f"/planner/plans/{p['id']}/buckets" for p in plans])
+
+    bucket_rows = []
+    for plan, buckets in zip(plans, buckets_per_plan):
+        for bucket in buckets.get("value", []):
+            bucket_rows.append((plan, bucket))
+
+    window = fetcher.workers * fetcher.batch_size
+    for start in range(0, len(bucket_rows), window):
+        chunk = bucket_rows[start:start + window]
+        tasks_per_bucket = fetcher.get_collections([f"/planner/buckets/{b['id']}/tasks" for _, b in chunk])
+
+        task_rows = []
+        for (plan, bucket), tasks in zip(chunk, tasks_per_bucket):
+            for task in tasks.get("value", []):
+                task_rows.append((plan, bucket, task))
+
+        tags_by_task = {}
+        if snapshot is not None:
+            for _, _, task in task_rows:
+                cached = snapshot.cached_tags(task["id"], task.get("@odata.etag"))
+                if cached is not None:
+                    tags_by_task[task["id"]] = cached
+        to_fetch = [task for _, _, task in task_rows if task["id"] not in tags_by_task]
+        details = fetcher.get_many([f"/planner/tasks/{t['id']}/details" for t in to_fetch])
+        now = time.time()
+        for task, detail in zip(to_fetch, details):
+            tags_by_task[task["id"]] = parse_description((detail or {}).get("description", ""))
+            if snapshot is not None:
+                snapshot.update(task["id"], task.get("@odata.etag", ""), tags_by_task[task["id"]], fetched_at=now)
+        fetcher._count("details_fetched", len(to_fetch))
+        fetcher._count("details_skipped", len(task_rows) - len(to_fetch))
+
+        for plan, bucket, task in task_rows:
+            yield _task_record(plan, bucket, task, tags_by_task[task["id"]])
+
+
+def fetch_planner_tasks(fetcher, parse_description, snapshot=None):
+    """Todas las tareas de una vez: (all_planner_tasks por id, all_dynamic_cols)."""
+    all_planner_tasks = {}
+    all_dynamic_cols = set()
+    for record in iter_planner_tasks(fetcher, parse_description, snapshot):
+        all_dynamic_cols.update(k for k in record if k not in TASK_FIELDS)
+        all_planner_tasks[record["Task ID"]] = record
+    return all_planner_tasks, all_dynamic_cols
@@ -0,0 +1,91 @@
+import os
+import re
+import msal
+from dotenv import load_dotenv
+from datetime import datetime
+
+import graph_fetch
+from graph_fetch import TASK_FIELDS
+
+# Cargar variables de entorno desde el directorio padre
+env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+load_dotenv(env_path)
+
+CLIENT_ID = os.getenv('MS_GRAPH_CLIENT_ID')
+TENANT_ID = os.getenv('MS_GRAPH_TENANT_ID')
+CLIENT_SECRET = os.getenv('MS_GRAPH_CLIENT_SECRET')
+
+AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
+SCOPE = ["https://graph.microsoft.com/.default"]
+
+# Columnas base de la hoja / exportación; detrás van las dinámicas ordenadas alfabéticamente
+BASE_HEADERS = ["Task ID", "Plan Name", "Bucket Name", "Task Title", "Status", "ETag"]
+
+def get_access_token():
+    """Obtiene el token de acceso de Microsoft Graph usando MSAL."""
+    app = msal.ConfidentialClientApplication(
+        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
+    )
+    result = app.acquire_token_for_client(scopes=SCOPE)
+    if "access_token" in result:
+        return result["access_token"]
+    else:
+        raise Exception(f"No se pudo adquirir el token: {result.get('error_description')}")
+
+def parse_description(description):
+    """
+    Analiza la descripción de una tarea en busca de etiquetas ##Clave: Valor.
+    Soporta alias como ##Dinero, ##Fecha y booleanos (ON/OFF).
+    """
+    if not description:
+        return {}
+    
+    tags = {}
+    # Patrón para encontrar ##Clave: Valor o ##Clave Valor
+    # Asegura que se detenga antes de la siguiente etiqueta ## o del final de la línea
+    matches = re.finditer(r'##([\w\$\-]+)(?:[:\s=]+)(.*?)(?=\s*##|$)', description)
+    
+    for match in matches:
+        key = match.group(1).strip()
+        value = match.group(2).strip()
+        
+        # Alias Amigables
+        if key == '$' or key.lower() == 'dinero': 
+            key = 'Dinero'
+            try: 
+                # Buscar el primer número en el valor (ignora $, texto extra, etc.)
+                num_match = re.search(r'[\d,.]+', value)
+                if num_match:
+                    value = float(num_match.group(0).replace(',', ''))
+            except: pass
+        elif key == 'F' or key.lower() == 'fecha': 
+            key = 'Fecha'
+            try: value = datetime.strptime(value.strip(), '%Y-%m-%d')
+            except: pass
+        elif key == 'D' or key.lower() == 'desc': 
+            key = 'Descripcion_Extra'
+        elif key.startswith('B-') or key.lower().startswith('check'):
+            key = key.replace('B-', '').replace('Check-', '').replace('check-', '')
+            value = value.upper().strip() in ['ON', 'TRUE', '1', 'SI', 'YES']
+        elif key.startswith('PR-') or key.startswith('PG-') or key == 'PS':
+            try: 
+                num_match = re.search(r'[\d,.]+', value)
+                if num_match:
+                    value = float(num_match.group(0).replace(',', ''))
+            except: pass
+            
+        tags[key] = value
+    return tags
+
+def ordered_columns(dynamic_cols, existing=None):
+    """Cabeceras existentes (o las base) seguidas de las columnas ##Tag nuevas, en orden alfabético."""
+    headers = list(existing or BASE_HEADERS)
+    for col in sorted(dynamic_cols):
+        if col not in headers:
+            headers.append(col)
+    return headers
+
+
+def iter_tasks(fetcher, snapshot=None):
+    """Tareas de Planner como filas (dict) a medida que llegan de Graph."""
+    return graph_fetch.iter_planner_tasks(fetcher, parse_description, snapshot)
@@ -1,22 +1,11 @@
 import os
-import re
-import json
-import msal
-import requests
 import xlwings as xw
-from dotenv import load_dotenv
-from datetime import datetime
 
-# Cargar variables de entorno desde el directorio padre
-env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-load_dotenv(env_path)
-
-CLIENT_ID = os.getenv('MS_GRAPH_CLIENT_ID')
-TENANT_ID = os.getenv('MS_GRAPH_TENANT_ID')
-CLIENT_SECRET = os.getenv('MS_GRAPH_CLIENT_SECRET')
-
-AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
-SCOPE = ["https://graph.microsoft.com/.default"]
+import graph_fetch
+import sync_snapshot
+import excel_writer
+# Autenticación, parseo de ##Tags y columnas: compartidos con la exportación sin Excel (export.py)
+from pipeline import TASK_FIELDS, BASE_HEADERS, get_access_token, parse_description, ordered_columns
 
 # Colores de Resaltado Visual
 COLOR_PLANNER_NEW = (255, 230, 153) # Naranja claro (Planner tiene datos nuevos)
@@ -24,79 +13,8 @@ COLOR_EXCEL_NEW = (189, 215, 238)   # Azul claro (Excel tiene cambios locales)
 COLOR_CONFLICT = (248, 203, 173)    # Rojo claro (Ambos cambiaron)
 COLOR_DEFAULT = (255, 255, 255)     # Blanco/Sin color
 
-def get_access_token():
-    """Obtiene el token de acceso de Microsoft Graph usando MSAL."""
-    app = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-    )
-    result = app.acquire_token_for_client(scopes=SCOPE)
-    if "access_token" in result:
-        return result["access_token"]
-    else:
-        raise Exception(f"No se pudo adquirir el token: {result.get('error_description')}")
-
-def graph_get(url, token):
-    """Realiza una petición GET a Microsoft Graph API."""
-    headers = {'Authorization': f'Bearer {token}'}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
-
-def graph_patch(url, token, data, etag):
-    """Realiza una petición PATCH a Microsoft Graph API con If-Match (ETag)."""
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-        'If-Match': etag
-    }
-    response = requests.patch(url, headers=headers, json=data)
-    response.raise_for_status()
-    return response.json()
-
-def parse_description(description):
-    """
-    Analiza la descripción de una tarea en busca de etiquetas ##Clave: Valor.
-    Soporta alias como ##Dinero, ##Fecha y booleanos (ON/OFF).
-    """
-    if not description:
-        return {}
-    
-    tags = {}
-    # Patrón para encontrar ##Clave: Valor o ##Clave Valor
-    # Asegura que se detenga antes de la siguiente etiqueta ## o del final de la línea
-    matches = re.finditer(r'##([\w\$\-]+)(?:[:\s=]+)(.*?)(?=\s*##|$)', description)
-    
-    for match in matches:
-        key = match.group(1).strip()
-        value = match.group(2).strip()
-        
-        # Alias Amigables
-        if key == '$' or key.lower() == 'dinero': 
-            key = 'Dinero'
-            try: 
-                # Buscar el primer número en el valor (ignora $, texto extra, etc.)
-                num_match = re.search(r'[\d,.]+', value)
-                if num_match:
-                    value = float(num_match.group(0).replace(',', ''))
-            except: pass
-        elif key == 'F' or key.lower() == 'fecha': 
-            key = 'Fecha'
-            try: value = datetime.strptime(value.strip(), '%Y-%m-%d')
-            except: pass
-        elif key == 'D' or key.lower() == 'desc': 
-            key = 'Descripcion_Extra'
-        elif key.startswith('B-') or key.lower().startswith('check'):
-            key = key.replace('B-', '').replace('Check-', '').replace('check-', '')
-            value = value.upper().strip() in ['ON', 'TRUE', '1', 'SI', 'YES']
-        elif key.startswith('PR-') or key.startswith('PG-') or key == 'PS':
-            try: 
-                num_match = re.search(r'[\d,.]+', value)
-                if num_match:
-                    value = float(num_match.group(0).replace(',', ''))
-            except: pass
-            
-        tags[key] = value
-    return tags
+# Instantánea local (ETag y etiquetas) para no releer los detalles que no cambiaron
+SNAPSHOT_ENABLED = os.getenv('PLANNER_SYNC_SNAPSHOT', 'true').strip().lower() in ('1', 'true', 'yes')
 
 def sync(mode="full"):
     """
@@ -108,69 +26,39 @@ def sync(mode="full"):
         print(f"Iniciando sincronización en modo {mode}...")
         token = get_access_token()
         
-        # Obteniendo Planes
-        plans_data = graph_get("https://graph.microsoft.com/v1.0/planner/plans", token)
-        plans = plans_data.get('value', [])
-        
-        all_planner_tasks = {} # Diccionario para indexar tareas por ID
-        all_dynamic_cols = set() # Conjunto para rastrear columnas dinámicas únicas
-        
-        for plan in plans:
-            plan_id = plan['id']
-            plan_name = plan['title']
-            
-            # Obteniendo Buckets (Cubetas)
-            buckets_data = graph_get(f"https://graph.microsoft.com/v1.0/planner/plans/{plan_id}/buckets", token)
-            buckets = buckets_data.get('value', [])
-            
-            for bucket in buckets:
-                bucket_name = bucket['name']
-                bucket_id = bucket['id']
-                
-                # Obteniendo Tareas de la cubeta
-                tasks_data = graph_get(f"https://graph.microsoft.com/v1.0/planner/buckets/{bucket_id}/tasks", token)
-                tasks = tasks_data.get('value', [])
-                
-                for task in tasks:
-                    task_id = task['id']
-                    # Detalles de la tarea para obtener la descripción
-                    details = graph_get(f"https://graph.microsoft.com/v1.0/planner/tasks/{task_id}/details", token)
-                    description = details.get('description', '')
-                    
-                    parsed_tags = parse_description(description)
-                    all_dynamic_cols.update(parsed_tags.keys())
-                    
-                    percent = task.get('percentComplete', 0)
-                    all_planner_tasks[task_id] = {
-                        "Task ID": task_id,
-                        "Plan ID": plan_id,
-                        "Plan Name": plan_name,
-                        "Bucket Name": bucket_name,
-                        "Task Title": task.get('title', ''),
-                        "Status": "Completada" if percent == 100 else ("Iniciada" if percent > 0 else "No Iniciada"),
-                        "ETag": task.get('@odata.etag', ''),
-                        **parsed_tags
-                    }
-        
         # Integración con Excel
         try:
             wb = xw.Book.caller()
         except Exception:
             wb = xw.books.active
         sheet = wb.sheets.active
+
+        # Instantánea junto al libro: ETag y etiquetas de la última pasada
+        snapshot = None
+        if SNAPSHOT_ENABLED:
+            snapshot = sync_snapshot.SyncSnapshot(sync_snapshot.snapshot_path(wb.fullname))
+
+        # Push con línea base en la instantánea: basta con la hoja y la instantánea, sin releer Planner
+        push_from_snapshot = (mode == "push" and snapshot is not None
+                              and any(e.get("edit_hash") for e in snapshot.entries.values()))
+
+        # Planes, buckets, tareas y detalles: por niveles, en paralelo y con /$batch
+        all_planner_tasks, all_dynamic_cols = {}, set()
+        if not push_from_snapshot:
+            with graph_fetch.GraphFetcher(token) as fetcher:
+                all_planner_tasks, all_dynamic_cols = graph_fetch.fetch_planner_tasks(fetcher, parse_description, snapshot)
+                print(f"{len(all_planner_tasks)} tareas leídas de Planner "
+                      f"({fetcher.stats['requests']} peticiones HTTP, {fetcher.stats['batches']} lotes; "
+                      f"detalles: {fetcher.stats['details_fetched']} pedidos, {fetcher.stats['details_skipped']} sin cambios)")
+                if fetcher.stats['details_skipped']:
+                    print(f"Aviso: {sync_snapshot.staleness_note()}")
         
-        # Asegurar Encabezados base
-        base_headers = ["Task ID", "Plan Name", "Bucket Name", "Task Title", "Status", "ETag"]
+        # Asegurar Encabezados base y añadir columnas dinámicas detectadas
         existing_headers = sheet.range('A1').expand('right').value
         
         if not existing_headers or existing_headers == [None] or isinstance(existing_headers, str):
-            existing_headers = base_headers
-        if isinstance(existing_headers, str): existing_headers = [existing_headers]
-        
-        # Añadir columnas dinámicas detectadas
-        for col in sorted(list(all_dynamic_cols)):
-            if col not in existing_headers:
-                existing_headers.append(col)
+            existing_headers = BASE_HEADERS
+        existing_headers = ordered_columns(all_dynamic_cols, existing_headers)
         
         sheet.range('A1').value = existing_headers
         
@@ -182,6 +70,7 @@ def sync(mode="full"):
         # Cargar datos existentes de Excel para comparación
         last_row_idx = sheet.range('A' + str(sheet.cells.last_cell.row)).end('up').row
         excel_data = {}
+        rows = []
         if last_row_idx > 1:
             rows = sheet.range(f'A2:{xw.utils.col_name(len(existing_headers))}{last_row_idx}').value
             if last_row_idx == 2: rows = [rows] # Ajuste para fila única
@@ -189,25 +78,44 @@ def sync(mode="full"):
                 if row and row[id_col_idx]:
                     excel_data[row[id_col_idx]] = {"row_idx": r_idx + 2, "data": row}
 
-        # Procesamiento de Cambios
-        data_to_write = []
+        # Procesamiento de Cambios: todo se acumula en un plan de escritura y se aplica al final
+        plan = excel_writer.WritePlan()
         rows_to_highlight = {} # indice_fila: color
         
         if mode == "full":
-            # Reconstruir matriz de datos y escribir todo
-            for t_id, t_info in all_planner_tasks.items():
-                row_list = [t_info.get(h, "") for h in existing_headers]
-                data_to_write.append(row_list)
-            
-            if last_row_idx > 1:
-                sheet.range(f'A2:ZZ{last_row_idx}').clear_contents()
-                sheet.range(f'A2:ZZ{last_row_idx}').color = None
-            
-            if data_to_write:
-                sheet.range('A2').value = data_to_write
-            
-            apply_premium_styling(sheet)
-            print(f"Sincronización completa. {len(data_to_write)} tareas actualizadas.")
+            planner_rows = {t_id: [t_info.get(h, "") for h in existing_headers] for t_id, t_info in all_planner_tasks.items()}
+            # Filas de tareas borradas en Planner o filas sin ID: hay que compactar la hoja entera
+            rebuild = (not excel_data or any(t_id not in all_planner_tasks for t_id in excel_data)
+                       or len(excel_data) != last_row_idx - 1)
+
+            if rebuild:
+                # Matriz en el orden de Planner; lo que sobre por debajo se vacía en una llamada
+                target = list(planner_rows.values())
+                if last_row_idx > len(target) + 1:
+                    plan.clear(f'A{len(target) + 2}:ZZ{last_row_idx}')
+            else:
+                # Cada tarea conserva su fila; las nuevas, al final
+                target = [list(row) for row in rows]
+                for t_id, row_list in planner_rows.items():
+                    if t_id in excel_data:
+                        target[excel_data[t_id]["row_idx"] - 2] = row_list
+                    else:
+                        target.append(row_list)
+
+            # Quitar los resaltados de pasadas anteriores (un solo rango "2:N" en apply)
+            for r_idx in range(2, last_row_idx + 1):
+                plan.highlight(r_idx, None)
+
+            # Solo se escriben las celdas que difieren de lo que ya hay en la hoja
+            changed = plan.diff_rows(rows, target)
+            skipped = len(target) - changed
+
+            if snapshot is not None:
+                for t_id in planner_rows:
+                    t_info = all_planner_tasks[t_id]
+                    tags = {k: v for k, v in t_info.items() if k not in TASK_FIELDS}
+                    snapshot.update(t_id, t_info["ETag"], tags,
+                                    edit_hash=sync_snapshot.edit_hash(t_info["Task Title"], t_info["Status"]))
 
         elif mode == "compare":
             # Lógica de comparación inteligente (Semáforo completo)
@@ -237,18 +145,16 @@ def sync(mode="full"):
                     else:
                         rows_to_highlight[e_row_idx] = COLOR_DEFAULT
 
-            # Aplicar Resaltado Visual
+            # Resaltado Visual: filas del mismo color en un único rango multiárea
             for r_idx, color in rows_to_highlight.items():
-                sheet.range(f'{r_idx}:{r_idx}').color = color
-
-            print("Comparación finalizada. Resaltado aplicado en Excel.")
+                plan.highlight(r_idx, color)
 
         elif mode == "push":
-            # Lógica de Push: Excel → Planner (con If-Match ETag)
+            # Lógica de Push: Excel → Planner (con If-Match ETag), solo las filas editadas
             title_col_idx = header_map.get("Task Title", 3)
             status_col_idx = header_map.get("Status", 4)
-            pushed = 0
-            errors = 0
+            dirty = [] # (t_id, fila, título, estado, etag)
+            unknown = [] # filas sin línea base cuando no se ha leído Planner
 
             for t_id, e_info in excel_data.items():
                 e_row_idx = e_info["row_idx"]
@@ -261,39 +167,85 @@ def sync(mode="full"):
                 e_title = e_data[title_col_idx] if title_col_idx < len(e_data) else ""
                 e_status = e_data[status_col_idx] if status_col_idx < len(e_data) else ""
 
-                # Convert status text back to percentComplete
-                if e_status == "Completada":
-                    percent = 100
-                elif e_status == "Iniciada":
-                    percent = 50
+                # Línea base: hash de título/estado tras la última sincronización de la fila.
+                # Sin instantánea se compara con lo que hay ahora en Planner.
+                baseline = snapshot.entries.get(t_id, {}).get("edit_hash") if snapshot is not None else None
+                if baseline is not None:
+                    is_dirty = sync_snapshot.edit_hash(e_title, e_status) != baseline
+                elif push_from_snapshot:
+                    unknown.append((t_id, e_row_idx, e_title, e_status, e_etag))
+                    continue
                 else:
-                    percent = 0
-
-                patch_body = {
-                    "title": e_title,
-                    "percentComplete": percent
-                }
-
-                try:
-                    result = graph_patch(
-                        f"https://graph.microsoft.com/v1.0/planner/tasks/{t_id}",
-                        token, patch_body, e_etag
-                    )
+                    p_task = all_planner_tasks.get(t_id, {})
+                    is_dirty = (e_title, e_status) != (p_task.get("Task Title"), p_task.get("Status"))
+                if is_dirty:
+                    dirty.append((t_id, e_row_idx, e_title, e_status, e_etag))
+
+            # Convert status text back to percentComplete
+            percents = {"Completada": 100, "Iniciada": 50}
+
+            with graph_fetch.GraphFetcher(token) as writer:
+                if unknown:
+                    # Filas que la instantánea no conoce: se comparan pidiendo a Planner solo esas tareas
+                    current = writer.send_many([{"method": "GET", "url": f"/planner/tasks/{u[0]}"} for u in unknown])
+                    for u, (status, body) in zip(unknown, current):
+                        if status == 200 and (u[2], u[3]) != (body.get("title"), graph_fetch.status_label(body.get("percentComplete", 0))):
+                            dirty.append(u)
+
+                batch = [{
+                    "method": "PATCH",
+                    "url": f"/planner/tasks/{t_id}",
+                    "headers": {"Content-Type": "application/json", "If-Match": e_etag,
+                                "Prefer": "return=representation"},
+                    "body": {"title": e_title, "percentComplete": percents.get(e_status, 0)},
+                } for t_id, _, e_title, e_status, e_etag in dirty]
+                results = writer.send_many(batch) if batch else []
+
+            pushed = 0
+            errors = 0
+            new_etags = {} # fila: ETag
+            for (t_id, e_row_idx, e_title, e_status, e_etag), (status, body) in zip(dirty, results):
+                if status is not None and status < 400:
                     # Update ETag in Excel with the new one from server
-                    new_etag = result.get('@odata.etag', e_etag)
-                    sheet.range(f'{xw.utils.col_name(etag_col_idx + 1)}{e_row_idx}').value = new_etag
+                    new_etag = (body or {}).get('@odata.etag', e_etag)
+                    new_etags[e_row_idx] = new_etag
                     pushed += 1
-                except requests.exceptions.HTTPError as e:
-                    if e.response.status_code == 412:
-                        # Precondition Failed — someone else modified the task
-                        sheet.range(f'{e_row_idx}:{e_row_idx}').color = COLOR_CONFLICT
+                    if snapshot is not None:
+                        snapshot.update(t_id, new_etag, edit_hash=sync_snapshot.edit_hash(e_title, e_status))
+                elif status == 412:
+                    # Precondition Failed — someone else modified the task
+                    plan.highlight(e_row_idx, COLOR_CONFLICT)
                     errors += 1
-                    print(f"Error al subir tarea {t_id}: {e}")
-                except Exception as e:
+                    print(f"Conflicto al subir tarea {t_id}: modificada en Planner")
+                else:
                     errors += 1
-                    print(f"Error inesperado en tarea {t_id}: {e}")
+                    print(f"Error al subir tarea {t_id}: {status} {body}")
+
+            # Columna de ETags completa en una sola escritura
+            if new_etags:
+                for offset, row in enumerate(rows):
+                    r_idx = offset + 2
+                    plan.set(r_idx, etag_col_idx + 1, new_etags.get(r_idx, row[etag_col_idx] if etag_col_idx < len(row) else None))
+
+            print(f"Push finalizado. {pushed} tareas subidas, {errors} errores, "
+                  f"{len(excel_data) - len(dirty)} filas sin cambios.")
+
+        # Escritura en Excel: rangos contiguos y multiárea, sin repintado ni recálculo
+        with excel_writer.suspended(wb.app):
+            calls = plan.apply(sheet)
+            if mode == "full":
+                apply_premium_styling(sheet)
+
+        if mode == "full":
+            print(f"Sincronización completa. {changed} tareas actualizadas, {skipped} sin cambios "
+                  f"({calls} escrituras en Excel).")
+        elif mode == "compare":
+            print(f"Comparación finalizada. Resaltado aplicado en Excel ({calls} escrituras).")
 
-            print(f"Push finalizado. {pushed} tareas subidas, {errors} errores.")
+        if snapshot is not None:
+            # Sin lectura de Planner no se sabe qué tareas se borraron: se conservan todas
+            snapshot.save(keep_ids=None if push_from_snapshot else all_planner_tasks.keys())
+            snapshot.close()
 
     except Exception as e:
         print(f"ERROR: {e}")
@@ -317,7 +269,11 @@ def apply_premium_styling(sheet):
 if __name__ == "__main__":
     import sys
     arg = sys.argv[1] if len(sys.argv) > 1 else "full"
-    if arg not in ("full", "compare", "push"):
-        print(f"Modo desconocido: {arg}. Usa: full, compare, push")
+    usage = ("Uso: python planner_sync.py [full|compare|push]\n"
+             f"Con PLANNER_SYNC_SNAPSHOT activo, {sync_snapshot.staleness_note()}.")
+    if arg in ("-h", "--help"):
+        print(usage)
+    elif arg not in ("full", "compare", "push"):
+        print(f"Modo desconocido: {arg}.\n{usage}")
     else:
         sync(arg)
@@ -0,0 +1,223 @@
+import os
+import csv
+import abc
+import json
+import tempfile
+from datetime import date, datetime
+
+import sync_snapshot
+from pipeline import TASK_FIELDS, ordered_columns
+
+# Filas por row group en Parquet (lo que se mantiene en memoria antes de escribir)
+EXPORT_ROW_GROUP = int(os.getenv("PLANNER_EXPORT_ROW_GROUP", "10000"))
+
+
+def _kind(value):
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, (datetime, date)):
+        return "date"
+    return "str"
+
+
+class Sink(abc.ABC):
+    """
+    Destino de la exportación: recibe las tareas (dict) de una en una y las escribe sin
+    acumularlas en memoria.
+
+    Con `columns` fijas cada fila se escribe en cuanto llega. Sin ellas las columnas ##Tag
+    no se conocen hasta la última tarea: las filas se vuelcan a un fichero temporal (una
+    línea JSON por tarea) y al cerrar se escribe la cabecera completa y se reproducen.
+
+    Se escribe en "<path>.part" y solo al cerrar sin errores sustituye a `path`: si Graph falla
+    a mitad, la exportación anterior sigue intacta.
+    """
+
+    # Parquet necesita conocer el tipo de cada columna antes de abrir el fichero
+    needs_types = False
+
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.columns = list(columns) if columns else None
+        self.count = 0
+        self.types = {}
+        self._dynamic = set()
+        self._spill = None
+        if self.columns is None or self.needs_types:
+            self._spill = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        else:
+            self._open(self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, record):
+        for key, value in record.items():
+            if key not in TASK_FIELDS:
+                self._dynamic.add(key)
+            if value is not None and value != "":
+                self.types.setdefault(key, set()).add(_kind(value))
+        if self._spill is not None:
+            self._spill.write(json.dumps({k: sync_snapshot.encode_value(v) for k, v in record.items()}) + "\n")
+        else:
+            self._write_row([record.get(c) for c in self.columns])
+        self.count += 1
+
+    def close(self):
+        if self._spill is not None:
+            if self.columns is None:
+                self.columns = ordered_columns(self._dynamic)
+            self._open(self.columns)
+            self._spill.seek(0)
+            for line in self._spill:
+                record = {k: sync_snapshot.decode_value(v) for k, v in json.loads(line).items()}
+                self._write_row([record.get(c) for c in self.columns])
+            self._spill.close()
+            self._spill = None
+        self._finish()
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        """Cierra sin completar y borra el fichero a medio escribir (`path` no se toca)."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        try:
+            self._finish()
+        except Exception:
+            pass
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    @abc.abstractmethod
+    def _open(self, columns):
+        """Crea `part_path` y escribe la cabecera con `columns`."""
+
+    @abc.abstractmethod
+    def _write_row(self, values):
+        """Escribe una fila (valores en el orden de `columns`)."""
+
+    @abc.abstractmethod
+    def _finish(self):
+        """Vacía y cierra `part_path`; también se llama al abortar, aunque `_open` no se llegara a llamar."""
+
+
+class CsvSink(Sink):
+    """CSV UTF-8 con BOM (Excel lo abre con acentos correctos); fechas en ISO."""
+
+    def _open(self, columns):
+        self._file = open(self.part_path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def _write_row(self, values):
+        self._writer.writerow(["" if v is None else self._cell(v) for v in values])
+
+    @staticmethod
+    def _cell(value):
+        if isinstance(value, datetime) and not (value.hour or value.minute or value.second):
+            return value.date().isoformat()
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return value
+
+    def _finish(self):
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = None
+
+
+class XlsxSink(Sink):
+    """Libro .xlsx con openpyxl en modo write-only: las filas se vuelcan al disco según llegan."""
+
+    def _open(self, columns):
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+            from openpyxl.styles import Font
+        except ImportError:
+            raise RuntimeError("La exportación a xlsx necesita openpyxl (pip install openpyxl)")
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet("Planner")
+        self._ws.freeze_panes = "A2"
+        header = []
+        for name in columns:
+            cell = WriteOnlyCell(self._ws, value=name)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        self._ws.append(header)
+
+    def _write_row(self, values):
+        self._ws.append(values)
+
+    def _finish(self):
+        if getattr(self, "_wb", None) is not None:
+            self._wb.save(self.part_path)
+            self._wb = None
+
+
+class ParquetSink(Sink):
+    """Parquet con pyarrow: esquema inferido de los valores y row groups de tamaño acotado."""
+
+    needs_types = True
+
+    def _open(self, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("La exportación a Parquet necesita pyarrow (pip install pyarrow)")
+        self._pa = pa
+        arrow_types = {"number": pa.float64(), "bool": pa.bool_(), "date": pa.timestamp("us")}
+        fields = []
+        for name in columns:
+            kinds = self.types.get(name, set())
+            # Una columna con tipos mezclados (p. ej. ##Fecha mal escrita) se guarda como texto
+            kind = next(iter(kinds)) if len(kinds) == 1 else "str"
+            fields.append(pa.field(name, arrow_types.get(kind, pa.string())))
+        self._schema = pa.schema(fields)
+        self._writer = pq.ParquetWriter(self.part_path, self._schema)
+        self._rows = []
+
+    def _write_row(self, values):
+        row = {}
+        for field, value in zip(self._schema, values):
+            if value is None or value == "":
+                value = None
+            elif field.type == self._pa.string():
+                value = value.isoformat() if isinstance(value, (datetime, date)) else str(value)
+            elif field.type == self._pa.float64():
+                value = float(value)
+            row[field.name] = value
+        self._rows.append(row)
+        if len(self._rows) >= EXPORT_ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def _finish(self):
+        if getattr(self, "_writer", None) is not None:
+            self._flush()
+            self._writer.close()
+            self._writer = None
+
+
+SINKS = {"csv": CsvSink, "xlsx": XlsxSink, "parquet": ParquetSink}
+
+
+def open_sink(fmt, path, columns=None):
+    if fmt not in SINKS:
+        raise ValueError(f"Formato no soportado: {fmt} (opciones: {', '.join(SINKS)})")
+    return SINKS[fmt](path, columns)
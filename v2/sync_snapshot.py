@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from datetime import datetime
+
+# Horas tras las que se vuelven a pedir los detalles aunque el ETag de la tarea no cambie
+# (editar solo la descripción cambia el ETag de los detalles, no el de la tarea)
+SNAPSHOT_MAX_AGE_H = float(os.getenv("PLANNER_SYNC_SNAPSHOT_MAX_AGE_H", "24"))
+
+
+def staleness_note(max_age_h=None):
+    """Aviso para el log y la ayuda: hasta cuándo puede quedar desfasada una etiqueta reutilizada."""
+    max_age_h = SNAPSHOT_MAX_AGE_H if max_age_h is None else max_age_h
+    return (f"editar solo la descripción no cambia el ETag de la tarea: esas etiquetas ##Tag se releen "
+            f"como tarde a las {max_age_h:g} h (PLANNER_SYNC_SNAPSHOT_MAX_AGE_H)")
+
+
+def snapshot_path(workbook_path):
+    """Fichero SQLite junto al libro: Libro.xlsm → Libro.planner-sync.db"""
+    if workbook_path and os.path.dirname(workbook_path):
+        return os.path.splitext(workbook_path)[0] + ".planner-sync.db"
+    # Libro sin guardar: junto a este script
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "planner-sync.db")
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def normalize_cell(value):
+    # Excel devuelve los números como float y las celdas vacías como None
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0).isoformat()
+    return value
+
+
+def row_hash(values):
+    """Hash estable de una fila tal como queda en Excel."""
+    normalized = [normalize_cell(v) for v in values]
+    while normalized and normalized[-1] == "":
+        normalized.pop()
+    return hashlib.sha1(json.dumps(normalized, default=str).encode("utf-8")).hexdigest()
+
+
+def edit_hash(title, status):
+    """Hash de los valores que el modo push sube a Planner (título y estado)."""
+    return row_hash([title, status])
+
+
+class SyncSnapshot:
+    """
+    Estado de la última sincronización por tarea: ETag, etiquetas ##Tag ya parseadas y
+    línea base (título/estado) para detectar ediciones locales.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, etag TEXT, tags TEXT, fetched_at REAL, edit_hash TEXT)"
+        )
+        # Instantáneas creadas antes de guardar la línea base del modo push
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+        if "edit_hash" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN edit_hash TEXT")
+        self.entries = {
+            task_id: {"etag": etag, "tags": {k: decode_value(v) for k, v in json.loads(tags or "{}").items()},
+                      "fetched_at": fetched_at or 0, "edit_hash": edit_hash_}
+            for task_id, etag, tags, fetched_at, edit_hash_ in self.conn.execute(
+                "SELECT task_id, etag, tags, fetched_at, edit_hash FROM tasks")
+        }
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cached_tags(self, task_id, etag):
+        """Etiquetas guardadas si la tarea no cambió desde la última lectura de sus detalles."""
+        entry = self.entries.get(task_id)
+        if not entry or not etag or entry["etag"] != etag:
+            return None
+        if time.time() - entry["fetched_at"] > SNAPSHOT_MAX_AGE_H * 3600:
+            return None
+        return entry["tags"]
+
+    def update(self, task_id, etag, tags=None, fetched_at=None, edit_hash=None):
+        entry = self.entries.setdefault(task_id, {"tags": {}, "fetched_at": 0, "edit_hash": None})
+        entry["etag"] = etag
+        if tags is not None:
+            entry["tags"] = tags
+        if fetched_at is not None:
+            entry["fetched_at"] = fetched_at
+        if edit_hash is not None:
+            entry["edit_hash"] = edit_hash
+
+    def save(self, keep_ids=None):
+        """Persiste en una transacción; keep_ids descarta las tareas que ya no existen."""
+        if keep_ids is not None:
+            for task_id in set(self.entries) - set(keep_ids):
+                del self.entries[task_id]
+        with self.conn:
+            self.conn.execute("DELETE FROM tasks")
+            self.conn.executemany(
+                "INSERT INTO tasks (task_id, etag, tags, fetched_at, edit_hash) VALUES (?, ?, ?, ?, ?)",
+                [(task_id, e["etag"], json.dumps({k: encode_value(v) for k, v in (e["tags"] or {}).items()}),
+                  e["fetched_at"], e["edit_hash"]) for task_id, e in self.entries.items()],
+            )
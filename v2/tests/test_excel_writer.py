@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import excel_writer
+
+
+class FakeRange:
+    def __init__(self, sheet, address):
+        self.sheet = sheet
+        self.address = address
+
+    def clear_contents(self):
+        self.sheet.log.append(("clear", self.address))
+
+    def __setattr__(self, name, value):
+        if name in ("value", "color"):
+            self.sheet.log.append((name, self.address, value))
+        else:
+            object.__setattr__(self, name, value)
+
+
+class FakeSheet:
+    def __init__(self):
+        self.log = []
+
+    def range(self, address):
+        return FakeRange(self, address)
+
+
+def test_col_name():
+    assert [excel_writer.col_name(n) for n in (1, 26, 27, 52, 703)] == ["A", "Z", "AA", "AZ", "AAA"]
+
+
+def test_diff_rows_writes_only_changed_span():
+    plan = excel_writer.WritePlan()
+    current = [["t1", "Plan", "Título", 5.0], ["t2", "Plan", "Otra", None]]
+    target = [["t1", "Plan", "Título", 5], ["t2", "Plan", "Cambiada", 7], ["t3", "Plan", "Nueva"]]
+    assert plan.diff_rows(current, target) == 2
+    # 5.0 en Excel y 5 en Planner son la misma celda: la fila 2 no se toca
+    assert plan.cells == {(3, 3): "Cambiada", (3, 4): 7, (4, 1): "t3", (4, 2): "Plan", (4, 3): "Nueva"}
+
+
+def test_diff_rows_clears_cells_beyond_new_width():
+    plan = excel_writer.WritePlan()
+    assert plan.diff_rows([["t1", "x", "sobra"]], [["t1", "x"]]) == 1
+    assert plan.cells == {(2, 3): ""}
+
+
+def test_blocks_merge_neighbouring_rows_with_same_span():
+    plan = excel_writer.WritePlan()
+    for row in (2, 3, 4):
+        plan.set_row(row, [f"a{row}", f"b{row}"], first_col=2)
+    plan.set(6, 2, "suelta")
+    plan.set(2, 5, "otra")
+    assert sorted(plan.blocks()) == [
+        (2, 2, [["a2", "b2"], ["a3", "b3"], ["a4", "b4"]]),
+        (2, 5, [["otra"]]),
+        (6, 2, [["suelta"]]),
+    ]
+
+
+def test_color_areas_split_at_max_address_len():
+    plan = excel_writer.WritePlan()
+    # Filas alternas: ninguna se une a su vecina y la dirección crece rápido
+    for row in range(2, 400, 2):
+        plan.highlight(row, (255, 0, 0))
+    plan.highlight(401, None)
+    areas = plan.color_areas()
+    red = [address for color, address in areas if color == (255, 0, 0)]
+    assert len(red) > 1
+    assert all(len(address) <= excel_writer.MAX_ADDRESS_LEN for address in red)
+    rows = [int(part.split(":")[0]) for address in red for part in address.split(",")]
+    assert rows == list(range(2, 400, 2))
+    assert (None, "401:401") in areas
+
+
+def test_apply_uses_one_call_per_block_and_color():
+    plan = excel_writer.WritePlan()
+    plan.clear("A10:C20")
+    plan.set_row(2, ["t1", "Plan"])
+    plan.set_row(3, ["t2", "Plan"])
+    plan.highlight(2, (0, 255, 0))
+    plan.highlight(3, (0, 255, 0))
+    sheet = FakeSheet()
+    assert plan.apply(sheet) == 3
+    assert sheet.log == [
+        ("clear", "A10:C20"),
+        ("value", "A2", [["t1", "Plan"], ["t2", "Plan"]]),
+        ("color", "2:3", (0, 255, 0)),
+    ]
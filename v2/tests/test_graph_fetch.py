@@ -0,0 +1,106 @@
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph_fetch
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.headers = headers or {}
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class FakeSession:
+    """Sustituye a requests.Session: responde con `handler(method, url, json)` y anota cada llamada."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.headers = {}
+        self.calls = []
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, json=None, **kwargs):
+        self.calls.append((method, url, json))
+        return self.handler(method, url, json)
+
+    def close(self):
+        pass
+
+
+def _echo_batch(method, url, body):
+    assert url.endswith("/$batch")
+    return FakeResponse(200, {"responses": [
+        {"id": r["id"], "status": 200, "body": {"url": r["url"]}} for r in body["requests"]
+    ]})
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(graph_fetch.time, "sleep", lambda seconds: None)
+
+
+def test_get_many_splits_in_batches_and_keeps_order():
+    session = FakeSession(_echo_batch)
+    paths = [f"/planner/tasks/t{i}/details" for i in range(7)]
+    with graph_fetch.GraphFetcher("tok", workers=2, batch_size=3, session=session) as fetcher:
+        bodies = fetcher.get_many(paths)
+    assert [b["url"] for b in bodies] == paths
+    assert sorted(len(body["requests"]) for _, _, body in session.calls) == [1, 3, 3]
+    assert fetcher.stats["batches"] == 3
+    assert session.headers["Authorization"] == "Bearer tok"
+
+
+def test_batch_retries_only_throttled_subrequests():
+    throttled = {"/planner/tasks/t1/details"}
+    sent = []
+
+    def handler(method, url, body):
+        sent.append([r["url"] for r in body["requests"]])
+        responses = []
+        for r in body["requests"]:
+            if r["url"] in throttled:
+                throttled.discard(r["url"])
+                responses.append({"id": r["id"], "status": 429, "headers": {"Retry-After": "0"}})
+            else:
+                responses.append({"id": r["id"], "status": 200, "body": {"url": r["url"]}})
+        return FakeResponse(200, {"responses": responses})
+
+    paths = [f"/planner/tasks/t{i}/details" for i in range(3)]
+    with graph_fetch.GraphFetcher("tok", workers=1, session=FakeSession(handler)) as fetcher:
+        bodies = fetcher.get_many(paths)
+    assert [b["url"] for b in bodies] == paths
+    assert sent == [paths, ["/planner/tasks/t1/details"]]
+    assert fetcher.stats["retries"] == 1
+
+
+def test_send_retries_whole_request_on_429():
+    replies = [FakeResponse(429, headers={"Retry-After": "0"}), FakeResponse(200, {"value": [{"id": "p1"}]})]
+    session = FakeSession(lambda method, url, body: replies.pop(0))
+    with graph_fetch.GraphFetcher("tok", session=session) as fetcher:
+        data = fetcher.get("/planner/plans")
+    assert data["value"] == [{"id": "p1"}]
+    assert fetcher.stats["requests"] == 2 and fetcher.stats["retries"] == 1
+
+
+def test_get_many_raises_on_failed_subrequest():
+    def handler(method, url, body):
+        return FakeResponse(200, {"responses": [{"id": r["id"], "status": 404, "body": {}} for r in body["requests"]]})
+
+    with graph_fetch.GraphFetcher("tok", session=FakeSession(handler)) as fetcher:
+        with pytest.raises(requests.HTTPError):
+            fetcher.get_many(["/planner/tasks/x/details"])
@@ -0,0 +1,104 @@
+import os
+import csv
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sinks
+
+
+def _task(task_id, **tags):
+    return {"Task ID": task_id, "Plan ID": "p1", "Plan Name": "Plan", "Bucket Name": "B",
+            "Task Title": f"Tarea {task_id}", "Status": "Iniciada", "ETag": "e", **tags}
+
+
+RECORDS = [
+    _task("t1", Dinero=10, Fecha=datetime(2024, 5, 1)),
+    _task("t2", Responsable="Ana"),
+    _task("t3", Dinero=2.5),
+]
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.reader(f))
+
+
+def test_csv_dynamic_columns_known_at_close(tmp_path):
+    path = str(tmp_path / "tareas.csv")
+    with sinks.open_sink("csv", path) as sink:
+        for record in RECORDS:
+            sink.write(record)
+    rows = _read_csv(path)
+    assert rows[0] == ["Task ID", "Plan Name", "Bucket Name", "Task Title", "Status", "ETag",
+                       "Dinero", "Fecha", "Responsable"]
+    assert rows[1][6:] == ["10", "2024-05-01", ""]
+    assert rows[2][6:] == ["", "", "Ana"]
+    assert sink.count == 3
+    assert not os.path.exists(path + ".part")
+
+
+def test_csv_fixed_columns(tmp_path):
+    path = str(tmp_path / "tareas.csv")
+    with sinks.open_sink("csv", path, columns=["Task ID", "Dinero"]) as sink:
+        for record in RECORDS:
+            sink.write(record)
+    assert _read_csv(path) == [["Task ID", "Dinero"], ["t1", "10"], ["t2", ""], ["t3", "2.5"]]
+
+
+def test_parquet_infers_column_types(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    pa = pytest.importorskip("pyarrow")
+    path = str(tmp_path / "tareas.parquet")
+    with sinks.open_sink("parquet", path) as sink:
+        for record in RECORDS + [_task("t4", Fecha="sin fecha")]:
+            sink.write(record)
+    table = pq.read_table(path)
+    assert table.schema.field("Dinero").type == pa.float64()
+    # Fecha mezcla fechas y texto: se guarda como texto
+    assert table.schema.field("Fecha").type == pa.string()
+    data = table.to_pydict()
+    assert data["Dinero"] == [10.0, None, 2.5, None]
+    assert data["Fecha"] == ["2024-05-01T00:00:00", None, None, "sin fecha"]
+    assert data["Task ID"] == ["t1", "t2", "t3", "t4"]
+
+
+def test_parquet_row_groups_are_bounded(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(sinks, "EXPORT_ROW_GROUP", 2)
+    path = str(tmp_path / "tareas.parquet")
+    with sinks.open_sink("parquet", path) as sink:
+        for i in range(5):
+            sink.write(_task(f"t{i}", Dinero=i))
+    assert pq.ParquetFile(path).metadata.num_row_groups == 3
+
+
+@pytest.mark.parametrize("columns", [None, ["Task ID", "Task Title"]])
+def test_abort_keeps_previous_export(tmp_path, columns):
+    path = str(tmp_path / "tareas.csv")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("exportación anterior")
+    with pytest.raises(RuntimeError):
+        with sinks.open_sink("csv", path, columns) as sink:
+            sink.write(RECORDS[0])
+            raise RuntimeError("Graph no responde")
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "exportación anterior"
+    assert not os.path.exists(path + ".part")
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        sinks.open_sink("json", "tareas.json")
+
+
+def test_sink_without_hooks_fails_at_instantiation(tmp_path):
+    class HalfSink(sinks.Sink):
+        def _open(self, columns):
+            pass
+
+    with pytest.raises(TypeError):
+        HalfSink(str(tmp_path / "tareas.out"), columns=["Task ID"])
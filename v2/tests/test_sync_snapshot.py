@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync_snapshot
+
+
+def test_snapshot_path_next_to_workbook():
+    assert sync_snapshot.snapshot_path("/datos/Libro.xlsm") == "/datos/Libro.planner-sync.db"
+
+
+def test_cached_tags_requires_same_etag(tmp_path):
+    path = str(tmp_path / "snap.db")
+    with sync_snapshot.SyncSnapshot(path) as snapshot:
+        snapshot.update("t1", "W/\"1\"", {"Dinero": 10, "Fecha": datetime(2024, 5, 1)}, fetched_at=time.time())
+        snapshot.save()
+
+    with sync_snapshot.SyncSnapshot(path) as snapshot:
+        assert snapshot.cached_tags("t1", "W/\"1\"") == {"Dinero": 10, "Fecha": datetime(2024, 5, 1)}
+        assert snapshot.cached_tags("t1", "W/\"2\"") is None
+        assert snapshot.cached_tags("t1", None) is None
+        assert snapshot.cached_tags("otra", "W/\"1\"") is None
+
+
+def test_cached_tags_expire_after_max_age(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_snapshot, "SNAPSHOT_MAX_AGE_H", 1)
+    with sync_snapshot.SyncSnapshot(str(tmp_path / "snap.db")) as snapshot:
+        snapshot.update("reciente", "e", {"A": 1}, fetched_at=time.time() - 60)
+        snapshot.update("antigua", "e", {"A": 1}, fetched_at=time.time() - 2 * 3600)
+        assert snapshot.cached_tags("reciente", "e") == {"A": 1}
+        assert snapshot.cached_tags("antigua", "e") is None
+
+
+def test_save_prunes_tasks_not_kept(tmp_path):
+    path = str(tmp_path / "snap.db")
+    with sync_snapshot.SyncSnapshot(path) as snapshot:
+        for task_id in ("a", "b", "c"):
+            snapshot.update(task_id, "e", {}, edit_hash=sync_snapshot.edit_hash(task_id, "Iniciada"))
+        snapshot.save(keep_ids=["a", "c"])
+
+    with sync_snapshot.SyncSnapshot(path) as snapshot:
+        assert sorted(snapshot.entries) == ["a", "c"]
+        assert snapshot.entries["c"]["edit_hash"] == sync_snapshot.edit_hash("c", "Iniciada")
+
+
+def test_edit_hash_ignores_excel_number_format():
+    assert sync_snapshot.edit_hash("Tarea", 1.0) == sync_snapshot.edit_hash("Tarea", 1)
+    assert sync_snapshot.edit_hash("Tarea", "Iniciada") != sync_snapshot.edit_hash("Tarea", "Completada")
+
+
+def test_staleness_note_reports_max_age(monkeypatch):
+    monkeypatch.setattr(sync_snapshot, "SNAPSHOT_MAX_AGE_H", 6)
+    assert "6 h" in sync_snapshot.staleness_note()
+    assert "0.5 h" in sync_snapshot.staleness_note(0.5)